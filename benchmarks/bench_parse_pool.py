@@ -0,0 +1,53 @@
+#!/usr/bin/python
+"""Measures the throughput of the parse stage over recorded board and thread
+pages with an increasing number of parser processes, against parsing in the
+scraper thread. Run from the repository's root directory with
+"python -m benchmarks.bench_parse_pool".
+"""
+
+from __future__ import print_function
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import multiprocessing
+import time
+
+from benchmarks.fixtures import load_long_thread
+from chandere.core import create_offsets, parse_pages
+
+
+def benchmark(offsets, pages, workers):
+    """Returns the pages-per-second rate of the parse stage."""
+    html_queue = queue.Queue()
+    for index, page in enumerate(pages):
+        html_queue.put(("http://boards.4chan.org/g/%d" % index, page))
+    parsed = parse_pages(offsets, html_queue, workers)
+    # The first page is left out, so that starting the pool isn't measured.
+    next(parsed)
+    start = time.time()
+    for _ in pages[1:]:
+        next(parsed)
+    elapsed = time.time() - start
+    parsed.close()
+    return (len(pages) - 1) / elapsed
+
+
+def main(count=200):
+    with open("tests/example_page") as page:
+        recorded = page.read()
+    pages = [load_long_thread(recorded)] * count
+    offsets = create_offsets("ar", "4chan")
+    baseline = benchmark(offsets, pages, 0)
+    print("In thread: %.0f pages/s" % baseline)
+    workers = 1
+    while workers <= multiprocessing.cpu_count():
+        rate = benchmark(offsets, pages, workers)
+        print("%d workers: %.0f pages/s (%.2fx)" % (workers, rate,
+                                                   rate / baseline))
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+"""Compares the throughput of the HTML parser backend against the previous
+method of splitting a page with one findall per post type and searching each
+post once per field, over the recorded pages in the tests directory. Run
+from the repository's root directory with "python -m benchmarks.bench_parsers".
+"""
+
+from __future__ import print_function
+
+import timeit
+
+from benchmarks.fixtures import load_long_thread
+from chandere.core import create_offsets
+from chandere.parsers import HTML_FIELDS, parse_html
+
+
+def parse_per_field(offsets, url, page):
+    """The previous parsing method, using the offsets as they are given."""
+    board = offsets["board_initial"].search(page).group()
+    posts = offsets["post_op"].findall(page)
+    if "Return</a>" in page:
+        posts += offsets["post_reply"].findall(page)
+    extracted = []
+    for post in posts:
+        fields = {"post_id": offsets["post_id"].search(post).group()}
+        for offset, field in HTML_FIELDS:
+            match = offsets[offset].search(post) if offset in offsets else None
+            fields[field] = match.group() if match else None
+        extracted.append(fields)
+    return board, extracted
+
+
+def benchmark(parse, offsets, page, repeat=5, number=20):
+    """Returns the best posts-per-second rate of the given parser."""
+    posts = len(parse(offsets, None, page)[1])
+    best = min(timeit.repeat(lambda: parse(offsets, None, page),
+                             repeat=repeat, number=number))
+    return posts, posts * number / best
+
+
+def main():
+    with open("tests/example_page") as page:
+        recorded = page.read()
+    pages = (("thread", recorded), ("long thread", load_long_thread(recorded)))
+    for mode in ("ar", "id"):
+        offsets = create_offsets(mode, "4chan")
+        for name, page in pages:
+            posts, before = benchmark(parse_per_field, offsets, page)
+            posts, after = benchmark(parse_html, offsets, page)
+            print("%s mode, %s (%d posts): %.0f posts/s before, %.0f posts/s "
+                  "after (%.2fx)" % (mode, name, posts, before, after,
+                                     after / before))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Pages the benchmarks are run against. The 4chan pages are built from the
+thread recorded in the tests directory, while the lainchan pages follow the
+markup the lainchan offsets expect, as no lainchan page has been recorded.
+"""
+
+import re
+
+LAINCHAN_OP = (
+    '<div class="thread" id="thread_%(id)d"><div id="op_%(id)d" class="post '
+    'op"><p class="intro"><a id="%(id)d" class="post_anchor"></a><span class'
+    '="subject">Cyberpunk is dead</span> <span class="name">Anonymous</span> '
+    '<time datetime="2016-06-11T05:01:13Z">06/11/16 (Sat) 05:01:13</time>'
+    '</p><div class="files"><div class="file"><p class="fileinfo">File: <a '
+    'href="/cyb/src/14656356%(id)d.png">14656356%(id)d.png</a> (143.89 KB, '
+    '715x1000)</p><a href="/cyb/src/14656356%(id)d.png" target="_blank"><img '
+    'class="post-image" src="/cyb/thumb/14656356%(id)d.png"></a></div></div>'
+    '<div class="body"><p class="body-line ltr ">Long live cyberpunk.</p>'
+    '</div></div>')
+LAINCHAN_REPLY = (
+    '<div id="reply_%(id)d" class="post reply"><p class="intro"><a id="%(id)d"'
+    ' class="post_anchor"></a><span class="name">Anonymous</span> <time '
+    'datetime="2016-06-11T08:39:19Z">06/11/16 (Sat) 08:39:19</time></p>'
+    '<div class="body"><p class="body-line ltr "><a href="/cyb/res/'
+    '%(thread)d.html#%(thread)d">&gt;&gt;%(thread)d</a></p><p class="body-'
+    'line ltr ">No.</p></div></div>')
+LAINCHAN_HEADER = (
+    '<!doctype html><html><head><title>/cyb/ - Cyberpunk</title></head><body>'
+    '<header><h1>/cyb/ - Cyberpunk</h1></header><form name="postcontrols" '
+    'action="/post.php" method="post">')
+LAINCHAN_FOOTER = '</form></body></html>'
+
+
+def fourchan_thread():
+    """Returns the recorded 4chan thread."""
+    with open("tests/example_page") as page:
+        return page.read()
+
+
+def load_long_thread(page, replies=300):
+    """Pads the recorded thread out to the given number of replies by
+    repeating its existing replies, numbered after the last one.
+    """
+    containers = re.findall(r'<div class="postContainer replyContainer".+?'
+                            r'</blockquote></div></div>', page)
+    end = page.index(containers[-1]) + len(containers[-1])
+    padding = ""
+    for index in range(replies - len(containers)):
+        container = containers[index % len(containers)]
+        post_id = re.search(r'(?<=id="pc)\d+', container).group()
+        padding += container.replace(post_id, str(55030000 + index))
+    return page[:end] + padding + page[end:]
+
+
+def fourchan_board(threads=15):
+    """Returns a 4chan board page of the given number of threads, made of
+    the recorded thread with its post numbers shifted for each thread.
+    """
+    page = fourchan_thread()
+    start = page.index('<div class="thread"')
+    end = page.index('</div><hr>', page.rindex('</blockquote></div></div>'))
+    thread = page[start:end + len("</div><hr>")]
+    board = "".join(re.sub(r'550\d{5}',
+                           lambda match: str(int(match.group()) + 10000 * n),
+                           thread) for n in range(threads))
+    return (page[:start] + board + page[end + len("</div><hr>"):]).replace(
+        "Return</a>", "Index</a>")
+
+
+def lainchan_thread(replies=50, thread=26278):
+    """Returns a lainchan thread with the given number of replies."""
+    return (LAINCHAN_HEADER + '[<a href="/cyb/">Return</a>]' +
+            LAINCHAN_OP % {"id": thread} +
+            "".join(LAINCHAN_REPLY % {"id": thread + number, "thread": thread}
+                    for number in range(1, replies + 1)) +
+            "</div>" + LAINCHAN_FOOTER)
+
+
+def lainchan_board(threads=10, replies=5):
+    """Returns a lainchan board page of the given number of threads, each
+    showing its last few replies.
+    """
+    body = ""
+    for number in range(threads):
+        thread = 26278 + 1000 * number
+        body += LAINCHAN_OP % {"id": thread} + "".join(
+            LAINCHAN_REPLY % {"id": thread + reply, "thread": thread}
+            for reply in range(1, replies + 1)) + "</div><hr>"
+    return LAINCHAN_HEADER + body + LAINCHAN_FOOTER
+
+
+PAGES = {"4chan": (("thread", fourchan_thread),
+                   ("long thread", lambda: load_long_thread(fourchan_thread())),
+                   ("board", fourchan_board)),
+         "lainchan": (("thread", lainchan_thread),
+                      ("board", lainchan_board))}
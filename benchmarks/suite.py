@@ -0,0 +1,241 @@
+#!/usr/bin/python
+"""Benchmark suite for Chandere, run offline against the pages in
+benchmarks.fixtures. Results are printed, and can be written as JSON with
+--output and compared against a previous run with --compare. Run from the
+repository's root directory with "python -m benchmarks.suite".
+"""
+
+from __future__ import print_function
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import timeit
+
+from benchmarks.fixtures import (PAGES, fourchan_thread, lainchan_thread,
+                                 load_long_thread)
+import chandere.cache
+import chandere.core
+import chandere.metrics
+import chandere.parsers
+
+CACHE_SIZES = (10000, 100000, 1000000)
+
+
+def best_rate(function, items, repeat=5, number=10):
+    """Returns the best rate at which function handles the given number of
+    items per call.
+    """
+    best = min(timeit.repeat(function, repeat=repeat, number=number))
+    return items * number / best
+
+
+def bench_generate_urls():
+    """Board urls generated per second."""
+    pages = len(list(chandere.core.generate_urls("4chan", "/g/")))
+    yield ("generate_urls", {"chan": "4chan"}, best_rate(
+        lambda: list(chandere.core.generate_urls("4chan", "/g/")), pages,
+        number=1000), "urls/s")
+
+
+def bench_scrape_html():
+    """Posts handled per second by the scraper thread, for every profile and
+    page, with an empty cache.
+    """
+    for chan, pages in sorted(PAGES.items()):
+        for mode in ("ar", "id"):
+            offsets = chandere.core.create_offsets(mode, chan)
+            for name, load in pages:
+                page = load()
+                posts = len(chandere.parsers.parse_html(offsets, None,
+                                                        page)[1])
+
+                def scrape():
+                    html_queue = queue.Queue()
+                    html_queue.put(("http://boards.4chan.org/g/", page))
+                    chandere.core.scrape_html(offsets, mode, chan, html_queue,
+                                              queue.Queue(),
+                                              chandere.cache.Cache(),
+                                              debug=True)
+
+                yield ("scrape_html", {"chan": chan, "mode": mode,
+                                       "page": name, "posts": posts},
+                       best_rate(scrape, posts), "posts/s")
+
+
+def bench_parse_refresh():
+    """Thread refreshes parsed per second, from the start of the page and
+    from the last reply seen before the refresh.
+    """
+    for chan, page in (("4chan", load_long_thread(fourchan_thread())),
+                       ("lainchan", lainchan_thread(300))):
+        offsets = chandere.core.create_offsets("ar", chan)
+        posts = chandere.parsers.parse_html(offsets, None, page)[1]
+        # The refresh finds the last five replies new.
+        after = int(posts[-6]["post_id"])
+        for name, mark in (("full", None), ("incremental", after)):
+            yield ("parse_refresh", {"chan": chan, "parse": name,
+                                     "posts": len(posts)},
+                   best_rate(lambda: chandere.parsers.parse_html(
+                       offsets, None, page, mark), 1), "pages/s")
+
+
+def cache_entries(size):
+    """Generates the given number of cache entries, spread over threads of
+    a hundred posts.
+    """
+    for number in range(size):
+        thread = 50000000 + number // 100 * 100
+        yield ("/g/", str(50000000 + number), "4chan",
+               "http://boards.4chan.org/g/thread/%d" % thread)
+
+
+def bench_cache_lookup(sizes):
+    """Seen-post checks per second, for posts in and not in the cache."""
+    for size in sizes:
+        cache = chandere.cache.Cache(cache_entries(size))
+        hits = [("/g/", str(50000000 + number), "4chan")
+                for number in range(0, size, max(1, size // 1000))]
+        misses = [("/g/", str(40000000 + number), "4chan")
+                  for number in range(len(hits))]
+        for name, keys in (("hit", hits), ("miss", misses)):
+            yield ("cache_lookup", {"entries": size, "lookup": name},
+                   best_rate(lambda: [key in cache for key in keys],
+                             len(keys), number=100), "lookups/s")
+
+
+def bench_cache_log(sizes, directory):
+    """Seconds taken to record entries to a cache log as they are seen and
+    dump it, and to load it back.
+    """
+    for size in sizes:
+        path = os.path.join(directory, "cache_%d" % size)
+        start = time.time()
+        cache = chandere.core.load_cache("ar", path)
+        for entry in cache_entries(size):
+            cache.add(entry)
+        chandere.core.dump_cache("ar", cache, path)
+        yield ("dump_cache", {"entries": size}, time.time() - start, "s")
+        start = time.time()
+        cache = chandere.core.load_cache("ar", path, False)
+        elapsed = time.time() - start
+        assert len(cache) == size
+        yield ("load_cache", {"entries": size}, elapsed, "s")
+        os.remove(path)
+
+
+def bench_write_to_disk(directory, posts=20000):
+    """Posts archived per second by the write thread in every format."""
+    post = ("55021750", None, "Anonymous", "06/11/16(Sat)", "05:01:13",
+            "back.jpg", "", "Best .cbr reader for android?" * 10, "/g/",
+            "4chan")
+    metrics = chandere.metrics.METRICS
+    for archive_format in ("text", "jsonl", "sqlite"):
+        data_queue = queue.Queue()
+        for number in range(posts):
+            data_queue.put((str(55021750 + number), ) + post[1:])
+        archived = metrics.get("chandere_posts_archived_total")
+        start = time.time()
+        # The write thread never returns, so it is left waiting on the
+        # emptied queue once every post has been archived.
+        threading.Thread(target=chandere.core.write_to_disk,
+                         args=("ar", os.path.join(directory, archive_format),
+                               "a+", data_queue),
+                         kwargs={"archive_format": archive_format},
+                         daemon=True).start()
+        while metrics.get("chandere_posts_archived_total") < archived + posts:
+            time.sleep(0.001)
+        yield ("write_to_disk", {"format": archive_format, "posts": posts},
+               posts / (time.time() - start), "posts/s")
+
+
+def run(sizes):
+    """Runs every benchmark, printing and returning the results."""
+    directory = tempfile.mkdtemp(prefix="chandere_bench_")
+    benchmarks = (bench_generate_urls(), bench_scrape_html(),
+                  bench_parse_refresh(), bench_cache_lookup(sizes),
+                  bench_cache_log(sizes, directory),
+                  bench_write_to_disk(directory))
+    results = []
+    try:
+        for benchmark in benchmarks:
+            for name, params, value, unit in benchmark:
+                print("%-14s %-55s %14.3f %s" % (name, describe(params),
+                                                 value, unit))
+                results.append({"name": name, "params": params,
+                                "value": value, "unit": unit})
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def describe(params):
+    return " ".join("%s=%s" % item for item in sorted(params.items()))
+
+
+def revision():
+    """Returns the commit the benchmarks are run on, if it can be found."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"]).decode(
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    """Prints the change of every result from the baseline. Rates should go
+    up and times down, so changes are shown as speedups either way.
+    """
+    previous = dict(((result["name"], describe(result["params"])), result)
+                    for result in baseline["results"])
+    for result in results:
+        before = previous.get((result["name"], describe(result["params"])))
+        if before is None or not before["value"] or not result["value"]:
+            continue
+        speedup = (before["value"] / result["value"] if result["unit"] == "s"
+                   else result["value"] / before["value"])
+        print("%-14s %-55s %6.2fx%s" % (result["name"],
+                                        describe(result["params"]), speedup,
+                                        "  REGRESSION" if speedup < 0.9 else
+                                        ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="Write the results to the given file as JSON.")
+    parser.add_argument("-c", "--compare", metavar="FILE",
+                        help="Compare the results against a previous run.")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+",
+                        default=CACHE_SIZES, metavar="N",
+                        help="Cache sizes to benchmark. Defaults to 10000, "
+                        "100000 and 1000000.")
+    args = parser.parse_args()
+    # Posts without files are warned about in image downloader mode.
+    logging.disable(logging.WARNING)
+    results = run(args.sizes)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"revision": revision(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "time": time.time(),
+                       "results": results}, output, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(json.load(baseline), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Writers for archive mode, each storing the posts taken from the data queue
+in a different format.
+
+Posts are tuples in the form of (post_id, parent_id, name, date, time,
+filename, title, body, board, chan). Fields a post doesn't have are None.
+"""
+
+import io
+import json
+import re
+import sqlite3
+
+FIELDS = ("post_id", "parent_id", "name", "date", "time", "filename", "title",
+          "body", "board", "chan")
+
+
+class TextWriter(object):
+    """Writes posts as human-readable text, separated by banners."""
+
+    extension = "txt"
+
+    def __init__(self, output, write_mode="a+"):
+        self._file = io.open(output, write_mode, encoding="utf-8")
+
+    def write(self, post):
+        post_id, parent_id, name, date, time, filename, title, body = post[:8]
+        title = "[No Title]" if title is None else title
+        title = re.sub(r'<.*>', "", title) + "\n" if title else ""
+        body = body or "[Empty Post]"
+        body = re.sub(r'<.*>', "", body)
+        body = re.sub(r'&#039;', "'", body)
+        body = re.sub(r'&quot;', "\"", body)
+        body = re.sub(r'&amp;', "&", body)
+        self._file.write(
+            u"\n********************\n%s"
+            "Post ID: %s\nFile: %s\n%s"
+            "%s posted this on %s at %s\n"
+            "%s\n********************" % (
+                title, post_id, filename or "[No File]", "Reply to: %s\n" %
+                parent_id if parent_id else "", name, date, time, body))
+
+    def commit(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JSONLinesWriter(object):
+    """Writes each post as a JSON object on its own line, so the archive can
+    be read incrementally by other tools.
+    """
+
+    extension = "jsonl"
+
+    def __init__(self, output, write_mode="a+"):
+        self._file = io.open(output, "a", encoding="utf-8", newline="\n")
+
+    def write(self, post):
+        self._file.write(json.dumps(dict(zip(FIELDS, post)),
+                                    ensure_ascii=False) + u"\n")
+
+    def commit(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class SQLiteWriter(object):
+    """Stores posts in an SQLite database, one row per post. Posts already in
+    the database are replaced, and rows are committed in batches.
+    """
+
+    extension = "db"
+
+    def __init__(self, output, write_mode="a+"):
+        self._connection = sqlite3.connect(output)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS posts (post_id TEXT NOT NULL, "
+            "parent_id TEXT, name TEXT, date TEXT, time TEXT, filename TEXT, "
+            "title TEXT, body TEXT, board TEXT NOT NULL, chan TEXT NOT NULL, "
+            "archived REAL DEFAULT (julianday('now')), "
+            "PRIMARY KEY (chan, board, post_id))")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS posts_by_parent ON posts (chan, "
+            "board, parent_id)")
+        self._connection.commit()
+
+    def write(self, post):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO posts (%s) VALUES (%s)" %
+            (", ".join(FIELDS), ", ".join("?" * len(FIELDS))), post)
+
+    def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+WRITERS = {"text": TextWriter, "jsonl": JSONLinesWriter,
+           "sqlite": SQLiteWriter}
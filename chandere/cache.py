@@ -0,0 +1,261 @@
+"""Cache of posts and pages that have already been handled by Chandere,
+shared between the connection and scraper threads, and the append-only log
+it is persisted to between runs.
+"""
+
+from collections import Counter
+import io
+import os
+import pickle
+import threading
+
+# Logs are compacted when they hold at least this many records, of which
+# more than half no longer describe a live entry.
+COMPACTION_THRESHOLD = 10000
+
+
+class Cache(object):
+    """Thread-safe store of cache entries, each a tuple in the form of
+    (board, post_id, chan, url). Entries are indexed both by their
+    (board, post_id, chan) key and by their url, so membership tests and
+    removals don't have to scan the whole cache.
+
+    If a CacheLog is given, every post added to or removed from the cache is
+    recorded in it as it happens. Entries without a post_id, which point to
+    board pages, are regenerated on every run and never recorded. Posts
+    still being written are added pending a token, and only recorded once
+    the token is confirmed, so that a run stopped before then handles them
+    again.
+    """
+
+    def __init__(self, entries=(), log=None):
+        self._lock = threading.RLock()
+        # Dictionaries keep their insertion order as of Python 3.7, the
+        # oldest version Chandere runs on, which the cache relies on.
+        self._entries = dict.fromkeys(tuple(entry) for entry in entries)
+        self._keys = dict(Counter(entry[:3] for entry in self._entries))
+        self._urls = {}
+        for entry in self._entries:
+            if entry[3] in self._urls:
+                self._urls[entry[3]].add(entry)
+            else:
+                self._urls[entry[3]] = set((entry, ))
+        self.log = log
+        self._pending = {}
+        self._unconfirmed = set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self):
+        """Iterates over a snapshot of the entries in insertion order, so the
+        cache may be modified by other threads while being iterated over.
+        """
+        with self._lock:
+            entries = list(self._entries)
+        return iter(entries)
+
+    def __contains__(self, key):
+        """Tests for a (board, post_id, chan) key in the cache."""
+        with self._lock:
+            return tuple(key[:3]) in self._keys
+
+    def add(self, entry, pending=None):
+        """Adds an entry to the cache. Returns False if it was already
+        present. If a pending token is given, the entry is only recorded in
+        the log once the token is confirmed.
+        """
+        entry = tuple(entry)
+        with self._lock:
+            if entry in self._entries:
+                return False
+            self._entries[entry] = None
+            key = entry[:3]
+            self._keys[key] = self._keys.get(key, 0) + 1
+            self._urls.setdefault(entry[3], set()).add(entry)
+            if self.log is not None and entry[1] is not None:
+                if pending is None:
+                    self.log.append("+", entry)
+                else:
+                    self._pending.setdefault(pending, []).append(entry)
+                    self._unconfirmed.add(entry)
+            return True
+
+    def confirm(self, token):
+        """Records the entries added pending the given token in the log, now
+        that their posts have been written.
+        """
+        with self._lock:
+            for entry in self._pending.pop(token, ()):
+                if entry in self._unconfirmed:
+                    self._unconfirmed.discard(entry)
+                    self.log.append("+", entry)
+
+    def unconfirmed(self):
+        """Returns the number of entries still waiting to be confirmed."""
+        with self._lock:
+            return len(self._unconfirmed)
+
+    def discard(self, entry):
+        """Removes a single entry from the cache, if present."""
+        entry = tuple(entry)
+        with self._lock:
+            if entry not in self._entries:
+                return False
+            del self._entries[entry]
+            key = entry[:3]
+            self._keys[key] -= 1
+            if not self._keys[key]:
+                del self._keys[key]
+            self._urls[entry[3]].discard(entry)
+            if not self._urls[entry[3]]:
+                del self._urls[entry[3]]
+            if entry in self._unconfirmed:
+                # The entry never reached the log.
+                self._unconfirmed.discard(entry)
+            elif self.log is not None and entry[1] is not None:
+                self.log.append("-", entry)
+            return True
+
+    def remove_url(self, url):
+        """Removes every entry pointing to the given url. Returns the number
+        of entries removed.
+        """
+        with self._lock:
+            entries = list(self._urls.get(url, ()))
+            for entry in entries:
+                self.discard(entry)
+            return len(entries)
+
+    def sync(self):
+        """Forces every entry recorded in the log so far onto the disk."""
+        with self._lock:
+            if self.log is not None:
+                self.log.sync()
+
+    def urls(self):
+        """Returns the urls of every entry, without duplicates, in the order
+        they were first added.
+        """
+        seen = set()
+        urls = []
+        for entry in self:
+            if entry[3] not in seen:
+                seen.add(entry[3])
+                urls.append(entry[3])
+        return urls
+
+
+class CacheLog(object):
+    """Append-only log of the entries added to and removed from the caches of
+    every mode. Each line is a record in the form of
+    "+|-<TAB>mode<TAB>board<TAB>post_id<TAB>chan<TAB>url". Records are handed
+    to the operating system as soon as they are written, so entries survive
+    the process being killed, and a record torn by a crash is discarded the
+    next time the log is opened.
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self._file = None
+
+    def open(self):
+        """Replays the log, compacting it if most of its records are dead,
+        and opens it for appending. Returns the live entries of the log's
+        mode.
+        """
+        records, read, length = read_log(self.path)
+        if length is not None and (os.path.getsize(self.path) != length or
+                                   (read >= COMPACTION_THRESHOLD and
+                                    read > 2 * len(records))):
+            write_log(self.path, records)
+        self._file = io.open(self.path, "a", buffering=1, encoding="utf-8",
+                             newline="\n")
+        return [entry for mode, entry in records if mode == self.mode]
+
+    def append(self, operation, entry):
+        """Records an entry being added ("+") or removed ("-")."""
+        if self._file is not None:
+            self._file.write(format_record(operation, self.mode, entry))
+
+    def sync(self):
+        """Flushes the log and forces it onto the disk."""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Syncs and closes the log. Nothing more is recorded afterwards."""
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+def format_record(operation, mode, entry):
+    """Formats a single line of a cache log."""
+    board, post_id, chan, url = entry
+    return u"\t".join((operation, mode, board, post_id or "", chan,
+                       url)) + u"\n"
+
+
+def read_log(path):
+    """Replays a cache log. Returns a dictionary of the live records, keyed
+    by (mode, entry) in the order they were added, along with the number of
+    complete records read and the length of the log up to the end of its last
+    complete record. The length is None if the log doesn't exist.
+
+    Caches dumped with pickle by older versions of Chandere are read as well,
+    and are rewritten as a log when the log is opened.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records, 0, None
+    with open(path, "rb") as log:
+        data = log.read()
+    if data[:1] == b"\x80":
+        return read_pickle(data), 0, 0
+    length = data.rfind(b"\n") + 1
+    lines = data[:length].decode("utf-8").split("\n")[:-1]
+    for read, line in enumerate(lines):
+        fields = line.split("\t")
+        if len(fields) != 6 or fields[0] not in ("+", "-"):
+            # Everything from the first malformed record onwards is dropped.
+            length = len(u"".join(line + u"\n" for line in lines[:read])
+                         .encode("utf-8"))
+            break
+        key = (fields[1], (fields[2], fields[3] or None, fields[4],
+                           fields[5]))
+        if fields[0] == "+":
+            records[key] = None
+        else:
+            records.pop(key, None)
+    else:
+        read = len(lines)
+    return records, read, length
+
+
+def read_pickle(data):
+    """Reads a cache dumped with pickle, a list of entries preceded by the
+    mode it was dumped in.
+    """
+    records = {}
+    try:
+        dumped = pickle.loads(data)
+    except (pickle.PickleError, EOFError):
+        return records
+    for entry in dumped[1:]:
+        records[(dumped[0], tuple(entry))] = None
+    return records
+
+
+def write_log(path, records):
+    """Atomically replaces a log with one holding only the given records."""
+    with io.open(path + ".tmp", "w", encoding="utf-8", newline="\n") as log:
+        for mode, entry in records:
+            log.write(format_record("+", mode, entry))
+        log.flush()
+        os.fsync(log.fileno())
+    os.replace(path + ".tmp", path)
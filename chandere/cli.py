@@ -6,6 +6,7 @@ from __future__ import print_function
 
 import chandere.formatters
 import chandere.core
+import chandere.profiler
 
 import argparse
 import os.path
@@ -35,7 +36,8 @@ def parse_arguments():
     parser = argparse.ArgumentParser(
         add_help=False,
         formatter_class=CustomHelp,
-        usage="%(prog)s (BOARD)[/THREAD] [-c CHAN] [-o OUTPUT] [OPTIONS]",
+        usage="%(prog)s [CHAN:](BOARD)[/THREAD] [-c CHAN] [-o OUTPUT] "
+        "[OPTIONS]",
         description="Generalized scraper for Futaba-styled imageboards, such "
         "as 4chan.\nCapable of downloading images and archiving entire boards.")
     docs = parser.add_argument_group("Documentation")
@@ -75,7 +77,10 @@ def parse_arguments():
         help="Combination of a board and optionally a thread to\nscrape from. "
         "(E.g.\"/g/51971506\"). If a thread is not\ngiven, Chandere will "
         "attempt to scrape the entire board.\nSeveral board/thread "
-        "combinations can be given.")
+        "combinations can be given, and\neach can be prefixed with an "
+        "imageboard to scrape it\nfrom instead of the one given with -c. "
+        "(E.g.\n\"lainchan:/cyb/\"). Imageboards are scraped from at "
+        "once.")
     scraper_opts.add_argument(
         "-m",
         "--mode",
@@ -96,9 +101,43 @@ def parse_arguments():
         default=os.path.join(
             os.path.expanduser("~"), ".chandere"),
         metavar="DIR",
-        help="Specifies a path at which the cache should be dumped, if\n"
-        "cache dumping is enabled. Defaults to \".chandere\" in the\n"
-        "running user's home directory.")
+        help="Specifies a path at which the cache should be kept, if\n"
+        "cache dumping is enabled. Entries are written as they\nare seen, "
+        "and caches for each mode share the file.\nDefaults to "
+        "\".chandere\" in the running user's home\ndirectory.")
+    scraper_opts.add_argument(
+        "-af",
+        "--archive-format",
+        default="text",
+        choices=["text", "jsonl", "sqlite"],
+        help="Applicable only in archive mode. Designates the format\nposts "
+        "should be archived in. \"jsonl\" writes one JSON\nobject per line "
+        "and \"sqlite\" one row per post, both\nkeeping the board and "
+        "imageboard of every post.\nDefault is \"text\".")
+    scraper_opts.add_argument(
+        "-mi",
+        "--media-index",
+        default=os.path.join(
+            os.path.expanduser("~"), ".chandere_media"),
+        metavar="FILE",
+        help="Applicable only in image downloader mode. Specifies a\npath "
+        "at which the digests of downloaded files should be\nkept. Files "
+        "already downloaded are linked rather than\ndownloaded again. "
+        "Defaults to \".chandere_media\" in the\nrunning user's home "
+        "directory.")
+    scraper_opts.add_argument(
+        "-sf",
+        "--stats-file",
+        metavar="FILE",
+        help="Specifies a path at which Chandere should keep its\nmetrics, "
+        "rewritten every 10 seconds in the Prometheus\ntext format.")
+    scraper_opts.add_argument(
+        "-mp",
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="Specifies a local port on which Chandere should serve\nits "
+        "metrics over HTTP, in the Prometheus text format.")
     scraper_opts.add_argument(
         "-q",
         "--quiet",
@@ -125,12 +164,112 @@ def parse_arguments():
         dest="dump",
         help="A cache of threads already seen will be used, but\nnot dumped "
         "to a file for future use.")
+    scraper_opts.add_argument(
+        "-ci",
+        "--checkpoint-interval",
+        default=chandere.core.CHECKPOINT_INTERVAL,
+        type=int,
+        metavar="XX",
+        help="Specify the time in seconds after which the cache\nshould be "
+        "forced onto the disk. It is also forced\nonto the disk on SIGHUP. "
+        "Default is 60.")
+    scraper_opts.add_argument(
+        "-cp",
+        "--checkpoint-posts",
+        default=chandere.core.CHECKPOINT_POSTS,
+        type=int,
+        metavar="XX",
+        help="Specify the number of new posts after which the cache\nshould "
+        "be forced onto the disk, or 0 to only do so\nperiodically. Default "
+        "is 1000.")
+    scraper_opts.add_argument(
+        "-sd",
+        "--shutdown-deadline",
+        default=chandere.core.SHUTDOWN_DEADLINE,
+        type=int,
+        metavar="XX",
+        help="Specify the time in seconds Chandere should take on\nSIGINT or "
+        "SIGTERM to finish scraping the pages and\nwriting the posts it "
+        "holds before quitting.\nDefault is 30.")
     scraper_opts.add_argument(
         "-nv",
         "--no-video",
         action="store_true",
         help="Applicable only in image downloader mode. Chandere\nwill ignore "
-        ".webm files.")
+        "videos, such as .webm files.")
+    scraper_opts.add_argument(
+        "-ft",
+        "--file-types",
+        nargs="+",
+        default=(),
+        metavar="TYPE",
+        help="Applicable only in image downloader mode. Only files\nof the "
+        "given extensions or MIME types (E.g. \"png\"\nor \"image/*\") "
+        "will be downloaded.")
+    scraper_opts.add_argument(
+        "-ms",
+        "--min-size",
+        type=int,
+        metavar="KB",
+        help="Applicable only in image downloader mode. Files\nsmaller than "
+        "the given size in kilobytes will be\nignored.")
+    scraper_opts.add_argument(
+        "-xs",
+        "--max-size",
+        type=int,
+        metavar="KB",
+        help="Applicable only in image downloader mode. Files\nlarger than "
+        "the given size in kilobytes will be\nignored.")
+    scraper_opts.add_argument(
+        "-md",
+        "--min-dimensions",
+        type=chandere.formatters.parse_dimensions,
+        metavar="WxH",
+        help="Applicable only in image downloader mode. Files\nnarrower or "
+        "shorter than the given dimensions\n(E.g. \"800x600\") will be "
+        "ignored.")
+    scraper_opts.add_argument(
+        "-xd",
+        "--max-dimensions",
+        type=chandere.formatters.parse_dimensions,
+        metavar="WxH",
+        help="Applicable only in image downloader mode. Files wider\nor "
+        "taller than the given dimensions will be ignored.")
+    scraper_opts.add_argument(
+        "-b",
+        "--backend",
+        choices=["html", "json"],
+        help="Designates how Chandere should read the imageboard.\n\"json\" "
+        "uses the read-only API published by 4chan and\nlainchan, while "
+        "\"html\" scrapes their pages. Defaults\nto \"json\" for "
+        "imageboards with a known API.")
+    scraper_opts.add_argument(
+        "-pw",
+        "--parse-workers",
+        default=0,
+        type=int,
+        metavar="XX",
+        help="Specify the number of processes Chandere should parse\npages "
+        "in, to make use of several cores. By default,\npages are parsed in "
+        "the scraper thread.")
+    scraper_opts.add_argument(
+        "-ip",
+        "--index-pages",
+        action="store_true",
+        help="Applicable only to the \"json\" backend. Chandere will\nsweep "
+        "boards through their index pages rather than\ntheir catalog, which "
+        "otherwise lets it download only\nthe threads that have changed.")
+    scraper_opts.add_argument(
+        "-pp",
+        "--profile-patterns",
+        nargs="?",
+        const=chandere.profiler.BUDGET,
+        type=float,
+        metavar="SECONDS",
+        help="Time every offset on each page, warning of any that\ntakes "
+        "longer than the given number of seconds on a\npage, 0.1 by default. "
+        "The slowest offsets are\nreported every minute and on exit. Only "
+        "the HTML\nbackend extracts posts with offsets.")
     connection_opts = parser.add_argument_group("Connection Options")
     connection_opts.add_argument(
         "-c",
@@ -147,9 +286,59 @@ def parse_arguments():
         default=300,
         type=int,
         metavar="XX",
-        help="Specify the time in seconds Chandere should wait before\n"
-        "refreshing a thread. This is ignored when scraping an\nentire "
-        "board. Default is 300.")
+        help="Specify the time in seconds Chandere should initially\nwait "
+        "before refreshing a page. Pages are then refreshed\nmore or less "
+        "often depending on how many new posts\nthey have. Default is 300.")
+    connection_opts.add_argument(
+        "-mr",
+        "--max-refresh",
+        default=3600,
+        type=int,
+        metavar="XX",
+        help="Specify the longest time in seconds Chandere should\nwait "
+        "before refreshing a page without new posts.\nDefault is 3600.")
+    connection_opts.add_argument(
+        "-cn",
+        "--connections",
+        default=8,
+        type=int,
+        metavar="XX",
+        help="Specify the maximum number of pages Chandere should\n"
+        "download at once. Default is 8.")
+    connection_opts.add_argument(
+        "-hl",
+        "--host-limit",
+        default=4,
+        type=int,
+        metavar="XX",
+        help="Specify the maximum number of connections Chandere\nshould "
+        "open to a single host at once. Fewer are opened\nwhile the host is "
+        "slow or refusing requests.\nDefault is 4.")
+    connection_opts.add_argument(
+        "-dw",
+        "--download-workers",
+        default=4,
+        type=int,
+        metavar="XX",
+        help="Applicable only in image downloader mode. Specify the\nnumber "
+        "of files Chandere should download at once.\nDefault is 4.")
+    connection_opts.add_argument(
+        "-qs",
+        "--queue-size",
+        default=100,
+        type=int,
+        metavar="XX",
+        help="Specify the maximum number of urls, pages or posts\nChandere "
+        "should hold between stages at once. Fetching\npauses while the "
+        "scraper or writer catch up.\nDefault is 100.")
+    connection_opts.add_argument(
+        "-qm",
+        "--queue-memory",
+        default=64,
+        type=int,
+        metavar="MB",
+        help="Specify the maximum size in megabytes of the pages\nChandere "
+        "should hold while they wait to be scraped.\nDefault is 64.")
     connection_opts.add_argument(
         "-fs",
         "--force-ssl",
@@ -157,18 +346,47 @@ def parse_arguments():
         help="Forces connections to use https. Be warned that urllib\ndoes "
         "not attempt to verify the SSL certificate of the\nserver it is "
         "communicating with.")
+    connection_opts.add_argument(
+        "-rc",
+        "--record",
+        metavar="DIR",
+        help="Record every page Chandere downloads to the given\n"
+        "directory, so that it can be replayed later.")
+    connection_opts.add_argument(
+        "-rp",
+        "--replay",
+        metavar="DIR",
+        help="Scrape the pages recorded to the given directory\ninstead "
+        "of downloading them, then quit.")
     return parser.parse_args()
 
 
+def kilobytes(size):
+    """Converts an optional size in kilobytes to bytes."""
+    return None if size is None else size * 1024
+
+
 def main():
     """Entry point to the main module."""
     args = parse_arguments()
-    combinations = chandere.formatters.separate_board_thread(args.board_thread)
-    output, write_mode = chandere.formatters.parse_path(args.output, args.mode)
+    combinations = chandere.formatters.separate_targets(args.board_thread,
+                                                        args.chan)
+    output, write_mode = chandere.formatters.parse_path(args.output, args.mode,
+                                                        args.archive_format)
     refresh_rate = int(args.refresh)
     if len(combinations) < 1:
         exit(1)
     chandere.core.main(args.mode, args.chan, combinations, refresh_rate,
                        args.force_ssl, args.dump_file, args.no_video, output,
                        write_mode, args.bottomfeed, args.dump, args.force,
-                       args.verbose)
+                       args.verbose, args.connections, args.host_limit,
+                       args.download_workers, args.backend,
+                       args.media_index, args.archive_format,
+                       args.max_refresh, args.queue_size, args.queue_memory,
+                       args.parse_workers, args.metrics_port,
+                       args.stats_file, args.index_pages, args.file_types,
+                       kilobytes(args.min_size), kilobytes(args.max_size),
+                       args.min_dimensions, args.max_dimensions,
+                       args.record, args.replay, args.profile_patterns,
+                       args.checkpoint_interval, args.checkpoint_posts,
+                       args.shutdown_deadline)
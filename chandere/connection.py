@@ -0,0 +1,407 @@
+"""Connection handling for Chandere, shared by the threads that talk to the
+imageboard being scraped from.
+"""
+
+try:
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import unquote, urljoin, urlparse
+    from urllib.request import getproxies, proxy_bypass
+except ImportError:
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib import getproxies, proxy_bypass, unquote
+    from urllib2 import HTTPError, URLError
+    from urlparse import urljoin, urlparse
+import base64
+import logging
+import random
+import threading
+import time
+import zlib
+
+import chandere.metrics
+
+# Failed requests are retried up to MAX_RETRIES times, after a delay doubling
+# from BACKOFF_BASE seconds with every attempt, up to BACKOFF_CAP seconds.
+MAX_RETRIES = 5
+BACKOFF_BASE = 2
+BACKOFF_CAP = 300
+# A host whose responses take this many times longer than they used to is
+# considered overloaded.
+SLOWDOWN = 3
+# Weight given to every new response time in a host's average.
+LATENCY_WEIGHT = 0.2
+# Idle connections kept open to each host for later requests.
+MAX_IDLE = 8
+# Redirects followed before a request is given up on.
+MAX_REDIRECTS = 10
+
+
+class HostLimiter(object):
+    """Caps the number of connections open to any single host at once.
+    Calling the limiter with a url returns a semaphore to be held for the
+    duration of the connection.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def __call__(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(
+                    self.limit)
+            return self._semaphores[host]
+
+
+class AdaptiveLimiter(object):
+    """Adapts the number of connections open to each host to how the host
+    responds, up to the given limit. A host starts with a single connection,
+    gains one for every round of healthy responses, and has its connections
+    halved whenever it refuses a request or its responses slow down. Hosts
+    refusing requests are also left alone for a growing, jittered delay.
+    """
+
+    def __init__(self, limit, slowdown=SLOWDOWN):
+        self.limit = max(1, limit)
+        self.slowdown = slowdown
+        self._condition = threading.Condition()
+        self._hosts = {}
+
+    def acquire(self, url, timeout=None):
+        """Waits until a connection may be opened to the host of the given
+        url. Returns False if none could be within the given timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            host = self._host(url)
+            while True:
+                now = time.time()
+                if host["resume"] <= now and host["active"] < int(
+                        host["window"]):
+                    host["active"] += 1
+                    return True
+                wait = host["resume"] - now if host["resume"] > now else None
+                if deadline is not None:
+                    if deadline <= now:
+                        return False
+                    wait = deadline - now if wait is None else min(
+                        wait, deadline - now)
+                self._condition.wait(wait)
+
+    def release(self, url, latency=None, refused=False):
+        """Frees a connection to the host of the given url, adjusting the
+        host's connections from the time it took to respond, or cutting them
+        if it refused the request. Connections that failed without a response
+        leave them as they are.
+        """
+        with self._condition:
+            host = self._host(url)
+            host["active"] -= 1
+            now = time.time()
+            if refused:
+                host["refusals"] += 1
+                self._decrease(url, host, now)
+                host["resume"] = now + backoff(host["refusals"] - 1)
+            elif latency is not None:
+                host["refusals"] = 0
+                if host["latency"] is None:
+                    host["latency"] = host["baseline"] = latency
+                host["latency"] += (latency - host["latency"]) * (
+                    LATENCY_WEIGHT)
+                # The baseline follows the average down at once, but only
+                # slowly up, so that a lasting change is eventually accepted.
+                host["baseline"] = min(host["latency"], host["baseline"] + (
+                    host["latency"] - host["baseline"]) * LATENCY_WEIGHT / 10)
+                if host["latency"] > self.slowdown * host["baseline"]:
+                    self._decrease(url, host, now)
+                else:
+                    host["window"] = min(self.limit,
+                                         host["window"] + 1 / host["window"])
+            self._condition.notify_all()
+
+    def window(self, url):
+        """Returns the number of connections currently allowed to the host of
+        the given url.
+        """
+        with self._condition:
+            return int(self._host(url)["window"])
+
+    def _host(self, url):
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = {"window": 1.0, "active": 0, "latency": None,
+                                 "baseline": None, "refusals": 0,
+                                 "resume": 0, "decreased": 0}
+        return self._hosts[host]
+
+    def _decrease(self, url, host, now):
+        # Responses to requests sent before the last cut still reflect the
+        # old number of connections, so connections are cut at most once
+        # per response time.
+        if now - host["decreased"] < (host["latency"] or 0):
+            return
+        host["decreased"] = now
+        host["window"] = max(1.0, host["window"] / 2)
+        logging.warning("Slowing down requests to %s (%d connections)." %
+                        (urlparse(url).netloc, host["window"]))
+
+
+def backoff(attempt):
+    """Returns the delay in seconds before the given retry of a failed
+    request, doubling with every attempt. Half of the delay is random, so that
+    requests that failed together are not retried together.
+    """
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+class Validators(object):
+    """Remembers the ETag and Last-Modified headers last received for each
+    url, so that unchanged pages can be requested conditionally and skipped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._validators = {}
+
+    def headers(self, url):
+        """Returns the conditional request headers for the given url."""
+        with self._lock:
+            etag, last_modified = self._validators.get(url, (None, None))
+        headers = {}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def update(self, url, headers):
+        """Stores the validators sent along with a response."""
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        with self._lock:
+            if etag is None and last_modified is None:
+                self._validators.pop(url, None)
+            else:
+                self._validators[url] = (etag, last_modified)
+
+    def forget(self, url):
+        """Discards the validators stored for the given url."""
+        with self._lock:
+            self._validators.pop(url, None)
+
+
+class HTTPClient(object):
+    """HTTP client keeping connections to every host open between requests,
+    so that pages and files from the same host don't each pay for a new
+    connection and TLS handshake. Responses are compressed in transit when
+    asked for, and decompressed as they are read.
+
+    Requests go through the proxies given by scheme, by default those of the
+    environment's http_proxy and https_proxy, except for hosts no_proxy
+    exempts. Proxies are spoken to in plain HTTP, and https urls are
+    tunnelled through them.
+    """
+
+    def __init__(self, timeout=60, max_idle=MAX_IDLE, proxies=None):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.proxies = getproxies() if proxies is None else proxies
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def open(self, url, headers=None, method="GET", compressed=False,
+             timeout=None):
+        """Requests a url, following redirects, and returns the Response.
+        Raises HTTPError for responses other than 2xx, as urlopen does, and
+        URLError if the server couldn't be reached.
+        """
+        headers = dict(headers or {})
+        if compressed:
+            headers["Accept-Encoding"] = "gzip, deflate"
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request(url, headers, method, timeout)
+            location = response.headers.get("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                response.close()
+                url = urljoin(url, location)
+                if response.status == 303 and method != "HEAD":
+                    method = "GET"
+                continue
+            if not 200 <= response.status < 300:
+                response.read()
+                response.close()
+                raise HTTPError(url, response.status, response.reason,
+                                response.headers, None)
+            return response
+        raise URLError("Too many redirects")
+
+    def close(self):
+        """Closes every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _request(self, url, headers, method, timeout):
+        parts = urlparse(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        proxy = self._proxy(parts)
+        if proxy is not None and parts.scheme != "https":
+            # Plain requests are sent to the proxy with the whole url.
+            path = parts.scheme + "://" + parts.netloc + path
+            headers = dict(headers, **proxy[1])
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                connection = idle.pop() if idle else None
+            reused = connection is not None
+            if not reused:
+                connection = (HTTPSConnection if parts.scheme == "https" else
+                              HTTPConnection)(parts.netloc if proxy is None
+                                              else proxy[0])
+                if proxy is not None and parts.scheme == "https":
+                    connection.set_tunnel(parts.netloc, headers=proxy[1])
+                chandere.metrics.METRICS.count(
+                    "chandere_connections_opened_total")
+            connection.timeout = timeout or self.timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(connection.timeout)
+            try:
+                connection.request(method, path, headers=headers)
+                return Response(self, key, connection,
+                                connection.getresponse(), url)
+            except (IOError, HTTPException) as error:
+                connection.close()
+                # The server may have closed an idle connection in the
+                # meantime, in which case a new one is tried.
+                if not reused:
+                    raise URLError(error)
+
+    def _proxy(self, parts):
+        """Returns the host of the proxy a url is requested through, along
+        with the headers the proxy is sent, or None if there is none.
+        """
+        proxy = self.proxies.get(parts.scheme)
+        if not proxy or proxy_bypass(parts.hostname or ""):
+            return None
+        proxy = urlparse(proxy if "://" in proxy else "http://" + proxy)
+        headers = {}
+        if proxy.username is not None:
+            credentials = "%s:%s" % (unquote(proxy.username),
+                                     unquote(proxy.password or ""))
+            headers["Proxy-Authorization"] = "Basic " + base64.b64encode(
+                credentials.encode("utf-8")).decode("ascii")
+        return proxy.hostname + (":%d" % proxy.port if proxy.port else
+                                 ""), headers
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+
+class Response(object):
+    """Response of an HTTPClient, read like the response of urlopen. The body
+    is decompressed as it is read, and the connection is handed back to the
+    client once the body has been read to its end.
+    """
+
+    def __init__(self, client, key, connection, response, url):
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self._client = client
+        self._key = key
+        self._connection = connection
+        self._response = response
+        encoding = (self.headers.get("Content-Encoding") or "").lower()
+        if encoding in ("gzip", "x-gzip"):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._decoder = zlib.decompressobj()
+        else:
+            self._decoder = None
+        self._started = False
+
+    def getcode(self):
+        return self.status
+
+    def read(self, amt=None):
+        """Reads and decompresses up to amt bytes of the body, or all of it.
+        Less or more than amt bytes may be returned when decompressing, but
+        nothing is returned only at the end of the body.
+        """
+        while True:
+            raw = self._response.read(amt) if amt else self._response.read()
+            data = raw if self._decoder is None else self._decompress(raw)
+            if not raw or not amt:
+                if self._decoder is not None:
+                    data += self._decompress(None)
+                self._finish()
+                return data
+            if data:
+                return data
+
+    def close(self):
+        """Closes the response, and its connection if the body is unread."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _decompress(self, raw):
+        """Decompresses a chunk of the body, or flushes the decoder if raw is
+        None. Raises IOError if the body is corrupt, like any other failed
+        read.
+        """
+        try:
+            if raw is None:
+                return self._decoder.flush()
+            try:
+                data = self._decoder.decompress(raw)
+            except zlib.error:
+                # Some servers send raw deflate data without its zlib
+                # header, which shows from the very first bytes.
+                if self._started:
+                    raise
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = self._decoder.decompress(raw)
+        except zlib.error as error:
+            self.close()
+            raise IOError("Could not decompress \"%s\": %s" % (self.url,
+                                                                error))
+        self._started = True
+        return data
+
+    def _finish(self):
+        if self._connection is None:
+            return
+        if self._response.will_close:
+            self._connection.close()
+        else:
+            self._client._release(self._key, self._connection)
+        self._connection = None
+
+
+# Client shared by the threads downloading pages and files.
+CLIENT = HTTPClient()
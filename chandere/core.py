@@ -4,21 +4,65 @@ imageboard.
 
 try:
     import queue
-    from urllib.request import urlopen, urlretrieve
-    from urllib.error import HTTPError
+    from http.client import HTTPException
+    from urllib.error import HTTPError, URLError
 except ImportError:
     import Queue as queue
-    from urllib import urlopen, urlretrieve
-from contextlib import closing
+    from httplib import HTTPException
+    from urllib2 import HTTPError, URLError
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import collections
 import re
 import os
-import pickle
+import errno
+import hashlib
+import json
+import signal
 import threading
 import logging
 import time
 
+import chandere.archive
+import chandere.cache
+import chandere.connection
+import chandere.media
+import chandere.metrics
+import chandere.parsers
+import chandere.pipeline
+import chandere.profiler
+import chandere.profiles
+import chandere.scheduler
+import chandere.store
+
 AVAILABLE_MODES = ["tc", "id", "ar"]
-KNOWN_CHANS = {"4chan": "boards.4chan.org", "lainchan": "lainchan.org"}
+KNOWN_CHANS = chandere.profiles.PROFILES.hosts()
+# Seconds between checks of the cache for pages the scheduler does not know.
+SYNC_INTERVAL = 10
+# Seconds the control loop waits for a page to become due before it checks
+# whether anything else is.
+POLL_INTERVAL = 1
+# Seconds between reports of the depth of the pipeline's queues.
+QUEUE_REPORT_INTERVAL = 60
+# Seconds and new posts after which the cache is forced onto the disk, and
+# seconds the pipeline is given to drain when quitting.
+CHECKPOINT_INTERVAL = 60
+CHECKPOINT_POSTS = 1000
+SHUTDOWN_DEADLINE = 30
+# Size in bytes of the chunks files are downloaded in.
+CHUNK_SIZE = 64 * 1024
+# Errors raised by the parser backends on pages they can't make sense of.
+PARSE_ERRORS = (ValueError, KeyError, AttributeError)
+# Paths claimed by the download threads of this run, as opposed to empty
+# placeholders left by an interrupted run, and those of the placeholders
+# claimed again, whose parts may be stale.
+_claimed = set()
+_reclaimed = set()
+_claimed_lock = threading.Lock()
+# Seconds a file download may stall before it is resumed.
+DOWNLOAD_TIMEOUT = 60
+# Imageboards which publish their threads and pages through a read-only JSON
+# API, usable with the "json" parser backend.
+API_CHANS = chandere.profiles.PROFILES.apis()
 
 
 def generate_urls(chan,
@@ -55,371 +99,1009 @@ def generate_urls(chan,
                 yield base_url + page_delimiter + str(page)
 
 
-def get_url_content(url_queue, html_queue, cache, debug=False):
-    """Thread to handle connections to the imageboard being scraped from."""
+def fetch_page(url, html_queue, cache, validators=None, scheduler=None,
+               store=None):
+    """Downloads a single page and passes it on to the scraper, removing it
+    from the cache if it no longer exists. If validators are given, the page
+    is requested conditionally and skipped entirely when it has not changed
+    since it was last downloaded, and if a page store is given, the page is
+    recorded to it. Returns how the request went, as one of "loaded",
+    "unchanged", "missing", "refused", "failed" or "error", along with the
+    seconds the server took to respond, or None if it didn't. Refused and
+    failed requests are worth retrying later.
+    """
+    headers = validators.headers(url) if validators is not None else {}
+    metrics = chandere.metrics.METRICS
+    start = time.time()
+    latency = None
+    try:
+        with chandere.connection.CLIENT.open(url, headers,
+                                             compressed=True) as page:
+            latency = time.time() - start
+            raw_html = page.read()
+            if validators is not None:
+                validators.update(url, page.headers)
+        metrics.observe("chandere_fetch_seconds", time.time() - start)
+        metrics.count("chandere_pages_fetched_total")
+        metrics.count("chandere_fetched_bytes_total", len(raw_html))
+        if store is not None:
+            store.record(url, page.headers, raw_html)
+        return load_page(url, raw_html, html_queue, cache, validators,
+                         scheduler), latency
+    except HTTPError as httpstatus:
+        latency = time.time() - start
+        metrics.observe("chandere_fetch_seconds", latency)
+        if httpstatus.code == 304:
+            metrics.count("chandere_pages_unchanged_total")
+            logging.info("Page, \"%s\", has not changed." % url)
+            if scheduler is not None:
+                scheduler.update(url, 0)
+            return "unchanged", latency
+        elif httpstatus.code == 404:
+            logging.critical("Inexistent page \"%s\"." % url)
+            forget_url(cache, url, validators, scheduler)
+            return "missing", latency
+        elif httpstatus.code in (403, 429) or httpstatus.code >= 500:
+            metrics.count("chandere_fetch_refused_total")
+            if httpstatus.code == 403:
+                logging.critical("Servers are blocking web scrapers.")
+            else:
+                logging.error("Could not load \"%s\": %s." % (url,
+                                                              httpstatus))
+            return "refused", latency
+        metrics.count("chandere_fetch_errors_total")
+        logging.error("Could not load \"%s\": %s." % (url, httpstatus))
+        return "error", latency
+    except (URLError, IOError, HTTPException) as error:
+        metrics.count("chandere_fetch_errors_total")
+        logging.error("Could not load \"%s\": %s." % (url, error))
+        return "failed", None
+
+
+def load_page(url, raw_html, html_queue, cache, validators=None,
+              scheduler=None):
+    """Passes a downloaded page on to the scraper, unless it is an error
+    page. Returns "loaded", or "missing" or "refused" for error pages.
+    """
+    raw_html = raw_html.decode()
+    page_title = re.search(r"(?<=<title>).+?(?=</title>)", raw_html)
+    page_title = page_title.group() if page_title else ""
+    if "404" in page_title:
+        logging.critical("Inexistent page \"%s\"." % url)
+        forget_url(cache, url, validators, scheduler)
+        return "missing"
+    elif "access denied" in page_title.lower():
+        chandere.metrics.METRICS.count("chandere_fetch_refused_total")
+        logging.critical("Servers are blocking web scrapers.")
+        return "refused"
+    html_queue.put((url, raw_html))
+    logging.info("Page, \"%s\", loaded." % (page_title or url))
+    return "loaded"
+
+
+def replay_page(url, html_queue, cache, store, scheduler=None):
+    """Passes every version of a page recorded in a page store on to the
+    scraper, oldest first, in place of downloading it. Returns how the last
+    one went, as fetch_page does, or "error" if the page was never recorded.
+    """
+    versions = store.versions(url)
+    if not versions:
+        logging.error("Page \"%s\" was never recorded." % url)
+        return "error"
+    for timestamp, headers, body in versions:
+        outcome = load_page(url, body, html_queue, cache, None, scheduler)
+    chandere.metrics.METRICS.count("chandere_pages_replayed_total",
+                                   len(versions))
+    return outcome
+
+
+def generate_api_urls(chan, board, thread=None, ssl=False, bottomfeed=False,
+                      max_page=None, catalog=False):
+    """Generator equivalent to generate_urls, yielding the urls of the JSON
+    documents an imageboard's API serves for a board or thread instead. If
+    catalog is True, the board's catalog is yielded in place of its pages.
+    """
+    api = API_CHANS[chan]
+    prefix = "https://" if ssl else "http://"
+    base_url = prefix + api["api_host"] + board
+    max_page = api["max_page"] if max_page is None else max_page
+    if thread:
+        yield base_url + api["thread_delimiter"] + thread + ".json"
+    elif catalog:
+        yield base_url + api["catalog_page"]
+    else:
+        pages = range(api["first_page"], api["first_page"] + max_page)
+        for page in pages if not bottomfeed else reversed(pages):
+            yield base_url + str(page) + ".json"
+
+
+def get_url_content(url_queue, html_queue, cache, debug=False, connections=8,
+                    host_limit=4, validators=None, scheduler=None,
+                    retries=chandere.connection.MAX_RETRIES, store=None,
+                    replay=False):
+    """Thread to handle connections to the imageboard being scraped from.
+    Up to the given number of pages are downloaded at once, with no more than
+    host_limit of them from the same host, and fewer while the host is slow
+    or refusing requests. Refused and failed pages are queued again after a
+    growing delay, up to the given number of retries. Pages are requested
+    conditionally on every refresh after the first. Downloaded pages are
+    recorded to the given page store, or, when replaying, read from it
+    instead of being downloaded, each only the first time it is asked for.
+    """
     logging.info("Starting...")
-    while True:
-        url = url_queue.get()
+    limiter = chandere.connection.AdaptiveLimiter(host_limit)
+    in_flight = threading.BoundedSemaphore(connections)
+    if validators is None:
+        validators = chandere.connection.Validators()
+    attempts = {}
+    attempts_lock = threading.Lock()
+    replayed = set()
+
+    def fetch(url):
         try:
-            with closing(urlopen(url)) as page:
-                raw_html = page.read().decode()
-            page_title = re.search(r"(?<=<title>).+?(?=</title>)",
-                                   raw_html).group()
-            if "404" in page_title:
-                logging.critical("Inexistent page \"%s\"." % url)
-                # The following is repeated four times. Should be refactored.
-                if url in [post[3] for post in cache]:
-                    for index, post in enumerate(cache):
-                        if post[3] == url:
-                            logging.warning("Removing url from cache.")
-                            del cache[index]
-            elif "access denied" in page_title.lower():
-                logging.critical("Servers are blocking web scrapers.")
-                if url in [post[3] for post in cache]:
-                    for index, post in enumerate(cache):
-                        if post[3] == url:
-                            logging.warning("Removing url from cache.")
-                            del cache[index]
+            outcome = replay_url(url) if replay else fetch_url(url)
+        finally:
+            in_flight.release()
+            url_queue.task_done()
+        with attempts_lock:
+            if replay or outcome not in ("refused", "failed"):
+                attempts.pop(url, None)
+                return
+            attempt = attempts.get(url, 0)
+            if attempt >= retries:
+                attempts.pop(url, None)
+                logging.error("Giving up on \"%s\" after %d retries." %
+                              (url, attempt))
+                return
+            attempts[url] = attempt + 1
+        delay = chandere.connection.backoff(attempt)
+        chandere.metrics.METRICS.count("chandere_fetch_retries_total")
+        logging.warning("Retrying \"%s\" in %.1f seconds." % (url, delay))
+        timer = threading.Timer(delay, url_queue.put, (url, ))
+        timer.daemon = True
+        timer.start()
+
+    def fetch_url(url):
+        outcome = latency = None
+        limiter.acquire(url)
+        try:
+            outcome, latency = fetch_page(url, html_queue, cache, validators,
+                                          scheduler, store)
+        finally:
+            limiter.release(url, latency, outcome == "refused")
+        return outcome
+
+    def replay_url(url):
+        with attempts_lock:
+            if url in replayed:
+                if scheduler is not None:
+                    scheduler.update(url, 0)
+                return "unchanged"
+            replayed.add(url)
+        return replay_page(url, html_queue, cache, store, scheduler)
+
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        while True:
+            url = url_queue.get()
+            in_flight.acquire()
+            future = executor.submit(fetch, url)
+            if debug:
+                future.result()
+                break
+
+
+def sweep(urls, html_queue, cache, connections=8, host_limit=4):
+    """Downloads every given url concurrently, returning once all of them
+    have been handled.
+    """
+    limiter = chandere.connection.HostLimiter(host_limit)
+
+    def fetch(url):
+        with limiter(url):
+            fetch_page(url, html_queue, cache)
+
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        for future in [executor.submit(fetch, url) for url in urls]:
+            future.result()
+
+
+def forget_url(cache, url, validators=None, scheduler=None):
+    """Removes every cache entry pointing to the given url, and stops
+    polling it.
+    """
+    if validators is not None:
+        validators.forget(url)
+    if scheduler is not None:
+        scheduler.retire(url)
+    if cache.remove_url(url):
+        logging.warning("Removing url from cache.")
+
+
+def scrape_html(offsets, mode, chan, html_queue, data_queue, cache, ssl=False,
+                thread_delimiter="thread/", debug=False, scheduler=None,
+                parse_workers=0, media_filter=None, profiler=None,
+                catalogs=None):
+    """Thread for extracting posts from downloaded pages. If a scheduler is
+    given, it is told how many new posts each page had, and archived threads
+    are retired from it. In image downloader mode, files the media filter
+    turns down are never queued. Given a pattern profiler, the offsets'
+    patterns are timed on every page. Catalogs read are compared with the
+    given Catalogs, which may be shared between imageboards.
+    """
+    logging.info("Starting...")
+    catalogs = Catalogs() if catalogs is None else catalogs
+    # The id of the last reply seen in each thread, so that refreshes only
+    # parse what comes after it.
+    watermarks = Watermarks()
+    for url, board, posts in parse_pages(offsets, html_queue, parse_workers,
+                                         watermarks, profiler):
+        try:
+            if chandere.parsers.select_parser(offsets, url) is (
+                    chandere.parsers.parse_catalog):
+                changed = handle_catalog(url, board, posts, offsets, chan,
+                                         catalogs, scheduler, ssl)
+                if scheduler is not None:
+                    scheduler.update(url, changed)
             else:
-                html_queue.put(raw_html)
-                logging.info("Page, \"%s\", loaded." % page_title)
-        except HTTPError as httpstatus:
-            if str(httpstatus) == "HTTP Error 404: Not Found":
-                logging.critical("Inexistent page \"%s\"." % url)
-                if url in [post[3] for post in cache]:
-                    for index, post in enumerate(cache):
-                        if post[3] == url:
-                            logging.warning("Removing url from cache.")
-                            del cache[index]
-            elif str(httpstatus) == "HTTP Error 403: Forbidden":
-                logging.critical("Servers are blocking web scrapers.")
-                if url in [post[3] for post in cache]:
-                    for index, post in enumerate(cache):
-                        if post[3] == url:
-                            logging.warning("Removing url from cache.")
-                            del cache[index]
+                scrape_page(url, board, posts, offsets, mode, chan,
+                            data_queue, cache, ssl, thread_delimiter,
+                            scheduler, media_filter, watermarks)
+                catalogs.scraped(url)
+        finally:
+            # Pages are only done with once scraped, for those waiting on
+            # the html queue to drain.
+            html_queue.task_done()
         if debug:
             break
 
 
-def scrape_html(offsets, mode, chan, html_queue, data_queue, cache, ssl=False,
-                thread_delimiter="thread/", debug=False):
-    logging.info("Starting...")
-    while True:
-        html = html_queue.get()
-        board = re.search(offsets["board_initial"], html).group()
-        thread_mode = bool(re.search(r'Return</a>', html))
-        for post in re.findall(offsets["post_op"], html):
-            post_id = re.search(offsets["post_id"], post).group()
-            if (board, post_id, chan) in [item[:3] for item in cache]:
-                logging.info("Parent post %s has already been handled." %
-                             post_id)
+def scrape_page(url, board, posts, offsets, mode, chan, data_queue, cache,
+                ssl=False, thread_delimiter="thread/", scheduler=None,
+                media_filter=None, watermarks=None):
+    """Handles every post of a board or thread page, and tells the scheduler
+    how many were new.
+    """
+    chandere.metrics.METRICS.count("chandere_posts_parsed_total", len(posts))
+    new_posts = 0
+    for post in posts:
+        new_posts += handle_post(post, board, offsets, mode, chan, data_queue,
+                                 cache, ssl, thread_delimiter, media_filter)
+    if watermarks is not None:
+        watermarks.update(url, posts)
+    if scheduler is not None:
+        threads = [post for post in posts if post["parent_id"] is None]
+        if len(threads) == 1 and threads[0]["archived"]:
+            logging.info("Thread %s has been archived." %
+                         threads[0]["post_id"])
+            scheduler.retire(url)
+        else:
+            scheduler.update(url, new_posts)
+
+
+def parse_pages(offsets, html_queue, workers=0, watermarks=None,
+                profiler=None):
+    """Generator yielding the url, board and posts of every page taken from
+    the html queue, in the order they were queued. Given a number of workers,
+    pages are parsed in a pool of as many processes, with up to two pages
+    per worker queued at once. Given watermarks, replies up to the last one
+    seen in a thread are skipped. Given a pattern profiler, the offsets'
+    patterns are timed on every page as well. Pages that can't be parsed are
+    logged and skipped.
+    """
+    if watermarks is None:
+        watermarks = {}
+    metrics = chandere.metrics.METRICS
+    if workers < 1:
+        while True:
+            url, page = html_queue.get()
+            start = time.time()
+            try:
+                board, posts = chandere.parsers.select_parser(offsets, url)(
+                    offsets, url, page, watermarks.get(url))
+            except PARSE_ERRORS as error:
+                skip_page(html_queue, url, error)
                 continue
-            elif mode == "id":
-                try:
-                    url = offsets["link_prefix"] + re.search(
-                        offsets["image_link"], post).group()
-                    filename = re.search(offsets["file_name"], post).group()
-                    logging.info("New parent post %s has been found!" %
-                                 post_id)
-                    data_queue.put((url, filename))
-                except AttributeError:
-                    logging.warning("Post %s was not handled properly." %
-                                    post_id)
-            elif mode == "ar":
+            metrics.observe("chandere_parse_seconds", time.time() - start)
+            if profiler is not None:
+                profiler.profile(offsets, url, page)
+            yield url, board, posts
+    with ProcessPoolExecutor(workers, initializer=chandere.parsers.init_worker,
+                             initargs=(offsets,
+                                       profiler is not None)) as executor:
+        pending = collections.deque()
+        while True:
+            # More pages are only waited for when none are being parsed.
+            while len(pending) < workers * 2:
                 try:
-                    name = re.search(offsets["poster_name"], post).group()
-                    date = re.search(offsets["pub_date"], post).group()
-                    time = re.search(offsets["pub_time"], post).group()
-                    try:
-                        filename = re.search(offsets["file_name"],
-                                             post).group()
-                    except AttributeError:
-                        filename = "[No File]"
-                    try:
-                        title = re.search(offsets["post_title"], post).group()
-                    except AttributeError:
-                        title = "[No Title]"
-                    try:
-                        body = re.search(offsets["post_body"], post).group()
-                    except AttributeError:
-                        body = "[Empty Post]"
-                    logging.info("New parent post %s has been found!" %
-                                 post_id)
-                    data_queue.put((post_id, None, name, date, time, filename,
-                                    title, body))
-                except AttributeError:
-                    logging.warning("Post %s was not handled properly." %
-                                    post_id)
-            cache.append(
-                (board, post_id, chan,
-                 next(generate_urls(chan,
-                                    board,
-                                    post_id,
-                                    ssl,
-                                    thread_delimiter=thread_delimiter))))
-        if thread_mode:
-            for post in re.findall(offsets["post_reply"], html):
-                parent_id = post_id
-                post_id = re.search(offsets["post_id"], post).group()
-                if (board, post_id, chan) in [item[:3] for item in cache]:
-                    logging.info("Child post %s has already been handled." %
-                                 post_id)
-                    continue
-                elif mode == "id":
-                    try:
-                        url = offsets["link_prefix"] + re.search(
-                            offsets["image_link"], post).group()
-                        filename = re.search(offsets["file_name"],
-                                             post).group()
-                        logging.info("New child post %s has been found!" %
-                                     post_id)
-                        data_queue.put((url, filename))
-                    except AttributeError:
-                        logging.warning("Post %s was not handled properly." %
-                                        post_id)
-                elif mode == "ar":
-                    try:
-                        name = re.search(offsets["poster_name"], post).group()
-                        date = re.search(offsets["pub_date"], post).group()
-                        time = re.search(offsets["pub_time"], post).group()
-                        try:
-                            filename = re.search(offsets["file_name"],
-                                                 post).group()
-                        except AttributeError:
-                            filename = "[No File]"
-                        try:
-                            title = re.search(offsets["post_title"],
-                                              post).group()
-                        except AttributeError:
-                            title = "[No Title]"
-                        try:
-                            body = re.search(offsets["post_body"],
-                                             post).group()
-                        except AttributeError:
-                            body = "[Empty Post]"
-                        logging.info("New child post %s has been found!" %
-                                     post_id)
-                        data_queue.put((post_id, parent_id, name, date, time,
-                                        filename, title, body))
-                    except AttributeError:
-                        logging.warning("Post %s was not handled properly." %
-                                        post_id)
-                cache.append(
-                    (board, post_id, chan,
-                     next(generate_urls(chan,
-                                        board,
-                                        post_id,
-                                        ssl,
-                                        thread_delimiter=thread_delimiter))))
+                    url, page = html_queue.get(block=not pending)
+                except queue.Empty:
+                    break
+                pending.append((url, len(page), executor.submit(
+                    chandere.parsers.parse_page, url, page,
+                    watermarks.get(url))))
+            url, size, parsed = pending.popleft()
+            try:
+                board, posts, elapsed, timings = parsed.result()
+            except PARSE_ERRORS as error:
+                skip_page(html_queue, url, error)
+                continue
+            metrics.observe("chandere_parse_seconds", elapsed)
+            if profiler is not None:
+                profiler.record(url, size, timings)
+            yield url, board, posts
+
+
+def skip_page(html_queue, url, error):
+    """Gives up on a page that couldn't be parsed, such as an error page
+    served in place of a thread, and marks it done with.
+    """
+    chandere.metrics.METRICS.count("chandere_parse_errors_total")
+    logging.error("Could not parse \"%s\": %r." % (url, error))
+    html_queue.task_done()
+
+
+class Watermarks(object):
+    """Ids of the last reply seen in each thread this run, by url. Marks are
+    not taken from the cache, as posts that were not written by an earlier
+    run are missing from it while later ones are not, so the first refresh
+    of every thread is parsed in full and left to the cache to sort out.
+    """
+
+    def __init__(self):
+        self._marks = {}
+
+    def get(self, url):
+        return self._marks.get(url)
+
+    def update(self, url, posts):
+        """Raises the mark of a page to its last reply. Pages without
+        replies, such as board pages, are left without one.
+        """
+        replies = [int(post["post_id"]) for post in posts
+                   if post["parent_id"] is not None and
+                   post["post_id"].isdigit()]
+        if replies:
+            self._marks[url] = max(replies + [self._marks.get(url) or 0])
+
+
+class Catalogs(dict):
+    """State of the threads listed in every catalog read, by the catalog's
+    url, as (last_modified, replies) tuples by thread id. If a path is
+    given, the state is read from it and dumped back to it as JSON, so that
+    threads left alone since the last run aren't downloaded again. Threads
+    that have changed but not been scraped yet, having been dropped or
+    failed, count as changed the next time their catalog is read, and are
+    left out of the dump.
+    """
+
+    def __init__(self, path=None):
+        dict.__init__(self)
+        self.path = path
+        self._lock = threading.Lock()
+        self._unscraped = {}
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path) as state:
+                for url, threads in json.load(state).items():
+                    self[url] = dict((thread, tuple(listed))
+                                     for thread, listed in threads.items())
+        except (IOError, OSError, ValueError, AttributeError) as error:
+            logging.warning("Could not read catalog state: %s." % error)
+
+    def listed(self, thread_url, url, thread):
+        """Notes that a thread listed in a catalog has yet to be scraped."""
+        with self._lock:
+            self._unscraped[thread_url] = (url, thread)
+
+    def unscraped(self, url):
+        """Returns the ids of the threads listed in a catalog that have yet
+        to be scraped.
+        """
+        with self._lock:
+            return set(thread for listed, thread in self._unscraped.values()
+                       if listed == url)
+
+    def prune(self, url, threads):
+        """Stops waiting for threads of a catalog that it no longer lists."""
+        with self._lock:
+            for thread_url, (listed, thread) in list(
+                    self._unscraped.items()):
+                if listed == url and thread not in threads:
+                    del self._unscraped[thread_url]
+
+    def scraped(self, thread_url):
+        """Notes that a thread has been scraped since it was listed."""
+        with self._lock:
+            self._unscraped.pop(thread_url, None)
+
+    def dump(self):
+        """Atomically writes the state of every thread scraped since it was
+        last listed to the path.
+        """
+        if self.path is None or not self and not os.path.exists(self.path):
+            return
+        with self._lock:
+            state = dict((url, dict(threads))
+                         for url, threads in list(self.items()))
+            for url, thread in self._unscraped.values():
+                state.get(url, {}).pop(thread, None)
+        with open(self.path + ".tmp", "w") as dumped:
+            json.dump(state, dumped)
+            dumped.flush()
+            os.fsync(dumped.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+
+def handle_catalog(url, board, threads, offsets, chan, catalogs,
+                   scheduler=None, ssl=False):
+    """Compares the threads listed in a board's catalog with those listed
+    the last time it was read, kept in catalogs, and schedules a single poll
+    of each thread that has changed since, or that has not been scraped
+    since it last changed. Returns the number of changed threads.
+    """
+    previous = catalogs.get(url, {})
+    unscraped = catalogs.unscraped(url)
+    current = {}
+    changed = 0
+    for thread in threads:
+        state = (thread["last_modified"], thread["replies"])
+        current[thread["post_id"]] = state
+        if previous.get(thread["post_id"]) != state or (
+                thread["post_id"] in unscraped):
+            changed += 1
+            if scheduler is not None:
+                listed = thread_url(offsets, chan, board, thread["post_id"],
+                                    ssl)
+                catalogs.listed(listed, url, thread["post_id"])
+                scheduler.add(listed, once=True)
+    # Threads no longer in the catalog are forgotten along with the rest.
+    catalogs.prune(url, current)
+    catalogs[url] = current
+    logging.info("%d of %d threads in the catalog of %s have changed." %
+                 (changed, len(threads), board))
+    return changed
+
+
+def handle_post(post, board, offsets, mode, chan, data_queue, cache,
+                ssl=False, thread_delimiter="thread/", media_filter=None):
+    """Passes a newly found post on to the write thread and caches it, unless
+    its file is turned down by the media filter in image downloader mode.
+    Posts passed on are cached pending their file's url or their key, which
+    the write thread confirms once they are written. Returns whether the post
+    had not been seen before.
+    """
+    post_id, parent_id = post["post_id"], post["parent_id"]
+    kind = "Child" if parent_id else "Parent"
+    item = pending = None
+    if (board, post_id, chan) in cache:
+        chandere.metrics.METRICS.count("chandere_cache_hits_total")
+        logging.info("%s post %s has already been handled." %
+                     (kind, post_id))
+        return False
+    elif mode == "id":
+        if post["file_url"] is not None and post["filename"] is not None:
+            logging.info("New %s post %s has been found!" %
+                         (kind.lower(), post_id))
+            if media_filter is None or media_filter.accepts(
+                    post["filename"], post["file_size"], post["dimensions"]):
+                item = (post["file_url"], post["filename"], post["md5"],
+                        post["file_size"])
+                pending = post["file_url"]
+            else:
+                chandere.metrics.METRICS.count("chandere_files_filtered_total")
+                logging.info("File %s was filtered out." % post["filename"])
+        else:
+            logging.warning("Post %s was not handled properly." % post_id)
+    elif mode == "ar":
+        if None not in (post["name"], post["date"], post["time"]):
+            logging.info("New %s post %s has been found!" %
+                         (kind.lower(), post_id))
+            item = (post_id, parent_id, post["name"], post["date"],
+                    post["time"], post["filename"], post["title"],
+                    post["body"], board, chan)
+            pending = (board, post_id, chan)
+        else:
+            logging.warning("Post %s was not handled properly." % post_id)
+    # Posts are cached under the url of the thread they belong to, so that
+    # they are forgotten along with it. They are cached before being queued,
+    # so that they can't be confirmed before they are pending.
+    cache.add((board, post_id, chan,
+               thread_url(offsets, chan, board, parent_id or post_id, ssl,
+                          thread_delimiter)), pending)
+    if item is not None:
+        data_queue.put(item)
+    chandere.metrics.METRICS.count("chandere_posts_new_total")
+    return True
+
+
+def thread_url(offsets, chan, board, thread, ssl=False,
+               thread_delimiter="thread/"):
+    """Returns the url of a thread, in the form used by the offsets' backend.
+    """
+    if offsets.get("backend") == "json":
+        return next(generate_api_urls(chan, board, thread, ssl))
+    return next(generate_urls(chan, board, thread, ssl,
+                              thread_delimiter=thread_delimiter))
+
+
+def claim_filename(output, filename):
+    """Reserves a free filename in the output directory by creating an empty
+    file there, prefixing "(copy)" to the filename until one is free. This is
+    atomic, so several download threads can never claim the same name. Empty
+    files not claimed by this run are placeholders left by an interrupted
+    one, and are claimed again rather than written around.
+    """
+    while True:
+        path = os.path.join(output, filename)
+        with _claimed_lock:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                _claimed.add(path)
+                return path
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+                if path not in _claimed and os.path.getsize(path) == 0:
+                    _claimed.add(path)
+                    _reclaimed.add(path)
+                    return path
+        filename = "(copy)" + filename
+
+
+def release_filename(path):
+    """Forgets a filename claimed by this run, once the file has been
+    written or removed.
+    """
+    with _claimed_lock:
+        _claimed.discard(path)
+        _reclaimed.discard(path)
+
+
+def download_file(url, filename, output, md5=None, media=None, size=None,
+                  media_filter=None):
+    """Downloads a single file into the output directory. If a media index is
+    given, files whose digest is already known are linked to the existing
+    copy instead, either before downloading them when the imageboard
+    publishes their digest, or afterwards. If the media filter needs a size
+    the imageboard didn't publish, it is asked of the server first. Returns
+    whether the file was handled, including by being filtered out, rather
+    than failing to download.
+    """
+    metrics = chandere.metrics.METRICS
+    if media_filter is not None and media_filter.needs_size(size):
+        try:
+            size, mime = file_headers(url)
+        except (URLError, IOError, HTTPException) as error:
+            logging.warning("Could not look up \"%s\": %s." % (url, error))
+        else:
+            if not media_filter.accepts(filename, size, mime=mime):
+                metrics.count("chandere_files_filtered_total")
+                logging.info("File %s was filtered out." % filename)
+                return True
+    if media is not None and md5 is not None:
+        existing = media.claim(md5)
+        if existing is not None:
+            path = claim_filename(output, filename)
+            chandere.media.link_file(existing, path)
+            release_filename(path)
+            metrics.count("chandere_files_linked_total")
+            logging.info("File %s is a duplicate of \"%s\", linked." %
+                         (os.path.basename(path), existing))
+            return True
+    try:
+        path = claim_filename(output, filename)
+        start = time.time()
+        try:
+            stream_file(url, path)
+        except (URLError, IOError, HTTPException) as error:
+            metrics.count("chandere_download_errors_total")
+            logging.error("Could not download \"%s\": %s." % (url, error))
+            os.remove(path)
+            release_filename(path)
+            return False
+        release_filename(path)
+        size = os.path.getsize(path)
+        elapsed = max(time.time() - start, 0.001)
+        metrics.observe("chandere_download_seconds", elapsed)
+        metrics.count("chandere_files_downloaded_total")
+        metrics.count("chandere_downloaded_bytes_total", size)
+        size /= 1024.0
+        logging.info("File %s successfully downloaded! (%.1f KiB at %.1f "
+                     "KiB/s)" % (os.path.basename(path), size, size / elapsed))
+        if media is not None:
+            digest = chandere.media.file_md5(path)
+            if md5 is not None and digest != md5:
+                logging.warning("File %s does not match its published "
+                                "digest." % os.path.basename(path))
+            existing = media.lookup(digest)
+            if existing is not None and existing != os.path.abspath(path):
+                chandere.media.link_file(existing, path)
+                metrics.count("chandere_files_linked_total")
+                logging.info("File %s is a duplicate of \"%s\", linked." %
+                             (os.path.basename(path), existing))
+            else:
+                media.record(digest, path)
+        return True
+    finally:
+        if media is not None and md5 is not None:
+            media.release(md5)
+
+
+def file_headers(url):
+    """Returns the size and MIME type of a file as given by a HEAD request,
+    either being None if the server didn't say.
+    """
+    with chandere.connection.CLIENT.open(
+            url, method="HEAD", timeout=DOWNLOAD_TIMEOUT) as response:
+        length = response.headers.get("Content-Length")
+        return (int(length) if length is not None else None,
+                response.headers.get("Content-Type"))
+
+
+def stream_file(url, path, retries=chandere.connection.MAX_RETRIES):
+    """Downloads a file in chunks to a ".part" file next to the given path,
+    named after the file's url, which replaces the path once the whole file
+    has arrived. Interrupted downloads are resumed from where they stopped
+    with a Range request, after a growing delay, up to the given number of
+    retries. A part left by an earlier run is resumed the same way. If the
+    path is a placeholder left by an earlier run, the parts it left there for
+    other files are removed. Returns the size of the file, or raises the last
+    error once out of retries.
+    """
+    metrics = chandere.metrics.METRICS
+    part = "%s.%s.part" % (path, hashlib.md5(url.encode("utf-8")).hexdigest(
+    )[:8])
+    with _claimed_lock:
+        reclaimed = path in _reclaimed
+        _reclaimed.discard(path)
+    if reclaimed:
+        directory, name = os.path.split(path)
+        stale = re.compile(re.escape(name) + r'\.[0-9a-f]{8}\.part$')
+        for filename in os.listdir(directory or "."):
+            if stale.match(filename) and (
+                    os.path.join(directory, filename) != part):
+                os.remove(os.path.join(directory, filename))
+    if os.path.exists(part):
+        logging.info("Resuming download of \"%s\" from %d bytes." %
+                     (url, os.path.getsize(part)))
+    else:
+        open(part, "wb").close()
+    attempt = 0
+    while True:
+        offset = os.path.getsize(part)
+        headers = {"Range": "bytes=%d-" % offset} if offset else {}
+        try:
+            with chandere.connection.CLIENT.open(
+                    url, headers, timeout=DOWNLOAD_TIMEOUT) as response:
+                # Servers ignoring the Range header send the whole file again.
+                resumed = offset and response.getcode() == 206
+                if resumed and not response.headers.get(
+                        "Content-Range", "").startswith("bytes %d-" % offset):
+                    open(part, "wb").close()
+                    raise IOError("Unexpected Content-Range")
+                length = response.headers.get("Content-Length")
+                expected = None if length is None else int(length) + (
+                    offset if resumed else 0)
+                with open(part, "ab" if resumed else "wb") as output:
+                    while True:
+                        chunk = response.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        output.write(chunk)
+            size = os.path.getsize(part)
+            if expected is not None and size != expected:
+                raise IOError("Received %d of %d bytes" % (size, expected))
+            os.replace(part, path)
+            return size
+        except (URLError, IOError, HTTPException) as error:
+            if isinstance(error, HTTPError):
+                if error.code == 416:
+                    # The part no longer matches the file being served.
+                    open(part, "wb").close()
+                elif error.code not in (408, 429) and error.code < 500:
+                    # The file is gone for good, and so is its part.
+                    os.remove(part)
+                    raise
+            if attempt >= retries:
+                # The part is kept, for the next run to resume.
+                raise
+            delay = chandere.connection.backoff(attempt)
+            attempt += 1
+            metrics.count("chandere_download_retries_total")
+            logging.warning("Download of \"%s\" interrupted (%s), resuming "
+                            "in %.1f seconds." % (url, error, delay))
+            time.sleep(delay)
+
+
+def download_files(output, data_queue, debug=False, media=None,
+                   media_filter=None, cache=None):
+    """Download worker, takes files from the data queue until killed. Files
+    handled are confirmed to the given cache.
+    """
+    while True:
+        url, filename, md5, size = data_queue.get()
+        try:
+            if download_file(url, filename, output, md5, media, size,
+                             media_filter) and cache is not None:
+                cache.confirm(url)
+        finally:
+            data_queue.task_done()
         if debug:
             break
 
 
-def write_to_disk(mode, output, write_mode, data_queue, debug=False):
-    """Thread for writing scraped data to disk."""
+def write_to_disk(mode, output, write_mode, data_queue, debug=False,
+                  workers=4, media=None, archive_format="text", batch_size=100,
+                  media_filter=None, cache=None):
+    """Thread for writing scraped data to disk. In image downloader mode,
+    files are downloaded by the given number of workers at once, and
+    duplicates of files in the media index are linked rather than written.
+    Files of unknown size are looked up first if the media filter needs it.
+    In archive mode, posts are written in the given format, in batches of up
+    to batch_size posts. Posts are confirmed to the given cache once their
+    files are downloaded or they are committed to the archive.
+    """
     logging.info("Starting...")
     if mode == "id":
-        while True:
-            url, filename = data_queue.get()
-            while os.path.exists(os.path.join(output, filename)):
-                filename = "(copy)" + filename
-            urlretrieve(url, filename=os.path.join(output, filename))
-            logging.info("File %s successfully downloaded!" % filename)
+        for number in range(1, 1 if debug else workers):
+            threading.Thread(name="Download Thread %d" % number,
+                             target=download_files,
+                             daemon=True,
+                             args=(output, data_queue, False, media,
+                                   media_filter, cache)).start()
+        download_files(output, data_queue, debug, media, media_filter, cache)
     else:
-        with open(output, write_mode) as output_file:
+        writer = chandere.archive.WRITERS[archive_format](output, write_mode)
+        try:
             while True:
-                post_id, parent_id, name, date, time, filename, title, body = data_queue.get(
-                )
-                if parent_id:
-                    output_file.seek(0)
+                batch = [data_queue.get()]
+                # Posts already waiting are written along with the first one,
+                # and committed together.
+                while len(batch) < (1 if debug else batch_size):
+                    try:
+                        batch.append(data_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for post in batch:
+                    writer.write(post)
+                writer.commit()
+                for post in batch:
+                    if cache is not None:
+                        cache.confirm((post[8], post[0], post[9]))
+                    data_queue.task_done()
+                chandere.metrics.METRICS.count("chandere_posts_archived_total",
+                                               len(batch))
+                if len(batch) == 1:
+                    logging.info("Post %s successfully archived!" % post[0])
                 else:
-                    output_file.seek(0, 2)
-                if len(title) > 0:
-                    title += "\n"
-                body = re.sub(r'<.*>', "", body)
-                body = re.sub(r'&#039;', "'", body)
-                body = re.sub(r'&quot;', "\"", body)
-                body = re.sub(r'&amp;', "&", body)
-                title = re.sub(r'<.*>', "", title)
-                output_file.write(
-                    "\n********************\n%s"
-                    "Post ID: %s\nFile: %s\n%s"
-                    "%s posted this on %s at %s\n"
-                    "%s\n********************" % (
-                        title, post_id, filename, "Reply to: %s\n" % parent_id
-                        if parent_id else "", name, date, time, body))
-                logging.info("Post %s successfully archived!" % post_id)
-                output_file.seek(0, 0)
+                    logging.info("%d posts successfully archived!" %
+                                 len(batch))
                 if debug:
                     break
+        finally:
+            writer.close()
+
+
+def log_queue_stats(**queues):
+    """Logs the depth of every given queue and the time spent waiting for
+    room in it.
+    """
+    for name, bounded_queue in sorted(queues.items()):
+        stats = bounded_queue.stats()
+        logging.info("Queue %s: %d items (%d bytes, peak %d), blocked for "
+                     "%.1f seconds." % (name, stats["depth"], stats["bytes"],
+                                        stats["peak"], stats["blocked"]))
+
+
+def create_site(mode, chan, backend=None, queue_size=100, queue_memory=64,
+                catalog=True):
+    """Prepares the offsets and queues used to scrape from an imageboard.
+    Boards are swept through their catalog when the imageboard's API
+    publishes one, unless catalog is False. Returns None if the imageboard
+    can't be read with the given backend.
+    """
+    if backend is None:
+        backend = "json" if chan in API_CHANS else "html"
+    elif backend == "json" and chan not in API_CHANS:
+        logging.critical("No JSON API is known for \"%s\"." % chan)
+        return None
+    # Pages are the bulk of what the pipeline holds, so the html queue is
+    # bounded by its size in megabytes as well.
+    offsets = create_offsets(mode, chan, backend)
+    return {"backend": backend,
+            "catalog": catalog and "catalog_page" in offsets,
+            "offsets": offsets,
+            "url_queue": chandere.pipeline.BoundedQueue(queue_size),
+            "html_queue": chandere.pipeline.BoundedQueue(
+                queue_size, queue_memory * 1024 * 1024,
+                chandere.pipeline.page_size)}
+
+
+def start_site(site, mode, chan, cache, data_queue, scheduler, ssl=False,
+               connections=8, host_limit=4, parse_workers=0, named=False,
+               media_filter=None, store=None, replay=False, profiler=None,
+               catalogs=None):
+    """Starts the connection and scraper threads of an imageboard. If named,
+    the threads are named after the imageboard. Pages are recorded to the
+    given page store, or read from it when replaying.
+    """
+    suffix = " (%s)" % chan if named else ""
+    threading.Thread(name="Connection Thread" + suffix,
+                     target=get_url_content,
+                     daemon=True,
+                     args=(site["url_queue"], site["html_queue"], cache,
+                           False, connections, host_limit, None, scheduler,
+                           chandere.connection.MAX_RETRIES, store,
+                           replay)).start()
+    threading.Thread(name="Scraper Thread" + suffix,
+                     target=scrape_html,
+                     daemon=True,
+                     args=(site["offsets"], mode, chan, site["html_queue"],
+                           data_queue, cache, ssl,
+                           site["offsets"]["thread_delimiter"], False,
+                           scheduler, parse_workers, media_filter,
+                           profiler, catalogs)).start()
+
+
+def drained(scheduler, sites, data_queue):
+    """Waits for every page handed to the given sites to be scraped and for
+    every post found to be written, then returns whether no more pages have
+    been scheduled in the meantime.
+    """
+    join_queues(pipeline_queues(sites, data_queue))
+    return not len(scheduler)
 
 
-def load_cache(mode, dump_file):
-    if dump_file is not None and os.path.exists(dump_file):
-        with open(dump_file, "rb") as cache_load:
+def shut_down(sites, data_queue, deadline=SHUTDOWN_DEADLINE):
+    """Lets the pipeline finish what it has started before quitting. Urls not
+    yet fetched are dropped, as they are polled again on the next run, while
+    pages already downloaded are scraped and every post found is written.
+    Returns whether the pipeline drained within the deadline in seconds.
+    """
+    for site in sites.values():
+        while True:
             try:
-                cache = pickle.load(cache_load)
-                if cache[0] != mode:
-                    cache = []
-                    logging.info("Incompatible cache file. Creating empty.")
-                else:
-                    cache = cache[1:]
-                    logging.info("Cache file successfully loaded.")
-            except pickle.PickleError:
-                cache = []
-                logging.warning("Incompatible cache file. Creating empty.")
-            except EOFError:
-                cache = []
-                logging.warning("Empty cache file. Creating empty.")
+                site["url_queue"].get_nowait()
+            except queue.Empty:
+                break
+            site["url_queue"].task_done()
+    return join_queues(pipeline_queues(sites, data_queue), deadline)
+
+
+def pipeline_queues(sites, data_queue):
+    """Returns the queues of every site and the data queue, in the order
+    items flow through them.
+    """
+    return ([site["url_queue"] for site in sites.values()] +
+            [site["html_queue"] for site in sites.values()] + [data_queue])
+
+
+def join_queues(queues, timeout=None):
+    """Waits for every item put on the given queues to be done with, in turn,
+    for up to timeout seconds in all. Returns whether they all were.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    for pending in queues:
+        with pending.all_tasks_done:
+            while pending.unfinished_tasks:
+                remaining = None if deadline is None else (
+                    deadline - time.time())
+                if remaining is not None and remaining <= 0:
+                    return False
+                pending.all_tasks_done.wait(remaining)
+    return True
+
+
+def checkpoint(cache, media=None, store=None, catalogs=None):
+    """Forces the cache log, along with the media index, page store and
+    catalog state if given, onto the disk, so that what has been handled so
+    far survives the machine crashing as well as Chandere being killed.
+    """
+    cache.sync()
+    if media is not None:
+        media.sync()
+    if store is not None:
+        store.sync()
+    if catalogs is not None:
+        catalogs.dump()
+    chandere.metrics.METRICS.count("chandere_checkpoints_total")
+    logging.info("Checkpoint written.")
+
+
+def handle_signals(requests):
+    """Makes SIGTERM quit Chandere the way SIGINT does, and SIGHUP ask for a
+    checkpoint by setting the "checkpoint" key of the given dictionary.
+    """
+    def terminate(signum, frame):
+        raise KeyboardInterrupt("SIGTERM")
+
+    def hang_up(signum, frame):
+        requests["checkpoint"] = True
+
+    signal.signal(signal.SIGTERM, terminate)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, hang_up)
+
+
+def polled(url, hosts, boards=None):
+    """Returns whether a cached url should be polled regularly, given the
+    sites being scraped from by host. If boards is given, only threads whose
+    url starts with one of its prefixes are.
+    """
+    site = hosts.get(url_host(url))
+    return site is not None and not site["catalog"] and (
+        boards is None or url.startswith(tuple(boards)))
+
+
+def board_prefix(offsets, chan, board, ssl=False):
+    """Returns the part of a board's thread urls preceding the thread."""
+    return thread_url(offsets, chan, board, "0", ssl,
+                      offsets["thread_delimiter"]).rsplit("/", 1)[0] + "/"
+
+
+def url_host(url):
+    """Returns the host part of an url."""
+    return url.split("/", 3)[2] if "://" in url else url.split("/", 1)[0]
+
+
+def register_metrics(scheduler, **queues):
+    """Registers gauges for the number of scheduled pages and the state of
+    every given queue.
+    """
+    metrics = chandere.metrics.METRICS
+    metrics.gauge("chandere_scheduled_pages", scheduler.__len__)
+    for name, bounded_queue in queues.items():
+        name = name.replace("_queue", "")
+        for stat, metric in (("depth", "chandere_queue_depth"),
+                             ("bytes", "chandere_queue_bytes"),
+                             ("blocked", "chandere_queue_blocked_seconds")):
+            metrics.gauge("%s{queue=\"%s\"}" % (metric, name),
+                          lambda bounded=bounded_queue, stat=stat:
+                          bounded.stats()[stat])
+
+
+def load_cache(mode, dump_file, record=True):
+    """Loads the cache of the given mode from its log, which new entries are
+    recorded to as they are seen unless record is False.
+    """
+    if dump_file is None:
+        logging.info("No cache file given. Creating empty.")
+        return chandere.cache.Cache()
+    log = chandere.cache.CacheLog(dump_file, mode)
+    try:
+        entries = log.open()
+    except (IOError, OSError) as error:
+        logging.warning("Could not open cache file: %s. Creating empty." %
+                        error)
+        return chandere.cache.Cache()
+    if entries:
+        logging.info("Cache file successfully loaded.")
     else:
-        cache = []
-        logging.info("Given cache did not exist. Creating empty.")
-    return cache
+        logging.info("No cached entries for this mode. Creating empty.")
+    if not record:
+        log.close()
+        log = None
+    return chandere.cache.Cache(entries, log)
 
 
 def dump_cache(mode, cache, dump_file):
-    """Called when the program exits to dump the post cache."""
-    # Remove cached board pages.
-    for index, item in enumerate(cache):
-        if item[1] is None:
-            del cache[index]
-    if dump_file is None:
+    """Called when the program exits to make sure every entry in the cache
+    has reached its log.
+    """
+    if cache.log is None:
         logging.warning("Invalid cache dump path. Cache was lost.")
     else:
-        with open(dump_file, "wb+") as cache_dump:
-            pickle.dump([mode] + cache, cache_dump)
-        logging.info("Cache dumped to \"%s\"." % dump_file)
-
-
-def create_offsets(mode, chan=None):
-    """Compile the regular expressions associated with the given imageboard."""
-    if mode == "ar" and chan == "lainchan":
-        offsets = {
-            "max_page": 7,
-            "page_delimiter": "",
-            "thread_delimiter": "res/",
-            "board_initial": re.compile(r'(?<=header><h1>)\S+?'),
-            "post_op": re.compile(r'(?<=post op").+?(?=<\/div>)'),
-            "post_reply":
-            re.compile(r'(?<=post reply">).+?(?=<\/div><\/div>)'),
-            "post_id": re.compile(r'(?<=<a id=")\d+(?=" class="post_anchor")'),
-            "file_name": re.compile(r'(?<=\/)\d+?\.\w{3,4}'),
-            "poster_name": re.compile(r'(?<=class="name">).*?(?=</span>)'),
-            "post_title": re.compile(r'(?<=class="subject">).*?(?=</span>)'),
-            "pub_date": re.compile(r'\d{4}-\d{2}-\d{2}'),
-            "pub_time": re.compile(r'\d{2}:\d{2}:\d{2}'),
-            "post_body": re.compile(r'(?<=class="body">).+?(?=<\/div)')
-        }
-    elif mode == "id" and chan == "lainchan":
-        offsets = {
-            "max_page": 7,
-            "page_delimiter": "",
-            "thread_delimiter": "res/",
-            "link_prefix": "https://lainchan.org",
-            "board_initial": re.compile(r'(?<=header><h1>)\S+?'),
-            "post_op": re.compile(r'(?<=post op").+?(?=<\/div>)'),
-            "post_reply":
-            re.compile(r'(?<=post reply">).+?(?=<\/div><\/div>)'),
-            "thread_link":
-            re.compile(r'(?<=<div id="op_)\d+(?=" class="post op")'),
-            "image_link": re.compile(
-                r'((?<=File: <a href=")|(?<=" href=")).+?\.\w{3,4}(?=")'),
-            "file_name": re.compile(r'(?<=\/)\d+?\.\w{3,4}')
-        }
-    elif mode == "tc" and chan == "lainchan":
-        offsets = {
-            "max_page": 7,
-            "page_delimiter": "",
-            "thread_delimiter": "res/"
-        }
-    elif mode == "ar" and chan == "4chan":
-        offsets = {
-            "max_page": 10,
-            "page_delimiter": "",
-            "thread_delimiter": "thread/",
-            "board_initial": re.compile(r'(?<=boardTitle">)\/\S+?\/'),
-            "post_op":
-            re.compile(r'(?<=post op">)<div.+?\/blockquote>(?=<\/div>)'),
-            "post_reply":
-            re.compile(r'(?<=post reply">)<div.+?\/blockquote>(?=<\/div>)'),
-            "post_id": re.compile(r'(?<=#p)\d+(?=")'),
-            "file_name":
-            re.compile(r'(?<=target="_blank">).+?\.\w{3,4}(?=</a>)'),
-            "poster_name": re.compile(r'(?<=class="name">).*?(?=</span>)'),
-            "post_title": re.compile(r'(?<=class="subject">).*?(?=</span>)'),
-            "pub_date": re.compile(r'\d{2}\/\d{2}\/\d{2}\(\w{3}\)'),
-            "pub_time": re.compile(r'\d{2}:\d{2}:\d{2}'),
-            "post_body":
-            re.compile(r'(?<="postMessage" id="m\d{8}">).+?(?=<\/block)')
-        }
-    elif mode == "id" and chan == "4chan":
-        offsets = {
-            "max_page": 10,
-            "page_delimiter": "",
-            "thread_delimiter": "thread/",
-            "link_prefix": "http:",
-            "board_initial": re.compile(r'(?<=boardTitle">)\/\S+?\/'),
-            "post_op":
-            re.compile(r'(?<=post op">)<div.+?\/blockquote>(?=<\/div>)'),
-            "post_reply":
-            re.compile(r'(?<=post reply">)<div.+?\/blockquote>(?=<\/div>)'),
-            "post_id": re.compile(r'(?<=#p)\d+(?=")'),
-            "image_link": re.compile(
-                r'((?<=File: <a href=")|(?<=" href=")).+?\.\w{3,4}(?=")'),
-            "file_name":
-            re.compile(r'(?<=target="_blank">).+?\.\w{3,4}(?=</a>)')
-        }
-    elif mode == "tc" and chan == "lainchan":
-        offsets = {
-            "max_page": 10,
-            "page_delimiter": "",
-            "thread_delimiter": "thread/"
-        }
-    elif mode == "ar":
-        offsets = {
-            "max_page": None,
-            "page_delimiter": "",
-            "thread_delimiter": "thread/",
-            "board_initial": re.compile(r'(?<=boardTitle">)\/\S+?\/'),
-            "post_op":
-            re.compile(r'(?<=post op">)<div.+?\/blockquote>(?=<\/div>)'),
-            "post_reply":
-            re.compile(r'(?<=post reply">)<div.+?\/blockquote>(?=<\/div>)'),
-            "post_id": re.compile(r'(?<=#p)\d+(?=")'),
-            "file_name":
-            re.compile(r'(?<=target="_blank">).+?\.\w{3,4}(?=</a>)'),
-            "poster_name": re.compile(r'(?<=class="name">).*?(?=</span>)'),
-            "post_title": re.compile(r'(?<=class="subject">).*?(?=</span>)'),
-            "pub_date": re.compile(r'\d{2}\/\d{2}\/\d{2}\(\w{3}\)'),
-            "pub_time": re.compile(r'\d{2}:\d{2}:\d{2}'),
-            "post_body":
-            re.compile(r'(?<="postMessage" id="m\d{8}">).+?(?=<\/block)')
-        }
-    elif mode == "id":
-        offsets = {
-            "max_page": None,
-            "page_delimiter": "",
-            "thread_delimiter": "thread/",
-            "link_prefix": "http:",
-            "board_initial": re.compile(r'(?<=boardTitle">)\/\S+?\/'),
-            "post_op":
-            re.compile(r'(?<=post op">)<div.+?\/blockquote>(?=<\/div>)'),
-            "post_reply":
-            re.compile(r'(?<=post reply">)<div.+?\/blockquote>(?=<\/div>)'),
-            "post_id": re.compile(r'(?<=#p)\d+(?=")'),
-            "image_link": re.compile(
-                r'((?<=File: <a href=")|(?<=" href=")).+?\.\w{3,4}(?=")'),
-            "file_name":
-            re.compile(r'(?<=target="_blank">).+?\.\w{3,4}(?=</a>)')
-        }
-    else:
-        offsets = {
-            "max_page": None,
-            "page_delimiter": "",
-            "thread_delimiter": "thread/"
-        }
-    return offsets
+        cache.log.close()
+        logging.info("Cache dumped to \"%s\"." % cache.log.path)
+
+
+def create_offsets(mode, chan=None, backend="html"):
+    """Returns the compiled offsets of the given imageboard's profile. When
+    the "json" backend is used, the description of the imageboard's API is
+    returned instead.
+    """
+    return chandere.profiles.PROFILES.offsets(mode, chan, backend)
 
 
 def main(mode,
@@ -434,58 +1116,239 @@ def main(mode,
          bottomfeed=False,
          dump=False,
          force=False,
-         verbose=False):
-    """Control function. Handles environment variables and threading."""
+         verbose=False,
+         connections=8,
+         host_limit=4,
+         download_workers=4,
+         backend=None,
+         media_index=None,
+         archive_format="text",
+         max_refresh=3600,
+         queue_size=100,
+         queue_memory=64,
+         parse_workers=0,
+         metrics_port=None,
+         stats_file=None,
+         index_pages=False,
+         file_types=(),
+         min_size=None,
+         max_size=None,
+         min_dimensions=None,
+         max_dimensions=None,
+         record=None,
+         replay=None,
+         pattern_budget=None,
+         checkpoint_interval=CHECKPOINT_INTERVAL,
+         checkpoint_posts=CHECKPOINT_POSTS,
+         shutdown_deadline=SHUTDOWN_DEADLINE):
+    """Control function. Handles environment variables and threading.
+    Combinations are either (board, thread) tuples on the given imageboard,
+    or (chan, board, thread) tuples, in which case every imageboard named is
+    scraped from at once. Downloaded pages are recorded to the record
+    directory, if given. If a replay directory is given instead, the pages
+    recorded there for the given imageboards are scraped again without
+    downloading anything, after which Chandere quits. Given a pattern
+    budget, every offset is timed on each page, and offsets taking longer
+    than the budget in seconds are warned about.
+
+    The cache is checkpointed every checkpoint_interval seconds or
+    checkpoint_posts new posts, whichever comes first, and on SIGHUP. On
+    SIGINT or SIGTERM, Chandere stops polling and gives the pipeline up to
+    shutdown_deadline seconds to finish the pages and posts it holds.
+    """
     logging.basicConfig(
         format="[%(threadName)-10s] %(levelname)s: %(message)s",
         level=logging.DEBUG if verbose else logging.WARNING)
-    offsets = create_offsets(mode, chan)
-    cache = load_cache(mode, dump_file)
-    url_queue = queue.Queue(maxsize=0)
-    html_queue = queue.Queue(maxsize=0)
-    data_queue = queue.Queue(maxsize=0)
-    connection_thread = threading.Thread(name="Connection Thread",
-                                         target=get_url_content,
-                                         daemon=True,
-                                         args=(url_queue, html_queue, cache))
-    scraper_thread = threading.Thread(name="Scraper Thread",
-                                      target=scrape_html,
-                                      daemon=True,
-                                      args=(offsets, mode, chan, html_queue,
-                                            data_queue, cache, force_ssl,
-                                            offsets["thread_delimiter"]))
+    combinations = [combination if len(combination) == 3 else
+                    (chan, ) + tuple(combination)
+                    for combination in combinations]
+    metrics = chandere.metrics.METRICS
+    if replay is None:
+        cache = load_cache(mode, dump_file, dump)
+    else:
+        # Posts recorded by a live run are in its cache already, so replays
+        # start from an empty cache, which isn't kept either.
+        cache = chandere.cache.Cache()
+        dump = False
+    # Catalogs are read again on every run, but only the threads that have
+    # changed since the last run are downloaded.
+    catalogs = Catalogs(dump_file + ".catalogs" if dump and (
+        dump_file is not None) else None)
+    media = chandere.media.MediaIndex(media_index) if (
+        mode == "id" and media_index is not None) else None
+    media_filter = chandere.media.MediaFilter(
+        file_types, chandere.media.VIDEO_TYPES if no_video else (), min_size,
+        max_size, min_dimensions, max_dimensions) if mode == "id" else None
+    scheduler = chandere.scheduler.Scheduler(refresh_rate, max_refresh)
+    store = None if record is None and replay is None else (
+        chandere.store.PageStore(record or replay))
+    profiler = None if pattern_budget is None else (
+        chandere.profiler.PatternProfiler(pattern_budget))
+    data_queue = chandere.pipeline.BoundedQueue(queue_size)
+    queues = {"data_queue": data_queue}
+    # Every imageboard has its own offsets, connections and scraper, so that
+    # a slow one doesn't hold up the others. The cache, scheduler and write
+    # thread are shared.
+    sites = {}
+    chans = sorted(set(combination[0] for combination in combinations))
+    for site_chan in chans:
+        site = create_site(mode, site_chan, backend, queue_size, queue_memory,
+                           not index_pages)
+        if site is None:
+            exit(1)
+        if profiler is not None and site["backend"] == "json":
+            logging.warning("Posts from \"%s\" are read from its JSON API "
+                            "rather than found with patterns, so none are "
+                            "profiled. Pass \"-b html\" to profile them." %
+                            site_chan)
+        sites[site_chan] = site
+        label = site_chan + " " if len(chans) > 1 else ""
+        queues[label + "url_queue"] = site["url_queue"]
+        queues[label + "html_queue"] = site["html_queue"]
+    register_metrics(scheduler, **queues)
+    if metrics_port is not None:
+        chandere.metrics.serve(metrics_port)
+    if stats_file is not None:
+        threading.Thread(name="Stats Thread",
+                         target=chandere.metrics.write_stats_periodically,
+                         daemon=True,
+                         args=(stats_file, )).start()
     write_thread = threading.Thread(name="Write Thread",
                                     target=write_to_disk,
                                     daemon=True,
                                     args=(mode, output, write_mode,
-                                          data_queue))
+                                          data_queue, False,
+                                          download_workers, media,
+                                          archive_format, 100, media_filter,
+                                          cache))
     try:
-        if any([combination[1] for combination in combinations]):
-            temporary_cache = [item for item in cache]
-            cache = []
+        if any([combination[2] for combination in combinations]):
+            # Only the given threads and the threads of the given boards are
+            # refreshed, rather than every thread in the cache.
+            targets = chandere.cache.Cache()
+            boards = []
         else:
-            temporary_cache = []
-        for board, thread in combinations:
-            for url in generate_urls(chan,
+            targets = cache
+            boards = None
+        seeds = []
+        hosts = {}
+        for site_chan, board, thread in combinations:
+            site = sites[site_chan]
+            offsets = site["offsets"]
+            if site["backend"] == "json":
+                urls = generate_api_urls(site_chan, board, thread, force_ssl,
+                                         bottomfeed, offsets["max_page"],
+                                         site["catalog"])
+            else:
+                urls = generate_urls(site_chan,
                                      board,
                                      thread,
                                      force_ssl,
                                      bottomfeed,
-                                     page_delimiter=offsets["page_delimiter"],
-                                     max_page=offsets["max_page"]):
-                cache.append((board, thread, chan, url))
+                                     offsets["thread_delimiter"],
+                                     offsets["page_delimiter"],
+                                     offsets["max_page"])
+            for url in urls:
+                targets.add((board, thread, site_chan, url))
+                seeds.append(url)
+                hosts[url_host(url)] = site
+            if boards is not None and not thread:
+                boards.append(board_prefix(offsets, site_chan, board,
+                                           force_ssl))
         if mode == "tc":
-            for item in cache:
-                url_queue.put(item[3])
-            exit(get_url_content(url_queue, html_queue, cache))
-        connection_thread.start()
-        scraper_thread.start()
+            # Every page of the given imageboards is tested, including the
+            # threads of boards swept through their catalog. Nothing reads
+            # the pages of a connection test, so they are not held back by
+            # the html queue's bounds.
+            exit(sweep([url for url in targets.urls()
+                        if url_host(url) in hosts], queue.Queue(), cache,
+                       connections, host_limit))
+        # Pages cached for imageboards not being scraped from are left alone,
+        # as are threads of boards swept through their catalog, which are
+        # only polled once the catalog shows they have changed.
+        known = [url for url in targets.urls() if polled(url, hosts)]
+        if targets is not cache:
+            known += [url for url in cache.urls()
+                      if polled(url, hosts, boards)]
+        if replay is not None:
+            # Every page recorded from the given imageboards is scraped once,
+            # in place of the pages that would have been downloaded.
+            seeds = [url for url in store.urls() if url_host(url) in hosts]
+            known = []
+            if not seeds:
+                logging.warning("No pages have been recorded from the given "
+                                "imageboards.")
+        # The given boards and threads are polled straight away, while pages
+        # remembered from earlier runs are spread over the first refresh.
+        scheduler.extend(seeds, once=replay is not None)
+        scheduler.extend(known, refresh_rate)
+        for site_chan, site in sorted(sites.items()):
+            start_site(site, mode, site_chan, cache, data_queue, scheduler,
+                       force_ssl, connections, host_limit, parse_workers,
+                       len(sites) > 1, media_filter, store,
+                       replay is not None, profiler, catalogs)
         write_thread.start()
+        requests = {"checkpoint": False}
+        handle_signals(requests)
+        synced = reported = checkpointed = time.time()
+        posts = metrics.get("chandere_posts_new_total")
         while True:
-            for item in cache:
-                url_queue.put(item[3])
-            time.sleep(refresh_rate)
-    except KeyboardInterrupt:
-        logging.critical("SIGINT received, quitting.")
-        if dump:
-            dump_cache(mode, cache, dump_file)
+            if replay is not None and not len(scheduler) and drained(
+                    scheduler, sites, data_queue):
+                logging.info("Every recorded page has been replayed.")
+                break
+            url = scheduler.pop(POLL_INTERVAL)
+            if url is not None:
+                try:
+                    hosts[url_host(url)]["url_queue"].put_nowait(url)
+                except queue.Full:
+                    # The imageboard is falling behind, which shouldn't keep
+                    # the others waiting.
+                    if not scheduler.postpone(url, 1):
+                        scheduler.add(url, 1, once=True)
+            if (boards != [] and replay is None and
+                    time.time() - synced >= SYNC_INTERVAL):
+                # Threads found on board pages since the last sync are
+                # scheduled as well.
+                scheduler.extend([url for url in cache.urls()
+                                  if polled(url, hosts, boards)],
+                                 SYNC_INTERVAL)
+                synced = time.time()
+            if time.time() - reported >= QUEUE_REPORT_INTERVAL:
+                log_queue_stats(**queues)
+                if profiler is not None:
+                    profiler.report()
+                reported = time.time()
+            if requests["checkpoint"] or (
+                    time.time() - checkpointed >= checkpoint_interval) or (
+                        checkpoint_posts and metrics.get(
+                            "chandere_posts_new_total") - posts >=
+                        checkpoint_posts):
+                requests["checkpoint"] = False
+                checkpoint(cache, media, store, catalogs)
+                checkpointed = time.time()
+                posts = metrics.get("chandere_posts_new_total")
+    except KeyboardInterrupt as interrupt:
+        logging.critical("%s received, quitting." %
+                         (interrupt.args[0] if interrupt.args else "SIGINT"))
+        if write_thread.is_alive():
+            try:
+                if not shut_down(sites, data_queue, shutdown_deadline):
+                    logging.error("The pipeline did not drain within %d "
+                                  "seconds." % shutdown_deadline)
+            except KeyboardInterrupt:
+                logging.critical("Quitting without waiting for the pipeline "
+                                 "to drain.")
+    if cache.log is not None and cache.unconfirmed():
+        logging.warning("%d posts were not written, and will be handled "
+                        "again on the next run." % cache.unconfirmed())
+    if media is not None:
+        media.sync()
+    log_queue_stats(**queues)
+    if profiler is not None:
+        profiler.report()
+    if dump:
+        dump_cache(mode, cache, dump_file)
+        catalogs.dump()
+    if store is not None:
+        store.close()
@@ -4,6 +4,8 @@ form usable by the core module."""
 import re
 import os
 
+import chandere.archive
+
 def separate_board_thread(arguments):
     """Parses the positional argument for specifying the board and thread to
     scrape from.
@@ -23,7 +25,33 @@ def separate_board_thread(arguments):
     return combinations
 
 
-def parse_path(string, mode):
+def separate_targets(arguments, chan):
+    """Parses the positional arguments like separate_board_thread, though
+    each may be prefixed with an imageboard and a colon (E.g.
+    "lainchan:/cyb/") to scrape from instead of the given one. Returns a list
+    of (chan, board, thread) tuples.
+    """
+    targets = []
+    for argument in arguments:
+        target_chan, separator, board_thread = argument.rpartition(":")
+        if not separator or board_thread.startswith("//"):
+            target_chan, board_thread = chan, argument
+        board, thread = separate_board_thread([board_thread])[0]
+        targets.append((target_chan, board, thread))
+    return targets
+
+
+def parse_dimensions(string):
+    """Parses image dimensions given in the form of WIDTHxHEIGHT (E.g.
+    "1920x1080") into a (width, height) tuple.
+    """
+    match = re.match(r'^(\d+)x(\d+)$', string.strip().lower())
+    if match is None:
+        raise ValueError("Invalid dimensions, \"%s\"." % string)
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_path(string, mode, archive_format="text"):
     """Validates a specific output location."""
     is_potential_file = bool(re.search(r'\S\.\w+(?!(\\|\/))', string))
     parent_dir = os.path.dirname(os.path.abspath(string))
@@ -43,7 +71,8 @@ def parse_path(string, mode):
             path = string
             write_mode = "a"
         elif os.path.exists(string) and os.path.isdir(string):
-            path = os.path.join(string, "archive.txt")
+            path = os.path.join(string, "archive.%s" % chandere.archive.WRITERS[
+                archive_format].extension)
             write_mode = "a+"
         elif os.path.exists(parent_dir) and not os.path.exists(string):
             path = string
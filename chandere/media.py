@@ -0,0 +1,179 @@
+"""Content-addressed index of the media downloaded by Chandere, used to avoid
+downloading or storing the same file twice across boards and runs, and the
+filter deciding which files are worth downloading at all.
+"""
+
+import base64
+import fnmatch
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import threading
+
+# MIME types of the files left out with --no-video.
+VIDEO_TYPES = ("video/*", )
+
+
+class MediaIndex(object):
+    """Persistent index of downloaded files by the base64-encoded MD5 digest
+    of their contents, the form imageboards publish digests in. The index is
+    an append-only file of lines in the form of "md5<TAB>size<TAB>path", the
+    last line for a digest taking precedence.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = {}
+        self._pending = {}
+        if os.path.exists(path):
+            with io.open(path, encoding="utf-8") as index:
+                for line in index:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) == 3 and fields[1].isdigit():
+                        self._files[fields[0]] = (int(fields[1]), fields[2])
+        self._file = io.open(path, "a", buffering=1, encoding="utf-8",
+                             newline="\n")
+
+    def lookup(self, md5):
+        """Returns the path of a file with the given digest, if one has been
+        downloaded and is still on disk unchanged.
+        """
+        with self._lock:
+            return self._lookup(md5)
+
+    def _lookup(self, md5):
+        size, path = self._files.get(md5, (None, None))
+        if path is not None and os.path.isfile(path) and (
+                os.path.getsize(path) == size):
+            return path
+        return None
+
+    def claim(self, md5):
+        """Returns the path of a file with the given digest if one exists.
+        Otherwise, marks the digest as being downloaded by the calling thread
+        and returns None, in which case release must be called once the
+        download is over. If another thread is downloading the same digest,
+        waits for it to finish first.
+        """
+        while True:
+            with self._lock:
+                pending = self._pending.get(md5)
+                if pending is None:
+                    path = self._lookup(md5)
+                    if path is None:
+                        self._pending[md5] = threading.Event()
+                    return path
+            pending.wait()
+
+    def release(self, md5):
+        """Wakes up any thread waiting on a claimed digest."""
+        with self._lock:
+            pending = self._pending.pop(md5, None)
+        if pending is not None:
+            pending.set()
+
+    def record(self, md5, path):
+        """Adds a downloaded file to the index."""
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._files[md5] = (size, path)
+            self._file.write(u"%s\t%d\t%s\n" % (md5, size, path))
+
+    def sync(self):
+        """Forces every file recorded so far onto the disk."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Closes the index. Nothing more is recorded afterwards."""
+        with self._lock:
+            self._file.close()
+
+
+class MediaFilter(object):
+    """Decides whether a file should be downloaded from what is known of it
+    beforehand. Types are extensions, such as "webm", or MIME types, such as
+    "image/*", and a file must match one of the given types, if any, and none
+    of the excluded ones. Sizes are in bytes and dimensions are (width,
+    height) tuples. Whatever isn't known of a file is given the benefit of the
+    doubt.
+    """
+
+    def __init__(self, types=(), exclude=(), min_size=None, max_size=None,
+                 min_dimensions=None, max_dimensions=None):
+        self.types = [media_type.lower().lstrip(".") for media_type in types]
+        self.exclude = [media_type.lower().lstrip(".")
+                        for media_type in exclude]
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_dimensions = min_dimensions
+        self.max_dimensions = max_dimensions
+
+    def accepts(self, filename, size=None, dimensions=None, mime=None):
+        """Returns whether a file with the given name, size, dimensions and
+        MIME type should be downloaded. The MIME type is guessed from the
+        filename when not given.
+        """
+        extension = os.path.splitext(filename)[1].lower().lstrip(".")
+        mime = (mime or mimetypes.guess_type(filename)[0] or "").split(";")[
+            0].strip().lower()
+        if self.types and not matches(self.types, extension, mime):
+            return False
+        if matches(self.exclude, extension, mime):
+            return False
+        if size is not None and not within(size, self.min_size,
+                                           self.max_size):
+            return False
+        if dimensions is not None:
+            bounds = zip(dimensions, self.min_dimensions or (None, None),
+                         self.max_dimensions or (None, None))
+            if not all(within(*bound) for bound in bounds):
+                return False
+        return True
+
+    def needs_size(self, size):
+        """Returns whether a file of the given size, None if unknown, has to
+        be looked up before it can be accepted.
+        """
+        return size is None and (self.min_size is not None or
+                                 self.max_size is not None)
+
+
+def matches(types, extension, mime):
+    """Returns whether an extension or MIME type is among the given types."""
+    return any(media_type == extension or (
+        "/" in media_type and fnmatch.fnmatchcase(mime, media_type))
+               for media_type in types)
+
+
+def within(value, minimum, maximum):
+    return ((minimum is None or value >= minimum) and
+            (maximum is None or value <= maximum))
+
+
+def file_md5(path):
+    """Returns the base64-encoded MD5 digest of a file's contents."""
+    digest = hashlib.md5()
+    with open(path, "rb") as media:
+        for chunk in iter(lambda: media.read(65536), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode("ascii")
+
+
+def link_file(source, destination):
+    """Replaces destination with a link to source, preferring a hard link and
+    falling back to a symbolic one.
+    """
+    temporary = destination + ".link"
+    try:
+        os.link(source, temporary)
+    except OSError:
+        logging.debug("Could not hard link \"%s\", using a symbolic link." %
+                      source)
+        os.symlink(os.path.abspath(source), temporary)
+    os.replace(temporary, destination)
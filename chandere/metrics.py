@@ -0,0 +1,159 @@
+"""Metrics collected by Chandere's threads, exposed in the Prometheus text
+format over HTTP or as a periodically rewritten stats file.
+
+Metrics are kept in the module-level METRICS registry, which every stage of
+the pipeline records to.
+"""
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+import bisect
+import io
+import logging
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the buckets histograms are sorted into.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics(object):
+    """Registry of counters, histograms and gauges. Counters and histograms
+    are updated as events happen, while gauges are functions sampled only
+    when the metrics are rendered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def count(self, name, value=1):
+        """Adds to a counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Records a value in a histogram."""
+        index = bisect.bisect_left(BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = [0] * (len(BUCKETS) + 3)
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def gauge(self, name, function):
+        """Registers a function returning the current value of a gauge."""
+        with self._lock:
+            self._gauges[name] = function
+
+    def get(self, name):
+        """Returns the value of a counter or gauge, or the number of values
+        recorded in a histogram.
+        """
+        with self._lock:
+            if name in self._histograms:
+                return self._histograms[name][-1]
+            gauge = self._gauges.get(name)
+            return gauge() if gauge is not None else self._counters.get(
+                name, 0)
+
+    def reset(self):
+        """Forgets every metric."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._gauges.clear()
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((name, list(histogram)) for name, histogram
+                                in self._histograms.items())
+            gauges = sorted(self._gauges.items())
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            base = name.split("{")[0]
+            if base not in typed:
+                typed.add(base)
+                lines.append("# TYPE %s %s" % (base, kind))
+
+        for name, value in counters:
+            declare(name, "counter")
+            lines.append("%s %s" % (name, value))
+        for name, value in gauges:
+            declare(name, "gauge")
+            lines.append("%s %s" % (name, value()))
+        for name, histogram in histograms:
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf", ), histogram):
+                cumulative += count
+                lines.append("%s_bucket{le=\"%s\"} %d" % (name, bound,
+                                                          cumulative))
+            lines.append("%s_sum %s" % (name, histogram[-2]))
+            lines.append("%s_count %d" % (name, histogram[-1]))
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the rendered metrics on every path."""
+
+    def do_GET(self):
+        body = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port, host="127.0.0.1", metrics=METRICS):
+    """Starts serving the metrics over HTTP in a background thread, and
+    returns the server.
+    """
+    server = MetricsServer((host, port), MetricsHandler)
+    server.metrics = metrics
+    threading.Thread(name="Metrics Thread", target=server.serve_forever,
+                     daemon=True).start()
+    return server
+
+
+def write_stats(path, metrics=METRICS):
+    """Replaces the stats file at the given path with the current metrics."""
+    temporary = path + ".tmp"
+    with io.open(temporary, "w", encoding="utf-8", newline="\n") as stats:
+        stats.write(metrics.render())
+    os.replace(temporary, path)
+
+
+def write_stats_periodically(path, interval=10, metrics=METRICS):
+    """Thread rewriting the stats file at the given interval."""
+    while True:
+        try:
+            write_stats(path, metrics)
+        except (IOError, OSError) as error:
+            logging.error("Could not write stats to \"%s\": %s." %
+                          (path, error))
+        time.sleep(interval)
@@ -0,0 +1,259 @@
+"""Parser backends for Chandere. Each backend takes a downloaded page and the
+offsets created for it, and returns the board the page belongs to along with
+every post found on it.
+
+Posts are dictionaries containing the post_id and parent_id of the post, as
+well as whichever of the name, date, time, filename, title, body, file_url,
+md5, file_size, dimensions and archived fields the backend could find.
+File sizes are in bytes and dimensions are (width, height) tuples. Missing
+fields are None.
+
+Backends may be given the id of the last reply already seen in a thread, in
+which case replies up to it are skipped.
+"""
+
+import datetime
+import json
+import re
+import time
+
+# Offsets used by the HTML backend, and the post fields they fill in.
+HTML_FIELDS = (("poster_name", "name"),
+               ("pub_date", "date"),
+               ("pub_time", "time"),
+               ("file_name", "filename"),
+               ("post_title", "title"),
+               ("post_body", "body"),
+               ("image_link", "file_url"),
+               ("file_md5", "md5"),
+               ("file_size", "file_size"),
+               ("file_dimensions", "dimensions"),
+               ("thread_archived", "archived"))
+# Units file sizes are given in on HTML pages.
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+LOOKBEHIND = re.compile(r'^\(\?<=([^()]*)\)|'
+                        r'^\(\(\?<=([^()]*)\)\|\(\?<=([^()]*)\)\)')
+# Offsets searched for over whole pages, rather than over each post. The
+# opening post and reply offsets are only ever searched for joined together,
+# as "post_split".
+PAGE_OFFSETS = ("board_initial", "post_split")
+# Offsets of the worker process, when parsing in a process pool, and whether
+# it times their patterns.
+_worker_offsets = None
+_worker_profile = False
+
+
+def parse_html(offsets, url, page, after=None):
+    """Extracts posts from an HTML page with the regular expressions in the
+    given offsets. Opening posts and replies are found in a single pass over
+    the page, though replies are only kept on thread pages. If the offsets
+    have a reply_marker and the last reply seen is on the page, the pass
+    starts from it rather than from the opening post.
+    """
+    board = offsets["board_initial"].search(page).group()
+    thread_mode = "Return</a>" in page
+    posts = []
+    parent_id = None
+    start = 0
+    if after is not None and thread_mode and "reply_marker" in offsets:
+        position = page.find(offsets["reply_marker"] % after)
+        opening = offsets["post_split"].search(page)
+        if position != -1 and opening is not None and (
+                opening.lastgroup == "op" and opening.end() <= position):
+            posts.append(extract_html_post(offsets, opening.group("op"),
+                                           None))
+            parent_id = posts[-1]["post_id"]
+            start = position
+    for match in offsets["post_split"].finditer(page, start):
+        if match.lastgroup == "op":
+            posts.append(extract_html_post(offsets, match.group("op"), None))
+            parent_id = posts[-1]["post_id"]
+        elif thread_mode and parent_id is not None:
+            post = extract_html_post(offsets, match.group("reply"), parent_id)
+            if after is None or not post["post_id"].isdigit() or int(
+                    post["post_id"]) > after:
+                posts.append(post)
+    return board, posts
+
+
+def extract_html_post(offsets, post, parent_id):
+    """Extracts every field of a single post with the patterns prepared by
+    combine_offsets.
+    """
+    extracted = dict.fromkeys(field for offset, field in HTML_FIELDS)
+    for field, pattern in offsets["post_fields"]:
+        match = pattern.search(post)
+        extracted[field] = match.group(field) if match else None
+    if extracted["post_id"] is None:
+        raise AttributeError("Post has no id.")
+    extracted["parent_id"] = parent_id
+    if extracted["file_url"] is not None:
+        extracted["file_url"] = offsets["link_prefix"] + extracted["file_url"]
+    if extracted["file_size"] is not None:
+        number, unit = extracted["file_size"].split()
+        extracted["file_size"] = int(float(number) * SIZE_UNITS[unit])
+    if extracted["dimensions"] is not None:
+        extracted["dimensions"] = tuple(
+            int(number) for number in extracted["dimensions"].split("x"))
+    return extracted
+
+
+def combine_offsets(offsets):
+    """Prepares the post offsets of an HTML profile for extraction. The
+    opening post and reply offsets are joined into a single pattern, so both
+    are found in one pass over the page, and the leading lookbehind of each
+    field's offset becomes a literal prefix, which lets the regular expression
+    engine skip straight to candidate positions rather than testing the
+    lookbehind at every character. Returns the joined pattern and a list of
+    (field, pattern) tuples.
+    """
+    split = re.compile("|".join((prefix_lookbehind("op", offsets["post_op"]),
+                                 prefix_lookbehind("reply",
+                                                   offsets["post_reply"]))))
+    fields = [("post_id", offsets["post_id"])]
+    fields.extend((field, offsets[offset]) for offset, field in HTML_FIELDS
+                  if offset in offsets)
+    return split, [(field, re.compile(prefix_lookbehind(field, pattern)))
+                   for field, pattern in fields]
+
+
+def prefix_lookbehind(name, pattern):
+    """Rewrites a pattern in the form of (?<=PREFIX)BODY, or one with a choice
+    of two lookbehinds, as PREFIX(?P<name>BODY). Other patterns are wrapped
+    in the named group as they are.
+    """
+    pattern = pattern.pattern
+    lookbehind = LOOKBEHIND.match(pattern)
+    if lookbehind is None:
+        return "(?P<%s>%s)" % (name, pattern)
+    elif lookbehind.group(1) is not None:
+        prefix = lookbehind.group(1)
+    else:
+        prefix = "(?:%s|%s)" % lookbehind.group(2, 3)
+    return "%s(?P<%s>%s)" % (prefix, name, pattern[lookbehind.end():])
+
+
+def parse_json(offsets, url, page, after=None):
+    """Extracts posts from a document served by a 4chan-styled JSON API.
+    Thread documents contain every post of the thread, while only the
+    opening post of each thread is taken from board pages.
+    """
+    board = "/" + re.search(r'(?<=://)[^/]+/([^/]+)', url).group(1) + "/"
+    document = json.loads(page)
+    if "threads" in document:
+        posts = [thread["posts"][0] for thread in document["threads"]]
+    elif after is not None:
+        posts = [post for post in document["posts"]
+                 if not post.get("resto") or post["no"] > after]
+    else:
+        posts = document["posts"]
+    return board, [extract_json_post(offsets, board, post) for post in posts]
+
+
+def extract_json_post(offsets, board, post):
+    """Converts a single post from a JSON API to the common post format."""
+    if "now" in post:
+        date, time = re.match(r'(.+\))(.+)', post["now"]).groups()
+    else:
+        timestamp = datetime.datetime.utcfromtimestamp(post["time"])
+        date, time = (timestamp.strftime("%Y-%m-%d"),
+                      timestamp.strftime("%H:%M:%S"))
+    extracted = {"post_id": str(post["no"]),
+                 "parent_id": str(post["resto"]) if post.get("resto") else None,
+                 "name": post.get("name", ""),
+                 "date": date,
+                 "time": time,
+                 "filename": None,
+                 "title": post.get("sub", ""),
+                 "body": post.get("com"),
+                 "file_url": None,
+                 "md5": None,
+                 "file_size": None,
+                 "dimensions": None,
+                 "archived": bool(post.get("archived")) or None}
+    if "tim" in post:
+        extracted["filename"] = post["filename"] + post["ext"]
+        extracted["md5"] = post.get("md5")
+        extracted["file_size"] = post.get("fsize")
+        if "w" in post and "h" in post:
+            extracted["dimensions"] = (post["w"], post["h"])
+        extracted["file_url"] = offsets["link_prefix"] + offsets[
+            "media_url"] % {"board": board,
+                            "tim": post["tim"],
+                            "ext": post["ext"]}
+    return extracted
+
+
+def parse_catalog(offsets, url, page, after=None):
+    """Extracts the threads listed in a board's catalog, as served by a
+    4chan-styled JSON API in the form of threads.json. Threads are
+    dictionaries containing their post_id, along with the time they were
+    last modified and their number of replies where given.
+    """
+    board = "/" + re.search(r'(?<=://)[^/]+/([^/]+)', url).group(1) + "/"
+    return board, [{"post_id": str(thread["no"]),
+                    "last_modified": thread.get("last_modified"),
+                    "replies": thread.get("replies")}
+                   for catalog_page in json.loads(page)
+                   for thread in catalog_page["threads"]]
+
+
+def select_parser(offsets, url):
+    """Returns the function to parse the page at the given url with."""
+    catalog_page = offsets.get("catalog_page")
+    if catalog_page is not None and url.endswith(catalog_page):
+        return parse_catalog
+    return BACKENDS[offsets.get("backend", "html")]
+
+
+BACKENDS = {"html": parse_html, "json": parse_json}
+
+
+def time_patterns(offsets, page):
+    """Times every pattern of the HTML backend's offsets against a page, in
+    the form parse_html uses them. Page-wide offsets are searched for over
+    the whole page, and post fields over every post the page is split into.
+    Returns a list of (offset, seconds, matches) tuples, which is empty for
+    offsets of other backends.
+    """
+    if "post_fields" not in offsets or offsets.get("backend",
+                                                   "html") != "html":
+        return []
+    timings = []
+    start = time.time()
+    matches = int(offsets["board_initial"].search(page) is not None)
+    timings.append(("board_initial", time.time() - start, matches))
+    start = time.time()
+    posts = [match.group(match.lastgroup)
+             for match in offsets["post_split"].finditer(page)]
+    timings.append(("post_split", time.time() - start, len(posts)))
+    field_offsets = dict((field, offset) for offset, field in HTML_FIELDS)
+    for field, pattern in offsets["post_fields"]:
+        start = time.time()
+        matches = sum(1 for post in posts if pattern.search(post))
+        timings.append((field_offsets.get(field, field), time.time() - start,
+                        matches))
+    return timings
+
+
+def init_worker(offsets, profile=False):
+    """Prepares a worker process of a parser pool to parse pages with the
+    given offsets, timing their patterns on every page if profile is set.
+    """
+    global _worker_offsets, _worker_profile
+    _worker_offsets = offsets
+    _worker_profile = profile
+
+
+def parse_page(url, page, after=None):
+    """Parses a page in a worker process of a parser pool with the backend
+    and offsets given to init_worker. Returns the board and posts of the page
+    along with the time taken to parse it, and the timings of its patterns if
+    they are being profiled.
+    """
+    parse = select_parser(_worker_offsets, url)
+    start = time.time()
+    board, posts = parse(_worker_offsets, url, page, after)
+    elapsed = time.time() - start
+    timings = time_patterns(_worker_offsets, page) if _worker_profile else None
+    return board, posts, elapsed, timings
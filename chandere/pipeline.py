@@ -0,0 +1,74 @@
+"""Queues connecting the threads of Chandere's pipeline. Each is bounded, so
+that a slow stage pauses the stages feeding it rather than letting their
+output pile up in memory.
+"""
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import time
+
+
+class BoundedQueue(queue.Queue):
+    """Queue bounded by the number of items it holds, and optionally by their
+    total size as measured by sizeof. Putting an item blocks until there is
+    room for it, though an item larger than max_bytes is let into an empty
+    queue rather than blocking forever. The time producers spend blocked is
+    kept for sizing the limits.
+    """
+
+    def __init__(self, maxsize=0, max_bytes=0, sizeof=None):
+        queue.Queue.__init__(self, maxsize)
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.peak = 0
+        self.blocked = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        size = self.sizeof(item) if self.sizeof is not None else 0
+        with self.not_full:
+            if self._full(size):
+                if not block:
+                    raise queue.Full
+                start = time.time()
+                try:
+                    while self._full(size):
+                        remaining = None if timeout is None else (
+                            start + timeout - time.time())
+                        if remaining is not None and remaining <= 0:
+                            raise queue.Full
+                        self.not_full.wait(remaining)
+                finally:
+                    self.blocked += time.time() - start
+            self._put((size, item))
+            self.bytes += size
+            self.peak = max(self.peak, self._qsize())
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def stats(self):
+        """Returns the depth, size in bytes, peak depth and seconds producers
+        have spent blocked, in a dictionary.
+        """
+        with self.mutex:
+            return {"depth": self._qsize(), "bytes": self.bytes,
+                    "peak": self.peak, "blocked": self.blocked}
+
+    def _full(self, size):
+        return (0 < self.maxsize <= self._qsize()) or (
+            0 < self.max_bytes < self.bytes + size and self.bytes > 0)
+
+    def _get(self):
+        size, item = self.queue.popleft()
+        self.bytes -= size
+        # Producers wait for different amounts of room, so all of them are
+        # woken to check whether their item fits now.
+        self.not_full.notify_all()
+        return item
+
+
+def page_size(item):
+    """Returns the size of a (url, page) tuple from the html queue."""
+    return len(item[1])
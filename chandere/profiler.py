@@ -0,0 +1,101 @@
+"""Profiling of the patterns Chandere extracts posts with. When a site changes
+its markup, lazy patterns searched for over whole pages can backtrack badly,
+which otherwise only shows as the scraper thread going quiet. The profiler
+times every offset on each page, warns of any taking longer than its budget
+and reports the slowest runs, without a debugger attached.
+"""
+
+import heapq
+import logging
+import threading
+
+import chandere.metrics
+import chandere.parsers
+
+# Seconds an offset may take on a single page before it is warned about.
+BUDGET = 0.1
+# Number of the slowest runs kept for the report.
+SLOWEST = 10
+
+
+class PatternProfiler(object):
+    """Record of how long every offset took on the pages it was timed
+    against. The time each offset takes is added to the metrics, runs over
+    the budget are warned about as they happen, and the slowest runs are
+    kept for the report.
+    """
+
+    def __init__(self, budget=BUDGET, slowest=SLOWEST,
+                 metrics=chandere.metrics.METRICS):
+        self.budget = budget
+        self.metrics = metrics
+        self._size = slowest
+        self._lock = threading.Lock()
+        self._slowest = []
+        self._totals = {}
+
+    def profile(self, offsets, url, page):
+        """Times the offsets' patterns against a page and records how long
+        each took.
+        """
+        self.record(url, len(page),
+                    chandere.parsers.time_patterns(offsets, page))
+
+    def record(self, url, size, timings):
+        """Records the (offset, seconds, matches) timings of a page of the
+        given size in bytes.
+        """
+        for offset, seconds, matches in timings or ():
+            self.metrics.count("chandere_pattern_seconds_total{offset=\"%s\"}"
+                               % offset, seconds)
+            if seconds > self.budget:
+                self.metrics.count("chandere_pattern_budget_exceeded_total")
+                logging.warning("Offset \"%s\" took %.3f seconds on \"%s\" "
+                                "(%d bytes, %d matches), over its budget of "
+                                "%.3f seconds." % (offset, seconds, url, size,
+                                                   matches, self.budget))
+            with self._lock:
+                total = self._totals.setdefault(offset, [0, 0, 0])
+                total[0] += seconds
+                total[1] += 1
+                total[2] += matches
+                run = (seconds, offset, url, size, matches)
+                if len(self._slowest) < self._size:
+                    heapq.heappush(self._slowest, run)
+                else:
+                    heapq.heappushpop(self._slowest, run)
+
+    def slowest(self):
+        """Returns the slowest runs recorded, slowest first, as (seconds,
+        offset, url, size, matches) tuples.
+        """
+        with self._lock:
+            return sorted(self._slowest, reverse=True)
+
+    def totals(self):
+        """Returns the total seconds, pages and matches of every offset, by
+        offset.
+        """
+        with self._lock:
+            return dict((offset, tuple(total))
+                        for offset, total in self._totals.items())
+
+    def report(self):
+        """Logs the slowest runs recorded and the offsets that took the
+        longest overall. Only offsets over their budget are warned about.
+        """
+        totals = sorted(self.totals().items(), key=lambda item: item[1][0],
+                        reverse=True)
+        for offset, (seconds, pages, matches) in totals[:self._size]:
+            logging.log(self._level(seconds / pages),
+                        "Offset \"%s\" took %.3f seconds over %d pages "
+                        "(%.4f seconds a page, %d matches)." %
+                        (offset, seconds, pages, seconds / pages, matches))
+        for seconds, offset, url, size, matches in self.slowest():
+            logging.log(self._level(seconds),
+                        "Slowest: offset \"%s\" took %.3f seconds on \"%s\" "
+                        "(%d bytes, %d matches)." %
+                        (offset, seconds, url, size, matches))
+
+    def _level(self, seconds):
+        return logging.WARNING if seconds > self.budget else logging.INFO
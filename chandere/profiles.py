@@ -0,0 +1,225 @@
+"""Site profiles describing the imageboards Chandere knows how to scrape.
+
+A profile is plain data: the imageboard's host, how its pages and threads
+are numbered, the patterns its posts are found with, and the description of
+its JSON API, if it publishes one. Profiles are only checked when they are
+registered, and their patterns are compiled the first time offsets are
+asked for in a given mode, after which the compiled offsets are reused.
+Imageboards without a profile are assumed to be laid out like 4chan.
+"""
+
+import re
+import threading
+
+import chandere.parsers
+
+# Settings every profile gives.
+SETTINGS = ("host", "max_page", "page_delimiter", "thread_delimiter")
+# Patterns needed to find posts at all, and which patterns and settings every
+# mode of operation reads. The connection test reads no posts.
+POST_PATTERNS = ("board_initial", "post_op", "post_reply", "post_id",
+                 "reply_marker")
+MODE_FIELDS = {
+    "ar": POST_PATTERNS + ("file_name", "poster_name", "post_title",
+                           "pub_date", "pub_time", "post_body",
+                           "thread_archived"),
+    "id": POST_PATTERNS + ("link_prefix", "thread_link", "image_link",
+                           "file_name", "file_md5", "file_size",
+                           "file_dimensions", "thread_archived"),
+    "tc": ()
+}
+# Patterns used as format strings rather than regular expressions.
+LITERALS = ("reply_marker", )
+
+FOURCHAN_PATTERNS = {
+    "board_initial": r'(?<=boardTitle">)\/\S+?\/',
+    "post_op": r'(?<=post op">)<div.+?\/blockquote>(?=<\/div>)',
+    "post_reply": r'(?<=post reply">)<div.+?\/blockquote>(?=<\/div>)',
+    "post_id": r'(?<=#p)\d+(?=")',
+    "reply_marker": '<div id="p%d" class="post reply">',
+    "image_link": r'((?<=File: <a href=")|(?<=" href=")).+?\.\w{3,4}(?=")',
+    "file_name": r'(?<=target="_blank">).+?\.\w{3,4}(?=</a>)',
+    "file_md5": r'(?<=data-md5=")[^"]+(?=")',
+    "file_size": r'[\d.]+ [KMG]?B(?=, \d+x\d+[,)])',
+    "file_dimensions": r'(?<=B, )\d+x\d+(?=[,)])',
+    "poster_name": r'(?<=class="name">).*?(?=</span>)',
+    "post_title": r'(?<=class="subject">).*?(?=</span>)',
+    "pub_date": r'\d{2}\/\d{2}\/\d{2}\(\w{3}\)',
+    "pub_time": r'\d{2}:\d{2}:\d{2}',
+    "post_body": r'(?<="postMessage" id="m\d{8}">).+?(?=<\/block)',
+    "thread_archived": r'(?<=class=")archivedIcon(?=")'
+}
+
+LAINCHAN_PATTERNS = {
+    "board_initial": r'(?<=header><h1>)\S+?',
+    "post_op": r'(?<=post op").+?(?=<\/div>)',
+    "post_reply": r'(?<=post reply">).+?(?=<\/div><\/div>)',
+    "post_id": r'(?<=<a id=")\d+(?=" class="post_anchor")',
+    "reply_marker": 'id="reply_%d"',
+    "thread_link": r'(?<=<div id="op_)\d+(?=" class="post op")',
+    "image_link": r'((?<=File: <a href=")|(?<=" href=")).+?\.\w{3,4}(?=")',
+    "file_name": r'(?<=\/)\d+?\.\w{3,4}',
+    "file_size": r'[\d.]+ [KMG]?B(?=, \d+x\d+[,)])',
+    "file_dimensions": r'(?<=B, )\d+x\d+(?=[,)])',
+    "poster_name": r'(?<=class="name">).*?(?=</span>)',
+    "post_title": r'(?<=class="subject">).*?(?=</span>)',
+    "pub_date": r'\d{4}-\d{2}-\d{2}',
+    "pub_time": r'\d{2}:\d{2}:\d{2}',
+    "post_body": r'(?<=class="body">).+?(?=<\/div)'
+}
+
+# Profile of imageboards passed as an url rather than by name.
+GENERIC = {
+    "host": None,
+    "max_page": None,
+    "page_delimiter": "",
+    "thread_delimiter": "thread/",
+    "link_prefix": "http:",
+    "patterns": FOURCHAN_PATTERNS
+}
+
+
+class Registry(object):
+    """Site profiles by the name of their imageboard. The offsets compiled
+    from a profile are cached for every mode and backend, so that a profile's
+    patterns are compiled once however often they are asked for.
+    """
+
+    def __init__(self, generic=GENERIC):
+        self.generic = generic
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._compiled = {}
+
+    def __contains__(self, chan):
+        return chan in self._profiles
+
+    def __iter__(self):
+        return iter(sorted(self._profiles))
+
+    def register(self, chan, profile):
+        """Adds the profile of an imageboard, replacing any earlier profile
+        of the same name. Raises ValueError if the profile is incomplete.
+        """
+        check_profile(chan, profile)
+        with self._lock:
+            self._profiles[chan] = profile
+            for key in [key for key in self._compiled if key[1] == chan]:
+                del self._compiled[key]
+
+    def hosts(self):
+        """Returns the host of every known imageboard, by name."""
+        return dict((chan, profile["host"])
+                    for chan, profile in self._profiles.items())
+
+    def apis(self):
+        """Returns the description of every known JSON API, by the name of
+        its imageboard.
+        """
+        return dict((chan, profile["api"])
+                    for chan, profile in self._profiles.items()
+                    if "api" in profile)
+
+    def offsets(self, mode, chan=None, backend="html"):
+        """Returns the offsets used to scrape from the given imageboard in the
+        given mode, compiling them on first use. Raises ValueError if one of
+        the profile's patterns is not a valid regular expression.
+        """
+        profile = self._profiles.get(chan, self.generic)
+        if backend != "json" or "api" not in profile:
+            backend = "html"
+        key = (mode, chan if chan in self._profiles else None, backend)
+        with self._lock:
+            offsets = self._compiled.get(key)
+            if offsets is None:
+                offsets = self._compiled[key] = compile_profile(
+                    chan, profile, mode, backend)
+        return dict(offsets)
+
+
+def check_profile(chan, profile):
+    """Raises ValueError if a profile lacks a setting, names an unknown
+    pattern or gives only some of the patterns needed to find posts.
+    """
+    missing = [setting for setting in SETTINGS if setting not in profile]
+    if missing:
+        raise ValueError("Profile \"%s\" lacks %s." % (chan,
+                                                       ", ".join(missing)))
+    patterns = profile.get("patterns", {})
+    known = set(field for fields in MODE_FIELDS.values() for field in fields)
+    unknown = sorted(set(patterns) - known)
+    if unknown:
+        raise ValueError("Profile \"%s\" has unknown patterns %s." %
+                         (chan, ", ".join(unknown)))
+    if patterns and not all(field in patterns for field in POST_PATTERNS):
+        raise ValueError("Profile \"%s\" needs all of %s to find posts." %
+                         (chan, ", ".join(POST_PATTERNS)))
+
+
+def compile_profile(chan, profile, mode, backend="html"):
+    """Builds the offsets of a profile for the given mode and backend. When
+    the "json" backend is used, the description of the imageboard's API is
+    returned instead.
+    """
+    if backend == "json":
+        offsets = dict(profile["api"])
+        offsets.update({
+            "backend": "json",
+            "page_delimiter": "",
+            "link_prefix": "http:"
+        })
+        return offsets
+    offsets = dict((setting, profile[setting]) for setting in SETTINGS[1:])
+    fields = MODE_FIELDS.get(mode, ())
+    if "link_prefix" in fields and "link_prefix" in profile:
+        offsets["link_prefix"] = profile["link_prefix"]
+    for field, pattern in profile.get("patterns", {}).items():
+        if field not in fields:
+            continue
+        if field in LITERALS:
+            offsets[field] = pattern
+            continue
+        try:
+            offsets[field] = re.compile(pattern)
+        except re.error as error:
+            raise ValueError("Pattern \"%s\" of profile \"%s\" is invalid: "
+                             "%s." % (field, chan, error))
+    if "post_id" in offsets:
+        offsets["post_split"], offsets["post_fields"] = (
+            chandere.parsers.combine_offsets(offsets))
+    return offsets
+
+
+PROFILES = Registry()
+PROFILES.register("4chan", {
+    "host": "boards.4chan.org",
+    "max_page": 10,
+    "page_delimiter": "",
+    "thread_delimiter": "thread/",
+    "link_prefix": "http:",
+    "patterns": FOURCHAN_PATTERNS,
+    "api": {
+        "api_host": "a.4cdn.org",
+        "media_url": "//i.4cdn.org%(board)s%(tim)s%(ext)s",
+        "thread_delimiter": "thread/",
+        "first_page": 1,
+        "max_page": 10,
+        "catalog_page": "threads.json"
+    }
+})
+PROFILES.register("lainchan", {
+    "host": "lainchan.org",
+    "max_page": 7,
+    "page_delimiter": "",
+    "thread_delimiter": "res/",
+    "link_prefix": "https://lainchan.org",
+    "patterns": LAINCHAN_PATTERNS,
+    "api": {
+        "api_host": "lainchan.org",
+        "media_url": "//lainchan.org%(board)ssrc/%(tim)s%(ext)s",
+        "thread_delimiter": "res/",
+        "first_page": 0,
+        "max_page": 7,
+        "catalog_page": "threads.json"
+    }
+})
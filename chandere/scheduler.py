@@ -0,0 +1,160 @@
+"""Scheduling of page refreshes for Chandere. Every page is polled at its own
+interval, adapted to how often posts appear on it.
+"""
+
+import heapq
+import random
+import threading
+import time
+
+# Shortest interval a page is ever polled at, as asked of API clients by 4chan.
+MIN_INTERVAL = 10
+# Intervals are varied by up to this fraction, so that pages polled together
+# once drift apart rather than being refreshed in bursts.
+JITTER = 0.1
+
+
+class Scheduler(object):
+    """Priority queue of pages to be polled, ordered by the time each is next
+    due. A page's post rate is estimated from the number of new posts found
+    on every poll, and the page is polled about as often as a post is
+    expected on it, within the given bounds. Pages without new posts back off
+    up to max_interval, while retired pages are never polled again.
+    """
+
+    def __init__(self, interval=300, max_interval=3600,
+                 min_interval=MIN_INTERVAL, jitter=JITTER):
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.min_interval = min(interval, min_interval)
+        self.jitter = jitter
+        self._condition = threading.Condition()
+        self._heap = []
+        self._pages = {}
+        self._retired = set()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pages)
+
+    def __contains__(self, url):
+        with self._condition:
+            return url in self._pages
+
+    def add(self, url, delay=0, once=False):
+        """Schedules a page to be polled after the given delay, unless it is
+        already scheduled or has been retired. Returns whether it was added.
+        """
+        with self._condition:
+            if not self.extend((url, ), once=once):
+                return False
+            if delay:
+                # A single page is not spread, so its delay is set apart.
+                self._schedule(url, time.time() + delay)
+            return True
+
+    def extend(self, urls, spread=0, once=False):
+        """Schedules every new page among the given urls, spreading their
+        first polls evenly over the given number of seconds. Pages added once
+        are polled a single time and then forgotten, rather than being polled
+        repeatedly. Returns the number of pages added.
+        """
+        with self._condition:
+            urls = [url for url in urls
+                    if url not in self._pages and url not in self._retired]
+            now = time.time()
+            for index, url in enumerate(urls):
+                self._pages[url] = {"due": None,
+                                    "interval": self.interval,
+                                    "rate": 1.0 / self.interval,
+                                    "polled": None,
+                                    "elapsed": None,
+                                    "once": once}
+                self._schedule(url, now + spread * index / len(urls))
+            if urls:
+                self._condition.notify()
+            return len(urls)
+
+    def pop(self, timeout=None):
+        """Waits for the next page to become due and returns its url, or
+        returns None if none does within the given timeout. The page is
+        rescheduled at its current interval, to be adjusted once it has been
+        scraped with update.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                while self._heap and self._stale(*self._heap[0]):
+                    heapq.heappop(self._heap)
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    url = heapq.heappop(self._heap)[1]
+                    if self._pages[url]["once"]:
+                        del self._pages[url]
+                        return url
+                    page = self._pages[url]
+                    if page["polled"] is not None:
+                        page["elapsed"] = now - page["polled"]
+                    page["polled"] = now
+                    self._schedule(url, now + self._jittered(page["interval"]))
+                    return url
+                wait = self._heap[0][0] - now if self._heap else None
+                if deadline is not None:
+                    if deadline <= now:
+                        return None
+                    wait = deadline - now if wait is None else min(
+                        wait, deadline - now)
+                self._condition.wait(wait)
+
+    def update(self, url, new_posts):
+        """Adjusts the interval of a page after a poll that found the given
+        number of new posts. The first poll of a page only sets a baseline.
+        """
+        with self._condition:
+            page = self._pages.get(url)
+            if page is None or page["elapsed"] is None:
+                return
+            sample = new_posts / max(page["elapsed"], 1e-3)
+            page["rate"] = (page["rate"] + sample) / 2
+            interval = 1 / page["rate"] if page["rate"] else self.max_interval
+            page["interval"] = min(self.max_interval,
+                                   max(self.min_interval, interval))
+            self._schedule(url,
+                           page["polled"] + self._jittered(page["interval"]))
+            self._condition.notify()
+
+    def postpone(self, url, delay):
+        """Delays the next poll of a page by the given number of seconds from
+        now, leaving its interval as it is. Returns False if the page is not
+        scheduled, as pages polled once are not once they have been popped.
+        """
+        with self._condition:
+            if url not in self._pages:
+                return False
+            self._schedule(url, time.time() + delay)
+            self._condition.notify()
+            return True
+
+    def polling_interval(self, url):
+        """Returns the current polling interval of a page."""
+        with self._condition:
+            return self._pages[url]["interval"]
+
+    def retire(self, url):
+        """Stops polling a page for good, as it no longer exists or can no
+        longer change.
+        """
+        with self._condition:
+            self._retired.add(url)
+            return self._pages.pop(url, None) is not None
+
+    def _schedule(self, url, due):
+        self._pages[url]["due"] = due
+        heapq.heappush(self._heap, (due, url))
+
+    def _stale(self, due, url):
+        page = self._pages.get(url)
+        return page is None or page["due"] != due
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,152 @@
+"""Store of the pages downloaded by Chandere, recorded so that they can be
+replayed later without the network, to parse them again with new offsets or
+archive them in another format.
+
+Pages are kept in a directory of segment files, each a series of gzip
+members holding one page apiece: a line of JSON with the page's url, headers
+and the time it was downloaded, followed by its body. The directory's index
+lists where every page is, one line per page in the form of
+"url<TAB>time<TAB>segment<TAB>offset<TAB>size", in the order they were
+recorded.
+"""
+
+import gzip
+import io
+import itertools
+import json
+import os
+import threading
+import time
+
+# Size in bytes past which a new segment is started.
+SEGMENT_SIZE = 64 * 1024 * 1024
+INDEX_NAME = "index.tsv"
+
+
+class PageStore(object):
+    """Record of pages in the given directory, which is created if need be.
+    Pages are appended to the store, so every download of a page is kept.
+    """
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._urls = []
+        self._segment = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        index_path = os.path.join(directory, INDEX_NAME)
+        if os.path.exists(index_path):
+            with io.open(index_path, encoding="utf-8") as index:
+                for line in index:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) == 5:
+                        self._add(fields[0], float(fields[1]),
+                                  *map(int, fields[2:]))
+        self._index = io.open(index_path, "a", buffering=1, encoding="utf-8",
+                              newline="\n")
+        self._output = None
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(versions) for versions in self._pages.values())
+
+    def __contains__(self, url):
+        with self._lock:
+            return url in self._pages
+
+    def record(self, url, headers, body, timestamp=None):
+        """Appends a page to the store, along with its response headers and
+        the time it was downloaded at.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        header = json.dumps({"url": url, "time": timestamp,
+                             "headers": dict(headers)})
+        member = gzip.compress(header.encode("utf-8") + b"\n" + body)
+        with self._lock:
+            if self._output is None or (
+                    self._output.tell() + len(member) > self.segment_size and
+                    self._output.tell() > 0):
+                self._open_segment()
+            offset = self._output.tell()
+            self._output.write(member)
+            self._output.flush()
+            self._index.write(u"%s\t%r\t%d\t%d\t%d\n" % (
+                url, timestamp, self._segment, offset, len(member)))
+            self._add(url, timestamp, self._segment, offset, len(member))
+
+    def urls(self):
+        """Returns the url of every page in the store, in the order they were
+        first recorded.
+        """
+        with self._lock:
+            return list(self._urls)
+
+    def versions(self, url):
+        """Returns every recorded version of a page, oldest first, as
+        (timestamp, headers, body) tuples.
+        """
+        with self._lock:
+            locations = list(self._pages.get(url, ()))
+        return [self._read(*location)[1:] for location in locations]
+
+    def pages(self):
+        """Generator yielding every page in the store in the order they were
+        recorded, as (url, timestamp, headers, body) tuples.
+        """
+        with self._lock:
+            locations = sorted((location for versions in self._pages.values()
+                                for location in versions),
+                               key=lambda location: location[1:3])
+        for segment, members in itertools.groupby(
+                locations, lambda location: location[1]):
+            with open(self._segment_path(segment), "rb") as pages:
+                for timestamp, segment, offset, size in members:
+                    yield read_member(pages, offset, size)
+
+    def sync(self):
+        """Forces every page recorded so far onto the disk."""
+        with self._lock:
+            for output in (self._index, self._output):
+                if output is not None:
+                    output.flush()
+                    os.fsync(output.fileno())
+
+    def close(self):
+        """Closes the store. Nothing more is recorded afterwards."""
+        with self._lock:
+            self._index.close()
+            if self._output is not None:
+                self._output.close()
+
+    def _add(self, url, timestamp, segment, offset, size):
+        if url not in self._pages:
+            self._pages[url] = []
+            self._urls.append(url)
+        self._pages[url].append((timestamp, segment, offset, size))
+        self._segment = max(self._segment, segment)
+
+    def _open_segment(self):
+        if self._output is not None:
+            self._output.close()
+            self._segment += 1
+        self._output = open(self._segment_path(self._segment), "ab")
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, "pages-%05d.gz" % segment)
+
+    def _read(self, timestamp, segment, offset, size):
+        with open(self._segment_path(segment), "rb") as pages:
+            return read_member(pages, offset, size)
+
+
+def read_member(segment, offset, size):
+    """Reads the page stored at the given offset of an open segment, and
+    returns its url, timestamp, headers and body.
+    """
+    segment.seek(offset)
+    header, body = gzip.decompress(segment.read(size)).split(b"\n", 1)
+    header = json.loads(header.decode("utf-8"))
+    return header["url"], header["time"], header["headers"], body
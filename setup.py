@@ -18,13 +18,16 @@ setup(name="Chandere",
       download_url="",
       packages=["chandere"],
       include_package_data=True,
+      python_requires=">=3.7",
       install_requires=[],
       extras_require={},
       entry_points={"console_scripts": ["chandere = chandere.cli:main"]},
       classifiers=[
           'Development Status :: 1 - Planning',
           'Programming Language :: Python',
-          'Programming Language :: Python :: 3.5',
+          'Programming Language :: Python :: 3',
+          'Programming Language :: Python :: 3 :: Only',
+          'Programming Language :: Python :: 3.7',
           'Environment :: Console',
           'Intended Audience :: End Users/Desktop',
           'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
@@ -0,0 +1,18 @@
+"""Clock used by the tests in place of the time module, so that they move
+time on rather than wait for it.
+"""
+
+
+class FakeClock(object):
+    """Stands in for the time module of the module under test. The time only
+    changes when the test advances it.
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
@@ -0,0 +1,99 @@
+"""Local HTTP server used by the tests in place of a live imageboard."""
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+import gzip
+import threading
+import time
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """Serves the pages registered with the server. Each page is a tuple in
+    the form of (status, headers, body). Ranges of pages are served when
+    asked for, and the connection is dropped halfway through a page for as
+    many times as the server's drops give for its path. The most requests
+    answered at once is kept as the server's peak. Connections are kept
+    alive between requests, and pages are gzipped for clients accepting it
+    if the server compresses.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # The headers and body are written separately, which Nagle's algorithm
+    # would hold back on a kept-alive connection.
+    disable_nagle_algorithm = True
+
+    def do_HEAD(self):
+        self.do_GET(False)
+
+    def do_GET(self, send_body=True):
+        self.server.requests.append((self.path, dict(self.headers)))
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        try:
+            time.sleep(self.server.delay)
+            self.respond(send_body)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def respond(self, send_body):
+        status, headers, body = self.server.pages.get(
+            self.path, (404, {}, b"<title>404 Not Found</title>"))
+        headers = dict(headers)
+        if "ETag" in headers and (self.headers.get("If-None-Match") ==
+                                  headers["ETag"]):
+            status, body = 304, b""
+        requested = self.headers.get("Range")
+        if status == 200 and requested is not None:
+            start = int(requested.split("=")[1].split("-")[0])
+            headers["Content-Range"] = "bytes %d-%d/%d" % (
+                start, len(body) - 1, len(body))
+            status, body = 206, body[start:]
+        if self.server.compress and "gzip" in self.headers.get(
+                "Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            body = gzip.compress(body)
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not send_body:
+            return
+        if self.server.drops.get(self.path):
+            self.server.drops[self.path] -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(pages, delay=0, compress=False):
+    """Starts a server for the given pages in a background thread."""
+    server = ThreadingServer(("127.0.0.1", 0), PageHandler)
+    server.pages = pages
+    server.delay = delay
+    server.requests = []
+    server.drops = {}
+    server.compress = compress
+    # Number of requests being answered, and the most answered at once.
+    server.lock = threading.Lock()
+    server.active = server.peak = 0
+    server.url = "http://127.0.0.1:%d" % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
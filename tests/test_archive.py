@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+import json
+import os
+import sqlite3
+import unittest
+
+from chandere.archive import JSONLinesWriter, SQLiteWriter, TextWriter
+
+POSTS = [("51971506", None, "Anonymous", "12/20/15(Sun)", "20:03:52",
+          "RMS.png", "The /g/ Wiki", "Sticky", "/g/", "4chan"),
+         ("51971507", "51971506", "Anonymous", "12/20/15(Sun)", "20:04:10",
+          None, None, "&gt;&gt;51971506<br>Nice.", "/g/", "4chan")]
+
+
+class TextWriterTest(unittest.TestCase):
+    def tearDown(self):
+        os.remove("archive.txt")
+
+    def test_placeholders(self):
+        writer = TextWriter("archive.txt", "w+")
+        writer.write(POSTS[1])
+        writer.close()
+        with open("archive.txt") as archive:
+            self.assertEqual(archive.read(), "\n********************\n"
+                             "[No Title]\nPost ID: 51971507\nFile: [No File]"
+                             "\nReply to: 51971506\nAnonymous posted this on "
+                             "12/20/15(Sun) at 20:04:10\n&gt;&gt;51971506"
+                             "Nice.\n********************")
+
+
+class JSONLinesWriterTest(unittest.TestCase):
+    def tearDown(self):
+        os.remove("archive.jsonl")
+
+    def test_append(self):
+        for post in POSTS:
+            writer = JSONLinesWriter("archive.jsonl")
+            writer.write(post)
+            writer.close()
+        with open("archive.jsonl") as archive:
+            posts = [json.loads(line) for line in archive]
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(posts[1]["parent_id"], "51971506")
+        self.assertEqual(posts[1]["board"], "/g/")
+        self.assertEqual(posts[1]["filename"], None)
+
+
+class SQLiteWriterTest(unittest.TestCase):
+    def tearDown(self):
+        os.remove("archive.db")
+
+    def test_transactions(self):
+        writer = SQLiteWriter("archive.db")
+        for post in POSTS:
+            writer.write(post)
+        connection = sqlite3.connect("archive.db")
+        self.assertEqual(
+            connection.execute("SELECT COUNT(*) FROM posts").fetchone(), (0, ))
+        writer.commit()
+        self.assertEqual(
+            connection.execute("SELECT COUNT(*) FROM posts").fetchone(), (2, ))
+        writer.write(POSTS[0])
+        writer.close()
+        self.assertEqual(
+            connection.execute("SELECT post_id FROM posts WHERE parent_id = "
+                               "'51971506' AND chan = '4chan'").fetchall(),
+            [("51971507", )])
+        self.assertEqual(
+            connection.execute("SELECT COUNT(*) FROM posts").fetchone(), (2, ))
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+import os
+import pickle
+import threading
+import unittest
+
+import chandere.cache
+from chandere.cache import Cache, CacheLog
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache([
+            ("/g/", None, "4chan", "http://boards.4chan.org/g/"),
+            ("/g/", None, "4chan", "http://boards.4chan.org/g/2"),
+            ("/g/", "51971506", "4chan",
+             "http://boards.4chan.org/g/thread/51971506")
+        ])
+
+    def test_membership(self):
+        self.assertTrue(("/g/", "51971506", "4chan") in self.cache)
+        self.assertTrue(("/g/", "51971506", "4chan", "any url") in self.cache)
+        self.assertFalse(("/g/", "51971506", "lainchan") in self.cache)
+        self.assertFalse(("/3/", "51971506", "4chan") in self.cache)
+
+    def test_add(self):
+        self.assertFalse(self.cache.add(
+            ("/g/", None, "4chan", "http://boards.4chan.org/g/")))
+        self.assertTrue(self.cache.add(
+            ("/g/", None, "4chan", "http://boards.4chan.org/g/3")))
+        self.assertEqual(len(self.cache), 4)
+
+    def test_remove_url(self):
+        self.assertEqual(
+            self.cache.remove_url("http://boards.4chan.org/g/thread/51971506"),
+            1)
+        self.assertFalse(("/g/", "51971506", "4chan") in self.cache)
+        self.assertEqual(self.cache.remove_url("http://boards.4chan.org/z/"),
+                         0)
+        self.cache.remove_url("http://boards.4chan.org/g/")
+        # The other page of the board is still cached under the same key.
+        self.assertTrue(("/g/", None, "4chan") in self.cache)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_urls(self):
+        self.cache.add(("/g/", "51971507", "4chan",
+                        "http://boards.4chan.org/g/thread/51971506"))
+        self.assertEqual(self.cache.urls(),
+                         ["http://boards.4chan.org/g/",
+                          "http://boards.4chan.org/g/2",
+                          "http://boards.4chan.org/g/thread/51971506"])
+
+    def test_concurrent_access(self):
+        def add_posts(offset):
+            for post_id in range(offset, offset + 1000):
+                self.cache.add(("/g/", str(post_id), "4chan",
+                                "http://boards.4chan.org/g/thread/%d" %
+                                post_id))
+        threads = [threading.Thread(target=add_posts, args=(i * 1000, ))
+                   for i in range(4)]
+        seeded = list(self.cache)
+        for thread in threads:
+            thread.start()
+        for entry in seeded:
+            self.cache.discard(entry)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.cache), 4000)
+        self.assertEqual(len(self.cache.urls()), 4000)
+
+
+class CacheLogTest(unittest.TestCase):
+    def setUp(self):
+        self.path = "test_cache_log.txt"
+        self.entry = ("/g/", "51971506", "4chan",
+                      "http://boards.4chan.org/g/thread/51971506")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def open_cache(self, mode="id"):
+        log = CacheLog(self.path, mode)
+        return Cache(log.open(), log)
+
+    def test_entries_written_immediately(self):
+        cache = self.open_cache()
+        cache.add(self.entry)
+        cache.add(("/g/", None, "4chan", "http://boards.4chan.org/g/"))
+        with open(self.path) as log:
+            self.assertEqual(log.read(), "+\tid\t/g/\t51971506\t4chan\t"
+                             "http://boards.4chan.org/g/thread/51971506\n")
+        self.assertEqual(list(self.open_cache()), [self.entry])
+        cache.log.close()
+
+    def test_modes_side_by_side(self):
+        cache = self.open_cache("id")
+        cache.add(self.entry)
+        cache.log.close()
+        cache = self.open_cache("ar")
+        self.assertEqual(len(cache), 0)
+        cache.add(("/g/", "55021750", "4chan",
+                   "http://boards.4chan.org/g/thread/55021750"))
+        cache.log.close()
+        self.assertEqual(list(self.open_cache("id")), [self.entry])
+        self.assertEqual(len(self.open_cache("ar")), 1)
+
+    def test_pending_entries(self):
+        cache = self.open_cache()
+        cache.add(self.entry, pending="http://i.4cdn.org/g/1.png")
+        other = ("/g/", "51971507", "4chan", self.entry[3])
+        cache.add(other, pending="http://i.4cdn.org/g/2.png")
+        self.assertTrue(self.entry[:3] in cache)
+        self.assertEqual(cache.unconfirmed(), 2)
+        cache.confirm("http://i.4cdn.org/g/1.png")
+        cache.discard(other)
+        cache.confirm("http://i.4cdn.org/g/2.png")
+        self.assertEqual(cache.unconfirmed(), 0)
+        cache.log.close()
+        with open(self.path) as log:
+            self.assertEqual(log.read(), "+\tid\t/g/\t51971506\t4chan\t"
+                             "http://boards.4chan.org/g/thread/51971506\n")
+
+    def test_removal(self):
+        cache = self.open_cache()
+        cache.add(self.entry)
+        cache.remove_url(self.entry[3])
+        cache.log.close()
+        self.assertEqual(len(self.open_cache()), 0)
+
+    def test_torn_record(self):
+        cache = self.open_cache()
+        cache.add(self.entry)
+        cache.log.close()
+        with open(self.path, "a") as log:
+            log.write("+\tid\t/g/\t5502")
+        cache = self.open_cache()
+        self.assertEqual(list(cache), [self.entry])
+        cache.add(("/g/", "55021750", "4chan",
+                   "http://boards.4chan.org/g/thread/55021750"))
+        cache.log.close()
+        self.assertEqual(len(self.open_cache()), 2)
+
+    def test_compaction(self):
+        threshold = chandere.cache.COMPACTION_THRESHOLD
+        chandere.cache.COMPACTION_THRESHOLD = 10
+        try:
+            cache = self.open_cache()
+            for _ in range(10):
+                cache.add(self.entry)
+                cache.discard(self.entry)
+            cache.add(self.entry)
+            cache.log.close()
+            self.assertEqual(list(self.open_cache()), [self.entry])
+            with open(self.path) as log:
+                self.assertEqual(len(log.readlines()), 1)
+        finally:
+            chandere.cache.COMPACTION_THRESHOLD = threshold
+
+    def test_pickled_cache(self):
+        with open(self.path, "wb") as dump:
+            pickle.dump(["ar", self.entry], dump)
+        self.assertEqual(list(self.open_cache("ar")), [self.entry])
+        self.assertEqual(list(self.open_cache("ar")), [self.entry])
+        self.assertEqual(len(self.open_cache("id")), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError
+import socket
+import time
+import unittest
+
+import chandere.connection
+import chandere.metrics
+from chandere.connection import (AdaptiveLimiter, HostLimiter, HTTPClient,
+                                 Validators, backoff)
+from tests.clock import FakeClock
+from tests.server import start_server
+
+
+class HostLimiterTest(unittest.TestCase):
+    def test_shared_host(self):
+        limiter = HostLimiter(2)
+        self.assertTrue(limiter("http://boards.4chan.org/g/") is
+                        limiter("http://boards.4chan.org/g/thread/51971506"))
+        self.assertFalse(limiter("http://boards.4chan.org/g/") is
+                         limiter("http://lainchan.org/cyb/"))
+
+    def test_limit(self):
+        limiter = HostLimiter(2)
+        semaphore = limiter("http://boards.4chan.org/g/")
+        self.assertTrue(semaphore.acquire(False))
+        self.assertTrue(semaphore.acquire(False))
+        self.assertFalse(semaphore.acquire(False))
+        self.assertTrue(limiter("http://lainchan.org/cyb/").acquire(False))
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.base = chandere.connection.BACKOFF_BASE
+        chandere.connection.BACKOFF_BASE = 0.2
+        self.limiter = AdaptiveLimiter(4)
+        self.url = "http://boards.4chan.org/g/"
+
+    def tearDown(self):
+        chandere.connection.BACKOFF_BASE = self.base
+
+    def respond(self, latency, times=1):
+        for _ in range(times):
+            self.assertTrue(self.limiter.acquire(self.url, 0))
+            self.limiter.release(self.url, latency)
+
+    def test_healthy_responses(self):
+        self.assertEqual(self.limiter.window(self.url), 1)
+        self.assertTrue(self.limiter.acquire(self.url, 0))
+        self.assertFalse(self.limiter.acquire(self.url, 0))
+        self.limiter.release(self.url, 0.1)
+        self.respond(0.1, 10)
+        self.assertEqual(self.limiter.window(self.url), 4)
+        self.assertEqual(self.limiter.window("http://lainchan.org/cyb/"), 1)
+
+    def test_refused_request(self):
+        clock = FakeClock()
+        chandere.connection.time = clock
+        try:
+            self.respond(0.1, 10)
+            self.limiter.acquire(self.url)
+            self.limiter.release(self.url, 0.1, refused=True)
+            self.assertEqual(self.limiter.window(self.url), 2)
+            # The host is left alone for between half and all of the first
+            # backoff after refusing a request.
+            clock.advance(0.09)
+            self.assertFalse(self.limiter.acquire(self.url, 0))
+            clock.advance(0.12)
+            self.assertTrue(self.limiter.acquire(self.url, 0))
+        finally:
+            chandere.connection.time = time
+
+    def test_slow_responses(self):
+        self.respond(0.01, 10)
+        self.respond(1, 3)
+        self.assertEqual(self.limiter.window(self.url), 2)
+
+    def test_backoff(self):
+        for attempt in range(4):
+            delay = 0.2 * 2 ** attempt
+            self.assertTrue(delay / 2 <= backoff(attempt) <= delay)
+        self.assertTrue(backoff(20) <= chandere.connection.BACKOFF_CAP)
+
+
+class ValidatorsTest(unittest.TestCase):
+    def setUp(self):
+        self.validators = Validators()
+        self.url = "http://boards.4chan.org/g/thread/51971506"
+
+    def test_conditional_headers(self):
+        self.assertEqual(self.validators.headers(self.url), {})
+        self.validators.update(self.url, {
+            "ETag": "\"5759d1b5-1b1f\"",
+            "Last-Modified": "Sat, 11 Jun 2016 09:08:13 GMT"
+        })
+        self.assertEqual(self.validators.headers(self.url), {
+            "If-None-Match": "\"5759d1b5-1b1f\"",
+            "If-Modified-Since": "Sat, 11 Jun 2016 09:08:13 GMT"
+        })
+        self.assertEqual(
+            self.validators.headers("http://boards.4chan.org/g/"), {})
+
+    def test_forget(self):
+        self.validators.update(self.url, {"ETag": "\"5759d1b5-1b1f\""})
+        self.validators.forget(self.url)
+        self.assertEqual(self.validators.headers(self.url), {})
+        self.validators.update(self.url, {"ETag": "\"5759d1b5-1b1f\""})
+        self.validators.update(self.url, {})
+        self.assertEqual(self.validators.headers(self.url), {})
+
+
+class HTTPClientTest(unittest.TestCase):
+    def setUp(self):
+        with open("tests/example_page", "rb") as page:
+            self.page = page.read()
+        self.server = start_server({
+            "/g/thread/55021750": (200, {}, self.page),
+            "/g/res/55021750": (301, {"Location": "/g/thread/55021750"}, b"")
+        }, compress=True)
+        self.url = self.server.url + "/g/thread/55021750"
+        self.client = HTTPClient()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def opened(self):
+        return chandere.metrics.METRICS.get(
+            "chandere_connections_opened_total")
+
+    def test_connection_reused(self):
+        opened = self.opened()
+        for _ in range(3):
+            with self.client.open(self.url) as response:
+                self.assertEqual(response.read(), self.page)
+        self.assertEqual(self.opened(), opened + 1)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_compressed(self):
+        with self.client.open(self.url, compressed=True) as response:
+            self.assertEqual(response.headers.get("Content-Encoding"),
+                             "gzip")
+            self.assertTrue(int(response.headers.get("Content-Length")) <
+                            len(self.page) / 2)
+            chunks = []
+            for chunk in iter(lambda: response.read(1024), b""):
+                chunks.append(chunk)
+        self.assertEqual(b"".join(chunks), self.page)
+
+    def test_closed_connection_replaced(self):
+        self.client.open(self.url).read()
+        for connections in self.client._idle.values():
+            for connection in connections:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.client.open(self.url).read(), self.page)
+
+    def test_redirect(self):
+        response = self.client.open(self.server.url + "/g/res/55021750")
+        self.assertEqual(response.url, self.url)
+        self.assertEqual(response.read(), self.page)
+
+    def test_error_status(self):
+        opened = self.opened()
+        with self.assertRaises(HTTPError) as raised:
+            self.client.open(self.server.url + "/z/")
+        self.assertEqual(raised.exception.code, 404)
+        self.client.open(self.url).read()
+        self.assertEqual(self.opened(), opened + 1)
+
+    def test_corrupt_body(self):
+        self.server.pages["/g/corrupt"] = (200, {"Content-Encoding": "gzip"},
+                                           b"not gzipped at all")
+        response = self.client.open(self.server.url + "/g/corrupt")
+        self.assertRaises(IOError, response.read)
+
+    def test_proxy(self):
+        url = "http://boards.example.org/g/thread/55021750"
+        self.server.pages[url] = (200, {}, self.page)
+        client = HTTPClient(proxies={
+            "http": "http://user:secret@" + self.server.url[7:]})
+        try:
+            self.assertEqual(client.open(url).read(), self.page)
+        finally:
+            client.close()
+        path, headers = self.server.requests[0]
+        self.assertEqual(path, url)
+        self.assertEqual(headers["Proxy-Authorization"],
+                         "Basic dXNlcjpzZWNyZXQ=")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,12 +6,26 @@ except ImportError:
     import Queue as queue
 import os
 import re
+import json
+import base64
+import hashlib
 import time
 import pickle
+import shutil
+import signal
 import threading
 import unittest
 
+import chandere.cache
+import chandere.connection
 import chandere.core
+import chandere.media
+import chandere.metrics
+import chandere.parsers
+import chandere.profiler
+import chandere.scheduler
+import chandere.store
+from tests.server import start_server
 
 
 class UrlGeneratorTest(unittest.TestCase):
@@ -170,6 +184,42 @@ class UrlGeneratorTest(unittest.TestCase):
         )
 
 
+class ApiUrlGeneratorTest(unittest.TestCase):
+    def test_generate_board_urls(self):
+        self.assertEqual(
+            list(chandere.core.generate_api_urls("4chan", "/g/", max_page=3)),
+            ["http://a.4cdn.org/g/1.json",
+             "http://a.4cdn.org/g/2.json",
+             "http://a.4cdn.org/g/3.json"])
+        self.assertEqual(
+            list(chandere.core.generate_api_urls("lainchan", "/cyb/",
+                                                 bottomfeed=True)),
+            ["http://lainchan.org/cyb/6.json",
+             "http://lainchan.org/cyb/5.json",
+             "http://lainchan.org/cyb/4.json",
+             "http://lainchan.org/cyb/3.json",
+             "http://lainchan.org/cyb/2.json",
+             "http://lainchan.org/cyb/1.json",
+             "http://lainchan.org/cyb/0.json"])
+
+    def test_thread_mode(self):
+        self.assertEqual(
+            next(chandere.core.generate_api_urls("4chan", "/g/", "51971506",
+                                                 ssl=True)),
+            "https://a.4cdn.org/g/thread/51971506.json")
+        self.assertEqual(
+            next(chandere.core.generate_api_urls("lainchan", "/cyb/",
+                                                 "26278")),
+            "http://lainchan.org/cyb/res/26278.json")
+
+
+    def test_catalog(self):
+        self.assertEqual(
+            list(chandere.core.generate_api_urls("lainchan", "/cyb/",
+                                                 catalog=True)),
+            ["http://lainchan.org/cyb/threads.json"])
+
+
 class OffsetsTest(unittest.TestCase):
     def test_create_offsets(self):
         self.assertTrue(chandere.core.create_offsets("id", "4chan"))
@@ -181,6 +231,11 @@ class OffsetsTest(unittest.TestCase):
         self.assertTrue(chandere.core.create_offsets("tc", "4chan"))
         self.assertTrue(chandere.core.create_offsets("tc", "lainchan"))
         self.assertTrue(chandere.core.create_offsets("tc"))
+        self.assertEqual(
+            chandere.core.create_offsets("ar", "4chan", "json")["backend"],
+            "json")
+        self.assertFalse("backend" in chandere.core.create_offsets(
+            "ar", "http://krautchan.net", "json"))
 
 
 # class ConnectionThreadTest(unittest.TestCase):
@@ -215,32 +270,782 @@ class OffsetsTest(unittest.TestCase):
 #         self.assertTrue(len(self.cache) == 0)
 
 
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        with open("tests/example_page", "rb") as page:
+            example = page.read()
+        self.server = start_server(
+            dict(("/g/%d" % page, (200, {}, example)) for page in range(8)),
+            delay=0.25)
+        self.cache = chandere.cache.Cache()
+        self.html_queue = queue.Queue()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_concurrent_sweep(self):
+        urls = ["%s/g/%d" % (self.server.url, page) for page in range(8)]
+        chandere.core.sweep(urls, self.html_queue, self.cache, connections=8,
+                            host_limit=8)
+        self.assertTrue(self.server.peak > 1)
+        self.assertEqual(self.html_queue.qsize(), 8)
+
+    def test_host_limit(self):
+        urls = ["%s/g/%d" % (self.server.url, page) for page in range(4)]
+        chandere.core.sweep(urls, self.html_queue, self.cache, connections=8,
+                            host_limit=1)
+        self.assertEqual(self.server.peak, 1)
+        self.assertEqual(self.html_queue.qsize(), 4)
+
+    def test_missing_page(self):
+        url = self.server.url + "/z/"
+        self.cache.add(("/z/", None, "4chan", url))
+        chandere.core.sweep([url], self.html_queue, self.cache)
+        self.assertTrue(self.html_queue.empty())
+        self.assertEqual(len(self.cache), 0)
+
+
+class ConnectionTestModeTest(unittest.TestCase):
+    def setUp(self):
+        self.sweep = chandere.core.sweep
+        self.swept = []
+        chandere.core.sweep = lambda urls, *args: self.swept.extend(urls)
+
+    def tearDown(self):
+        chandere.core.sweep = self.sweep
+
+    def test_catalog_board_tested(self):
+        self.assertRaises(SystemExit, chandere.core.main, "tc", "4chan",
+                          [("/g/", None)])
+        self.assertEqual(self.swept, ["http://a.4cdn.org/g/threads.json"])
+
+    def test_thread_tested(self):
+        self.assertRaises(SystemExit, chandere.core.main, "tc", "4chan",
+                          [("/g/", "55021750")])
+        self.assertEqual(self.swept,
+                         ["http://a.4cdn.org/g/thread/55021750.json"])
+
+    def test_api_not_profiled(self):
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertRaises(SystemExit, chandere.core.main, "tc", "4chan",
+                              [("/g/", None)], pattern_budget=0.1)
+        self.assertIn("Pass \"-b html\" to profile them.", logs.output[0])
+
+
+class ConditionalFetchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server({
+            "/g/thread/55021750": (200, {"ETag": "\"5759d1b5\""},
+                                   b"<title>/g/ - Technology</title>")
+        })
+        self.url = self.server.url + "/g/thread/55021750"
+        self.cache = chandere.cache.Cache()
+        self.url_queue = queue.Queue()
+        self.html_queue = queue.Queue()
+        self.validators = chandere.connection.Validators()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_unchanged_page_skipped(self):
+        metrics = chandere.metrics.METRICS
+        fetched = metrics.get("chandere_pages_fetched_total")
+        unchanged = metrics.get("chandere_pages_unchanged_total")
+        for _ in range(2):
+            self.url_queue.put(self.url)
+            chandere.core.get_url_content(self.url_queue, self.html_queue,
+                                          self.cache, debug=True,
+                                          validators=self.validators)
+        self.assertEqual(self.html_queue.qsize(), 1)
+        self.assertEqual(self.server.requests[1][1].get("If-None-Match"),
+                         "\"5759d1b5\"")
+        self.assertEqual(metrics.get("chandere_pages_fetched_total"),
+                         fetched + 1)
+        self.assertEqual(metrics.get("chandere_pages_unchanged_total"),
+                         unchanged + 1)
+
+    def test_compressed_page(self):
+        self.server.compress = True
+        self.url_queue.put(self.url)
+        chandere.core.get_url_content(self.url_queue, self.html_queue,
+                                      self.cache, debug=True)
+        self.assertEqual(self.server.requests[0][1].get("Accept-Encoding"),
+                         "gzip, deflate")
+        self.assertEqual(self.html_queue.get(),
+                         (self.url, "<title>/g/ - Technology</title>"))
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.base = chandere.connection.BACKOFF_BASE
+        chandere.connection.BACKOFF_BASE = 0.01
+        self.server = start_server({
+            "/g/": (503, {}, b"<title>503 Service Unavailable</title>"),
+            "/v/": (400, {}, b"<title>400 Bad Request</title>")
+        })
+        self.cache = chandere.cache.Cache()
+        self.url_queue = queue.Queue()
+        self.html_queue = queue.Queue()
+
+    def tearDown(self):
+        chandere.connection.BACKOFF_BASE = self.base
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_refused_page_retried(self):
+        url = self.server.url + "/g/"
+        self.cache.add(("/g/", None, "4chan", url))
+        self.url_queue.put(url)
+        chandere.core.get_url_content(self.url_queue, self.html_queue,
+                                      self.cache, debug=True)
+        self.assertEqual(self.url_queue.get(timeout=1), url)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_retries_exhausted(self):
+        url = self.server.url + "/g/"
+        for _ in range(3):
+            self.url_queue.put(url)
+            chandere.core.get_url_content(self.url_queue, self.html_queue,
+                                          self.cache, debug=True, retries=0)
+            self.assertRaises(queue.Empty, self.url_queue.get, timeout=0.1)
+
+    def test_error_not_retried(self):
+        self.url_queue.put(self.server.url + "/v/")
+        chandere.core.get_url_content(self.url_queue, self.html_queue,
+                                      self.cache, debug=True)
+        self.assertRaises(queue.Empty, self.url_queue.get, timeout=0.1)
+
+
+class RecordReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server({
+            "/g/thread/55021750": (200, {}, b"<title>/g/ - Technology</title>")
+        })
+        self.url = self.server.url + "/g/thread/55021750"
+        self.store = chandere.store.PageStore("test_pages")
+        self.cache = chandere.cache.Cache()
+        self.url_queue = queue.Queue()
+        self.html_queue = queue.Queue()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.store.close()
+        shutil.rmtree("test_pages")
+
+    def test_recorded_page_replayed(self):
+        self.url_queue.put(self.url)
+        chandere.core.get_url_content(self.url_queue, self.html_queue,
+                                      self.cache, debug=True,
+                                      store=self.store)
+        self.assertEqual(self.html_queue.get(),
+                         (self.url, "<title>/g/ - Technology</title>"))
+        self.assertEqual(len(self.store), 1)
+        self.server.shutdown()
+        self.url_queue.put(self.url)
+        chandere.core.get_url_content(self.url_queue, self.html_queue,
+                                      self.cache, debug=True,
+                                      store=self.store, replay=True)
+        self.assertEqual(self.html_queue.get(),
+                         (self.url, "<title>/g/ - Technology</title>"))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(self.store), 1)
+
+    def test_replayed_into_fresh_archive(self):
+        url = "http://boards.4chan.org/g/thread/55021750"
+        with open("tests/example_page", "rb") as page:
+            self.store.record(url, {}, page.read())
+        self.store.close()
+        # The live run that recorded the page has cached its posts.
+        cache = chandere.core.load_cache("ar", "test_cache.txt")
+        for post_id in ("55021750", "55023789", "55024083", "55024126",
+                        "55024240"):
+            cache.add(("/g/", post_id, "4chan", url))
+        cache.log.close()
+        handlers = (signal.getsignal(signal.SIGTERM),
+                    signal.getsignal(signal.SIGHUP))
+        try:
+            chandere.core.main("ar", "4chan", [("/g/", "55021750")],
+                               output="test_replay.txt", write_mode="a",
+                               dump=True, dump_file="test_cache.txt",
+                               backend="html", replay="test_pages")
+            with open("test_replay.txt") as archive:
+                self.assertEqual(archive.read().count("Post ID"), 5)
+            self.assertEqual(len(chandere.core.load_cache(
+                "ar", "test_cache.txt", False)), 5)
+        finally:
+            signal.signal(signal.SIGTERM, handlers[0])
+            signal.signal(signal.SIGHUP, handlers[1])
+            for path in ("test_replay.txt", "test_cache.txt"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_unrecorded_page(self):
+        self.url_queue.put(self.url)
+        chandere.core.get_url_content(self.url_queue, self.html_queue,
+                                      self.cache, debug=True,
+                                      store=self.store, replay=True)
+        self.assertTrue(self.html_queue.empty())
+        self.assertEqual(self.server.requests, [])
+
+
 class ScraperThreadTest(unittest.TestCase):
     def setUp(self):
-        self.cache = []
+        self.url = "http://boards.4chan.org/g/thread/55021750"
+        self.cache = chandere.cache.Cache()
         self.html_queue = queue.Queue()
         self.data_queue = queue.Queue()
 
     def test_find_images(self):
         offsets = chandere.core.create_offsets("id", "4chan")
         with open("tests/example_page") as page:
-            self.html_queue.put(page.read())
+            self.html_queue.put((self.url, page.read()))
         chandere.core.scrape_html(offsets, "id", "4chan", self.html_queue,
                                   self.data_queue, self.cache, debug=True)
         info = self.data_queue.get()
         self.assertEqual(info, ("http://i.4cdn.org/g/1465635673193.jpg",
-                                "back.jpg"))
+                                "back.jpg", "yZh7C2n3vUiurll2u3lvlA==",
+                                2998927))
 
     def test_archive_posts(self):
         offsets = chandere.core.create_offsets("ar", "4chan")
         with open("tests/example_page") as page:
-            self.html_queue.put(page.read())
+            self.html_queue.put((self.url, page.read()))
         chandere.core.scrape_html(offsets, "ar", "4chan", self.html_queue,
                                   self.data_queue, self.cache, debug=True)
         info = self.data_queue.get()
         self.assertEqual(info, ("55021750", None, "Anonymous", "06/11/16(Sat)",
                                 "05:01:13", "back.jpg", "",
-                                "Best .cbr reader for android?"))
+                                "Best .cbr reader for android?", "/g/",
+                                "4chan"))
+
+    def test_cached_posts_skipped(self):
+        offsets = chandere.core.create_offsets("id", "4chan")
+        self.cache.add(("/g/", "55021750", "4chan",
+                        "http://boards.4chan.org/g/thread/55021750"))
+        with open("tests/example_page") as page:
+            self.html_queue.put((self.url, page.read()))
+        chandere.core.scrape_html(offsets, "id", "4chan", self.html_queue,
+                                  self.data_queue, self.cache, debug=True)
+        self.assertTrue(self.data_queue.empty())
+
+    def test_replies_cached_under_thread(self):
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        with open("tests/example_page") as page:
+            self.html_queue.put((self.url, page.read()))
+        chandere.core.scrape_html(offsets, "ar", "4chan", self.html_queue,
+                                  self.data_queue, self.cache, debug=True)
+        self.assertEqual(self.data_queue.qsize(), 5)
+        self.assertEqual(self.cache.urls(), [self.url])
+        self.assertEqual(self.cache.remove_url(self.url), 5)
+
+    def test_refresh_parses_new_replies(self):
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        watermarks = chandere.core.Watermarks()
+        watermarks.update(self.url, [{"post_id": "55024083",
+                                      "parent_id": "55021750"}])
+        self.assertEqual(watermarks.get(self.url), 55024083)
+        with open("tests/example_page") as page:
+            self.html_queue.put((self.url, page.read()))
+        pages = chandere.core.parse_pages(offsets, self.html_queue,
+                                          watermarks=watermarks)
+        url, board, posts = next(pages)
+        pages.close()
+        self.assertEqual([post["post_id"] for post in posts],
+                         ["55021750", "55024126", "55024240"])
+        watermarks.update(url, posts)
+        self.assertEqual(watermarks.get(self.url), 55024240)
+
+    def test_unwritten_reply_handled_after_restart(self):
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        cache = chandere.core.load_cache("ar", "test_cache.txt")
+        cache.add(("/g/", "55021750", "4chan", self.url))
+        for post_id in ("55023789", "55024083"):
+            cache.add(("/g/", post_id, "4chan", self.url),
+                      pending=("/g/", post_id, "4chan"))
+        # Only the later reply was written before the run stopped.
+        cache.confirm(("/g/", "55024083", "4chan"))
+        cache.log.close()
+        cache = chandere.core.load_cache("ar", "test_cache.txt")
+        try:
+            with open("tests/example_page") as page:
+                self.html_queue.put((self.url, page.read()))
+            chandere.core.scrape_html(offsets, "ar", "4chan",
+                                      self.html_queue, self.data_queue,
+                                      cache, debug=True)
+        finally:
+            cache.log.close()
+            os.remove("test_cache.txt")
+        self.assertEqual([self.data_queue.get()[0] for _ in
+                          range(self.data_queue.qsize())],
+                         ["55023789", "55024126", "55024240"])
+
+    def test_filtered_files_not_queued(self):
+        offsets = chandere.core.create_offsets("id", "4chan")
+        with open("tests/example_page") as page:
+            self.html_queue.put((self.url, page.read()))
+        chandere.core.scrape_html(
+            offsets, "id", "4chan", self.html_queue, self.data_queue,
+            self.cache, debug=True,
+            media_filter=chandere.media.MediaFilter(max_size=1024 ** 2))
+        self.assertTrue(self.data_queue.empty())
+        self.assertTrue(("/g/", "55021750", "4chan") in self.cache)
+
+    def test_parse_workers(self):
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        with open("tests/example_page") as page:
+            self.html_queue.put((self.url, page.read()))
+        chandere.core.scrape_html(offsets, "ar", "4chan", self.html_queue,
+                                  self.data_queue, self.cache, debug=True,
+                                  parse_workers=2)
+        self.assertEqual(self.data_queue.qsize(), 5)
+        self.assertEqual(self.cache.urls(), [self.url])
+
+    def test_parse_order(self):
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        with open("tests/example_page") as page:
+            example = page.read()
+        urls = ["%s/%d" % (self.url, index) for index in range(6)]
+        for url in urls:
+            self.html_queue.put((url, example))
+        pages = chandere.core.parse_pages(offsets, self.html_queue, 2)
+        parsed = [next(pages) for url in urls]
+        pages.close()
+        self.assertEqual([page[0] for page in parsed], urls)
+        self.assertEqual(parsed[-1][1:], chandere.parsers.parse_html(
+            offsets, urls[-1], example))
+
+    def test_unparsable_page_skipped_by_workers(self):
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        with open("tests/example_page") as page:
+            example = page.read()
+        urls = ["%s/%d" % (self.url, index) for index in range(3)]
+        for url, page in zip(urls, (example, "<title>502</title>", example)):
+            self.html_queue.put((url, page))
+        pages = chandere.core.parse_pages(offsets, self.html_queue, 2)
+        parsed = [next(pages) for url in urls[::2]]
+        pages.close()
+        self.assertEqual([page[0] for page in parsed], urls[::2])
+        self.assertEqual(self.html_queue.unfinished_tasks, 2)
+
+    def test_patterns_profiled_in_workers(self):
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        with open("tests/example_page") as page:
+            self.html_queue.put((self.url, page.read()))
+        profiler = chandere.profiler.PatternProfiler()
+        pages = chandere.core.parse_pages(offsets, self.html_queue, 2,
+                                          profiler=profiler)
+        next(pages)
+        pages.close()
+        self.assertEqual(profiler.totals()["post_id"][1:], (1, 5))
+
+
+class JSONScraperTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = chandere.cache.Cache()
+        self.html_queue = queue.Queue()
+        self.data_queue = queue.Queue()
+
+    def scrape(self, mode, chan, url, fixture):
+        offsets = chandere.core.create_offsets(mode, chan, "json")
+        with open(fixture) as page:
+            self.html_queue.put((url, page.read()))
+        chandere.core.scrape_html(offsets, mode, chan, self.html_queue,
+                                  self.data_queue, self.cache, debug=True)
+
+    def test_find_images(self):
+        self.scrape("id", "4chan", "http://a.4cdn.org/g/thread/55021750.json",
+                    "tests/example_thread.json")
+        self.assertEqual(self.data_queue.get(),
+                         ("http://i.4cdn.org/g/1465635673193.jpg",
+                          "back.jpg", "yZh7C2n3vUiurll2u3lvlA==", 2998927))
+
+    def test_archive_posts(self):
+        self.scrape("ar", "4chan", "http://a.4cdn.org/g/thread/55021750.json",
+                    "tests/example_thread.json")
+        self.assertEqual(self.data_queue.get(),
+                         ("55021750", None, "Anonymous", "06/11/16(Sat)",
+                          "05:01:13", "back.jpg", "",
+                          "Best .cbr reader for android?", "/g/", "4chan"))
+        self.assertEqual(self.data_queue.get(),
+                         ("55023789", "55021750", "Anonymous",
+                          "06/11/16(Sat)", "08:39:19", None, "",
+                          "<a href=\"#p55021750\" class=\"quotelink\">"
+                          "&gt;&gt;55021750</a><br>Good album, honestly no "
+                          "idea on cbr readers though", "/g/", "4chan"))
+        self.assertEqual(self.cache.urls(),
+                         ["http://a.4cdn.org/g/thread/55021750.json"])
+
+    def test_unparsable_page_skipped(self):
+        offsets = chandere.core.create_offsets("ar", "4chan", "json")
+        with open("tests/example_thread.json") as page:
+            example = page.read()
+        for body in (example, "<title>502 Bad Gateway</title>", "{}",
+                     example.replace("55021750", "55021751")):
+            self.html_queue.put(("http://a.4cdn.org/g/thread/55021750.json",
+                                 body))
+        threading.Thread(target=chandere.core.scrape_html,
+                         args=(offsets, "ar", "4chan", self.html_queue,
+                               self.data_queue, self.cache),
+                         daemon=True).start()
+        self.assertTrue(chandere.core.join_queues([self.html_queue], 5))
+        self.assertTrue(("/g/", "55021751", "4chan") in self.cache)
+
+    def test_board_pages(self):
+        self.scrape("ar", "4chan", "http://a.4cdn.org/g/1.json",
+                    "tests/example_board.json")
+        self.assertEqual(self.data_queue.qsize(), 2)
+        self.assertTrue(("/g/", "51971506", "4chan") in self.cache)
+
+    def test_scheduler_updated(self):
+        url = "http://a.4cdn.org/g/thread/55021750.json"
+        scheduler = chandere.scheduler.Scheduler(0.05, min_interval=0.01,
+                                                 jitter=0)
+        scheduler.add(url)
+        scheduler.pop(0)
+        time.sleep(0.05)
+        scheduler.pop(1)
+        with open("tests/example_thread.json") as page:
+            thread = json.load(page)
+        self.html_queue.put((url, json.dumps(thread)))
+        chandere.core.scrape_html(chandere.core.create_offsets("ar", "4chan",
+                                                               "json"),
+                                  "ar", "4chan", self.html_queue,
+                                  self.data_queue, self.cache, debug=True,
+                                  scheduler=scheduler)
+        self.assertTrue(scheduler.polling_interval(url) < 0.05)
+        thread["posts"][0]["archived"] = 1
+        self.html_queue.put((url, json.dumps(thread)))
+        chandere.core.scrape_html(chandere.core.create_offsets("ar", "4chan",
+                                                               "json"),
+                                  "ar", "4chan", self.html_queue,
+                                  self.data_queue, self.cache, debug=True,
+                                  scheduler=scheduler)
+        self.assertFalse(url in scheduler)
+
+    def test_catalog(self):
+        scheduler = chandere.scheduler.Scheduler()
+        url = "http://a.4cdn.org/g/threads.json"
+        with open("tests/example_threads.json") as page:
+            self.html_queue.put((url, page.read()))
+        chandere.core.scrape_html(chandere.core.create_offsets("ar", "4chan",
+                                                               "json"),
+                                  "ar", "4chan", self.html_queue,
+                                  self.data_queue, self.cache, debug=True,
+                                  scheduler=scheduler)
+        self.assertEqual(sorted(scheduler.pop(0) for _ in range(3)),
+                         ["http://a.4cdn.org/g/thread/51971506.json",
+                          "http://a.4cdn.org/g/thread/55020188.json",
+                          "http://a.4cdn.org/g/thread/55021750.json"])
+        self.assertEqual(scheduler.pop(0), None)
+        self.assertTrue(self.data_queue.empty())
+
+    def test_changed_threads(self):
+        scheduler = chandere.scheduler.Scheduler()
+        url = "http://a.4cdn.org/g/threads.json"
+        offsets = chandere.core.create_offsets("ar", "4chan", "json")
+        with open("tests/example_threads.json") as page:
+            board, threads = chandere.parsers.parse_catalog(offsets, url,
+                                                            page.read())
+        catalogs = chandere.core.Catalogs()
+        self.assertEqual(chandere.core.handle_catalog(
+            url, board, threads, offsets, "4chan", catalogs), 3)
+        self.assertEqual(chandere.core.handle_catalog(
+            url, board, threads, offsets, "4chan", catalogs), 0)
+        threads[1]["replies"] += 1
+        self.assertEqual(chandere.core.handle_catalog(
+            url, board, threads[1:], offsets, "4chan", catalogs, scheduler), 1)
+        self.assertEqual(scheduler.pop(0),
+                         "http://a.4cdn.org/g/thread/55021750.json")
+        self.assertEqual(list(catalogs[url]), ["55021750", "55020188"])
+
+    def test_unscraped_threads_scheduled_again(self):
+        scheduler = chandere.scheduler.Scheduler()
+        url = "http://a.4cdn.org/g/threads.json"
+        offsets = chandere.core.create_offsets("ar", "4chan", "json")
+        with open("tests/example_threads.json") as page:
+            board, threads = chandere.parsers.parse_catalog(offsets, url,
+                                                            page.read())
+        catalogs = chandere.core.Catalogs()
+        self.assertEqual(chandere.core.handle_catalog(
+            url, board, threads, offsets, "4chan", catalogs, scheduler), 3)
+        # One thread is dropped before being fetched, and another scraped.
+        dropped = scheduler.pop(0)
+        scraped = scheduler.pop(0)
+        catalogs.scraped(scraped)
+        self.assertEqual(chandere.core.handle_catalog(
+            url, board, threads, offsets, "4chan", catalogs, scheduler), 2)
+        self.assertIn(dropped, scheduler)
+        self.assertNotIn(scraped, scheduler)
+        chandere.core.handle_catalog(url, board, threads[:1], offsets,
+                                     "4chan", catalogs, scheduler)
+        # Threads no longer listed are not waited for.
+        self.assertTrue(catalogs.unscraped(url) <=
+                        set([threads[0]["post_id"]]))
+
+    def test_catalogs_kept_between_runs(self):
+        scheduler = chandere.scheduler.Scheduler()
+        url = "http://a.4cdn.org/g/threads.json"
+        offsets = chandere.core.create_offsets("ar", "4chan", "json")
+        with open("tests/example_threads.json") as page:
+            board, threads = chandere.parsers.parse_catalog(offsets, url,
+                                                            page.read())
+        catalogs = chandere.core.Catalogs("test_cache.txt.catalogs")
+        self.assertEqual(chandere.core.handle_catalog(
+            url, board, threads, offsets, "4chan", catalogs, scheduler), 3)
+        for thread in threads[1:]:
+            catalogs.scraped("http://a.4cdn.org/g/thread/%s.json" %
+                             thread["post_id"])
+        catalogs.dump()
+        try:
+            # The thread never scraped is downloaded on the next run.
+            catalogs = chandere.core.Catalogs("test_cache.txt.catalogs")
+            self.assertEqual(chandere.core.handle_catalog(
+                url, board, threads, offsets, "4chan", catalogs), 1)
+        finally:
+            os.remove("test_cache.txt.catalogs")
+
+    def test_lainchan(self):
+        self.scrape("id", "lainchan", "http://lainchan.org/cyb/res/26278.json",
+                    "tests/example_lainchan_thread.json")
+        self.assertEqual(self.data_queue.get(),
+                         ("http://lainchan.org/cyb/src/1465635673193.png",
+                          "cyberia.png", "5/0+lyLnN4XHqU8jD6YzWg==", 147345))
+        self.assertTrue(("/cyb/", "26279", "lainchan") in self.cache)
+
+
+class MultiSiteTest(unittest.TestCase):
+    def setUp(self):
+        with open("tests/example_page", "rb") as page:
+            example = page.read()
+        self.servers = [start_server({"/g/thread/55021750": (200, {}, example)})
+                        for _ in range(2)]
+        self.cache = chandere.cache.Cache()
+        self.data_queue = queue.Queue()
+        self.scheduler = chandere.scheduler.Scheduler()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def test_sites_scraped_at_once(self):
+        for server in self.servers:
+            site = chandere.core.create_site("ar", server.url)
+            chandere.core.start_site(site, "ar", server.url, self.cache,
+                                     self.data_queue, self.scheduler,
+                                     named=True)
+            site["url_queue"].put(server.url + "/g/thread/55021750")
+        posts = [self.data_queue.get(timeout=5) for _ in range(10)]
+        self.assertEqual(set(post[-1] for post in posts),
+                         set(server.url for server in self.servers))
+        self.assertEqual(len(self.cache), 10)
+
+    def test_unknown_backend(self):
+        self.assertEqual(chandere.core.create_site("ar", "http://a.b", "json"),
+                         None)
+
+    def test_url_host(self):
+        self.assertEqual(chandere.core.url_host(
+            "http://a.4cdn.org/g/thread/55021750.json"), "a.4cdn.org")
+        self.assertEqual(chandere.core.url_host("http://127.0.0.1:8080"),
+                         "127.0.0.1:8080")
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server({"/g/1450659832892.png":
+                                    (200, {}, b"\x89PNG" * 256)},
+                                   delay=0.5)
+        self.data_queue = queue.Queue()
+        os.mkdir("test_downloads")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for filename in os.listdir("test_downloads"):
+            os.remove(os.path.join("test_downloads", filename))
+        os.rmdir("test_downloads")
+
+    def test_failed_download_not_confirmed(self):
+        cache = chandere.core.load_cache("id", "test_cache.txt")
+        for url in (self.server.url + "/g/1450659832892.png",
+                    self.server.url + "/g/missing.png"):
+            cache.add(("/g/", url[-8:], "4chan", url), pending=url)
+            self.data_queue.put((url, url[-8:], None, None))
+            chandere.core.download_files("test_downloads", self.data_queue,
+                                         True, cache=cache)
+        self.assertEqual(cache.unconfirmed(), 1)
+        cache.log.close()
+        self.assertEqual(len(chandere.core.load_cache("id", "test_cache.txt",
+                                                      False)), 1)
+        os.remove("test_cache.txt")
+
+    def test_claim_filename(self):
+        self.assertEqual(
+            chandere.core.claim_filename("test_downloads", "test.png"),
+            os.path.join("test_downloads", "test.png"))
+        self.assertEqual(
+            chandere.core.claim_filename("test_downloads", "test.png"),
+            os.path.join("test_downloads", "(copy)test.png"))
+        for filename in ("test.png", "(copy)test.png"):
+            chandere.core.release_filename(
+                os.path.join("test_downloads", filename))
+
+    def test_placeholder_reclaimed(self):
+        # An empty file left by an interrupted run is claimed again.
+        open("test_downloads/test.png", "w").close()
+        path = chandere.core.claim_filename("test_downloads", "test.png")
+        self.assertEqual(path, os.path.join("test_downloads", "test.png"))
+        self.assertEqual(
+            chandere.core.claim_filename("test_downloads", "test.png"),
+            os.path.join("test_downloads", "(copy)test.png"))
+        chandere.core.release_filename(path)
+        chandere.core.release_filename(
+            os.path.join("test_downloads", "(copy)test.png"))
+
+    def test_parallel_downloads(self):
+        for _ in range(4):
+            self.data_queue.put((self.server.url + "/g/1450659832892.png",
+                                 "test.png", None, None))
+        threading.Thread(target=chandere.core.write_to_disk,
+                         args=("id", "test_downloads", None, self.data_queue,
+                               False, 4),
+                         daemon=True).start()
+        start = time.time()
+        while len(os.listdir("test_downloads")) < 4 or any(
+                os.path.getsize(os.path.join("test_downloads", filename)) == 0
+                for filename in os.listdir("test_downloads")):
+            self.assertTrue(time.time() - start < 10)
+            time.sleep(0.01)
+        self.assertEqual(sorted(os.listdir("test_downloads")),
+                         ["(copy)(copy)(copy)test.png", "(copy)(copy)test.png",
+                          "(copy)test.png", "test.png"])
+        self.assertTrue(self.server.peak > 1)
+
+    def test_interrupted_download_resumed(self):
+        base = chandere.connection.BACKOFF_BASE
+        chandere.connection.BACKOFF_BASE = 0.01
+        self.server.delay = 0
+        self.server.drops["/g/1450659832892.png"] = 2
+        try:
+            self.data_queue.put((self.server.url + "/g/1450659832892.png",
+                                 "test.png", None, None))
+            chandere.core.write_to_disk("id", "test_downloads", None,
+                                        self.data_queue, debug=True)
+        finally:
+            chandere.connection.BACKOFF_BASE = base
+        self.assertEqual(os.listdir("test_downloads"), ["test.png"])
+        with open("test_downloads/test.png", "rb") as image:
+            self.assertEqual(image.read(), b"\x89PNG" * 256)
+        ranges = [headers.get("Range") for path, headers
+                  in self.server.requests]
+        self.assertEqual(ranges, [None, "bytes=512-", "bytes=768-"])
+
+    def test_part_resumed_across_runs(self):
+        self.server.delay = 0
+        url = self.server.url + "/g/1450659832892.png"
+        part = "test_downloads/test.png.%s.part" % hashlib.md5(
+            url.encode("utf-8")).hexdigest()[:8]
+        open("test_downloads/test.png", "w").close()
+        with open(part, "wb") as partial:
+            partial.write(b"\x89PNG" * 100)
+        open("test_downloads/test.png.0badf00d.part", "wb").close()
+        # Parts of other files starting with the same name are left alone.
+        open("test_downloads/test.png.png.0badf00d.part", "wb").close()
+        self.data_queue.put((url, "test.png", None, None))
+        chandere.core.write_to_disk("id", "test_downloads", None,
+                                    self.data_queue, debug=True)
+        self.assertEqual(sorted(os.listdir("test_downloads")),
+                         ["test.png", "test.png.png.0badf00d.part"])
+        with open("test_downloads/test.png", "rb") as image:
+            self.assertEqual(image.read(), b"\x89PNG" * 256)
+        self.assertEqual([headers.get("Range") for path, headers
+                          in self.server.requests], ["bytes=400-"])
+
+    def test_parts_kept_without_placeholder(self):
+        self.server.delay = 0
+        # Without a placeholder, nothing was left behind for this file.
+        open("test_downloads/test.png.0badf00d.part", "wb").close()
+        self.data_queue.put((self.server.url + "/g/1450659832892.png",
+                             "test.png", None, None))
+        chandere.core.write_to_disk("id", "test_downloads", None,
+                                    self.data_queue, debug=True)
+        self.assertEqual(sorted(os.listdir("test_downloads")),
+                         ["test.png", "test.png.0badf00d.part"])
+
+    def test_file_looked_up_for_filter(self):
+        self.server.delay = 0
+        url = self.server.url + "/g/1450659832892.png"
+        for max_size in (512, 1024):
+            self.data_queue.put((url, "test.png", None, None))
+            chandere.core.write_to_disk(
+                "id", "test_downloads", None, self.data_queue, debug=True,
+                media_filter=chandere.media.MediaFilter(max_size=max_size))
+        self.assertEqual([request[0] for request in self.server.requests],
+                         ["/g/1450659832892.png"] * 3)
+        self.assertEqual(os.listdir("test_downloads"), ["test.png"])
+
+    def test_failed_download(self):
+        self.data_queue.put((self.server.url + "/g/missing.png", "test.png",
+                             None, None))
+        chandere.core.write_to_disk("id", "test_downloads", None,
+                                    self.data_queue, debug=True)
+        self.assertEqual(os.listdir("test_downloads"), [])
+
+
+class MediaDeduplicationTest(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server({
+            "/g/1450659832892.png": (200, {}, b"\x89PNG" * 256),
+            "/3/1450659832893.png": (200, {}, b"\x89PNG" * 256)
+        })
+        self.data_queue = queue.Queue()
+        os.mkdir("test_downloads")
+        self.media = chandere.media.MediaIndex("test_media_index.txt")
+        self.md5 = base64.b64encode(
+            hashlib.md5(b"\x89PNG" * 256).digest()).decode()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.media.close()
+        os.remove("test_media_index.txt")
+        for filename in os.listdir("test_downloads"):
+            os.remove(os.path.join("test_downloads", filename))
+        os.rmdir("test_downloads")
+
+    def download(self, path, filename, md5=None):
+        self.data_queue.put((self.server.url + path, filename, md5, None))
+        chandere.core.write_to_disk("id", "test_downloads", None,
+                                    self.data_queue, debug=True,
+                                    media=self.media)
+
+    def test_known_digest_skipped(self):
+        self.download("/g/1450659832892.png", "first.png", self.md5)
+        self.download("/3/1450659832893.png", "second.png", self.md5)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertTrue(os.path.samefile("test_downloads/first.png",
+                                         "test_downloads/second.png"))
+
+    def test_duplicate_contents_linked(self):
+        self.download("/g/1450659832892.png", "first.png")
+        self.download("/3/1450659832893.png", "second.png")
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(os.path.samefile("test_downloads/first.png",
+                                         "test_downloads/second.png"))
+
+    def test_index_persists(self):
+        self.download("/g/1450659832892.png", "first.png")
+        digest = chandere.media.file_md5("test_downloads/first.png")
+        self.media.close()
+        self.media = chandere.media.MediaIndex("test_media_index.txt")
+        self.assertEqual(self.media.lookup(digest),
+                         os.path.abspath("test_downloads/first.png"))
+        os.remove("test_downloads/first.png")
+        self.assertEqual(self.media.lookup(digest), None)
 
 
 class WriteThreadTest(unittest.TestCase):
@@ -268,6 +1073,42 @@ class WriteThreadTest(unittest.TestCase):
                               "\n********************")
         os.remove("archive.txt")
 
+    def test_archived_posts_confirmed(self):
+        cache = chandere.core.load_cache("ar", "test_cache.txt")
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        with open("tests/example_page") as page:
+            posts = chandere.parsers.parse_html(offsets, None, page.read())[1]
+        chandere.core.handle_post(posts[0], "/g/", offsets, "ar", "4chan",
+                                  self.data_queue, cache)
+        # Nothing reaches the log until the post is written.
+        self.assertEqual(len(chandere.core.load_cache("ar", "test_cache.txt",
+                                                      False)), 0)
+        chandere.core.write_to_disk("ar", "./archive.txt", "w+",
+                                    self.data_queue, debug=True, cache=cache)
+        self.assertEqual(cache.unconfirmed(), 0)
+        self.assertEqual(len(chandere.core.load_cache("ar", "test_cache.txt",
+                                                      False)), 1)
+        cache.log.close()
+        os.remove("test_cache.txt")
+        os.remove("archive.txt")
+
+    def test_archive_batch(self):
+        for post_id in ("51971506", "51971507", "51971508"):
+            self.data_queue.put((post_id, None, "Anonymous", "12/20/15(Sun)",
+                                 "20:03:52", None, None, None, "/g/",
+                                 "4chan"))
+        threading.Thread(target=chandere.core.write_to_disk,
+                         args=("ar", "./archive.jsonl", "a+",
+                               self.data_queue, False),
+                         kwargs={"archive_format": "jsonl"},
+                         daemon=True).start()
+        start = time.time()
+        while not os.path.exists("archive.jsonl") or len(
+                open("archive.jsonl").readlines()) < 3:
+            self.assertTrue(time.time() - start < 10)
+            time.sleep(0.01)
+        os.remove("archive.jsonl")
+
 
 class CacheLoadTest(unittest.TestCase):
     def setUp(self):
@@ -288,5 +1129,92 @@ class CacheLoadTest(unittest.TestCase):
         os.remove("test_cache.txt")
 
 
+class PolledTest(unittest.TestCase):
+    def test_board_threads(self):
+        offsets = chandere.core.create_offsets("ar", "4chan")
+        prefix = chandere.core.board_prefix(offsets, "4chan", "/g/")
+        self.assertEqual(prefix, "http://boards.4chan.org/g/thread/")
+        hosts = {"boards.4chan.org": {"catalog": False}}
+        urls = ["http://boards.4chan.org/g/thread/51971506",
+                "http://boards.4chan.org/v/thread/51971507",
+                "http://lainchan.org/g/res/1"]
+        self.assertEqual([url for url in urls
+                          if chandere.core.polled(url, hosts)], urls[:2])
+        self.assertEqual([url for url in urls
+                          if chandere.core.polled(url, hosts, [prefix])],
+                         urls[:1])
+        self.assertEqual([url for url in urls
+                          if chandere.core.polled(url, hosts, [])], [])
+
+    def test_api_board_prefix(self):
+        offsets = chandere.core.create_offsets("ar", "lainchan", "json")
+        self.assertEqual(chandere.core.board_prefix(offsets, "lainchan",
+                                                    "/g/", True),
+                         "https://lainchan.org/g/res/")
+
+
+class ShutdownTest(unittest.TestCase):
+    def setUp(self):
+        self.sites = {"4chan": {"url_queue": queue.Queue(),
+                                "html_queue": queue.Queue()}}
+        self.data_queue = queue.Queue()
+
+    def test_queued_urls_dropped(self):
+        self.sites["4chan"]["url_queue"].put("http://boards.4chan.org/g/")
+        self.assertTrue(chandere.core.shut_down(self.sites, self.data_queue,
+                                                0.1))
+        self.assertTrue(self.sites["4chan"]["url_queue"].empty())
+
+    def test_pages_and_posts_drained(self):
+        html_queue = self.sites["4chan"]["html_queue"]
+        html_queue.put(("http://boards.4chan.org/g/", "<title></title>"))
+        self.data_queue.put(("55021750", ))
+
+        def work():
+            for pending in (html_queue, self.data_queue):
+                time.sleep(0.05)
+                pending.get()
+                pending.task_done()
+
+        threading.Thread(target=work, daemon=True).start()
+        self.assertTrue(chandere.core.shut_down(self.sites, self.data_queue,
+                                                1))
+        self.assertTrue(self.data_queue.empty())
+
+    def test_deadline(self):
+        self.data_queue.put(("55021750", ))
+        self.assertFalse(chandere.core.shut_down(self.sites, self.data_queue,
+                                                 0.1))
+        self.assertEqual(self.data_queue.unfinished_tasks, 1)
+
+    def test_hang_up_asks_for_checkpoint(self):
+        handlers = (signal.getsignal(signal.SIGTERM),
+                    signal.getsignal(signal.SIGHUP))
+        requests = {"checkpoint": False}
+        try:
+            chandere.core.handle_signals(requests)
+            os.kill(os.getpid(), signal.SIGHUP)
+            self.assertTrue(requests["checkpoint"])
+            self.assertRaises(KeyboardInterrupt, os.kill, os.getpid(),
+                              signal.SIGTERM)
+        finally:
+            signal.signal(signal.SIGTERM, handlers[0])
+            signal.signal(signal.SIGHUP, handlers[1])
+
+    def test_checkpoint(self):
+        cache = chandere.core.load_cache("ar", "test_cache.txt")
+        cache.add(("/g/", "55021750", "4chan",
+                   "http://boards.4chan.org/g/thread/55021750"))
+        checkpoints = chandere.metrics.METRICS.get(
+            "chandere_checkpoints_total")
+        chandere.core.checkpoint(cache)
+        self.assertEqual(chandere.metrics.METRICS.get(
+            "chandere_checkpoints_total"), checkpoints + 1)
+        self.assertEqual(len(chandere.core.load_cache("ar", "test_cache.txt",
+                                                      False)), 1)
+        cache.log.close()
+        os.remove("test_cache.txt")
+
+
 if __name__ == "__main__":
     unittest.main()
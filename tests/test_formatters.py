@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
-from chandere.formatters import separate_board_thread, parse_path
+from chandere.formatters import (separate_board_thread, separate_targets,
+                                 parse_dimensions, parse_path)
 import os
 import unittest
 
@@ -31,6 +32,21 @@ class FormattersTest(unittest.TestCase):
             separate_board_thread(["g 1234567890"]), [('/g/', '1234567890')])
         self.assertEqual(separate_board_thread(["/g/", "/3/"]), [('/g/', None), ('/3/', None)])
 
+    def test_separate_targets(self):
+        self.assertEqual(separate_targets(["/g/", "lainchan:/cyb/26278"],
+                                          "4chan"),
+                         [("4chan", "/g/", None),
+                          ("lainchan", "/cyb/", "26278")])
+        self.assertEqual(separate_targets(["http://krautchan.net:/c/"],
+                                          "4chan"),
+                         [("http://krautchan.net", "/c/", None)])
+
+    def test_parse_dimensions(self):
+        self.assertEqual(parse_dimensions("1920x1080"), (1920, 1080))
+        self.assertEqual(parse_dimensions(" 800X600"), (800, 600))
+        self.assertRaises(ValueError, parse_dimensions, "1920")
+        self.assertRaises(ValueError, parse_dimensions, "axb")
+
     def test_parse_directory_file(self):
         self.assertEqual(parse_path(".", "id"), (".", None))
         self.assertEqual(parse_path("./test_dir", "id"), ("./test_dir", None
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+import os
+import threading
+import time
+import unittest
+
+from chandere.media import VIDEO_TYPES, MediaFilter, MediaIndex, file_md5
+
+
+class MediaIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = MediaIndex("test_media_index.txt")
+        self.md5 = file_md5("tests/example_page")
+
+    def tearDown(self):
+        self.index.close()
+        os.remove("test_media_index.txt")
+
+    def test_file_md5(self):
+        self.assertEqual(len(self.md5), 24)
+        self.assertEqual(self.md5, file_md5("tests/example_page"))
+
+    def test_claim_waits_for_download(self):
+        self.assertEqual(self.index.claim(self.md5), None)
+        claimed = []
+        waiter = threading.Thread(
+            target=lambda: claimed.append(self.index.claim(self.md5)))
+        waiter.start()
+        time.sleep(0.1)
+        self.assertEqual(claimed, [])
+        self.index.record(self.md5, "tests/example_page")
+        self.index.release(self.md5)
+        waiter.join()
+        self.assertEqual(claimed, [os.path.abspath("tests/example_page")])
+
+    def test_failed_download_released(self):
+        self.assertEqual(self.index.claim(self.md5), None)
+        self.index.release(self.md5)
+        self.assertEqual(self.index.claim(self.md5), None)
+        self.index.release(self.md5)
+
+
+class MediaFilterTest(unittest.TestCase):
+    def test_types(self):
+        media_filter = MediaFilter(["PNG", ".gif", "video/*"])
+        self.assertTrue(media_filter.accepts("cyberia.png"))
+        self.assertTrue(media_filter.accepts("loop.GIF"))
+        self.assertTrue(media_filter.accepts("clip.webm"))
+        self.assertFalse(media_filter.accepts("back.jpg"))
+        self.assertTrue(MediaFilter(["image/*"]).accepts("1465635673193",
+                                                         mime="image/png"))
+
+    def test_excluded_types(self):
+        media_filter = MediaFilter(exclude=VIDEO_TYPES)
+        self.assertFalse(media_filter.accepts("clip.webm"))
+        self.assertFalse(media_filter.accepts("clip.mp4"))
+        self.assertTrue(media_filter.accepts("back.jpg"))
+        self.assertFalse(media_filter.accepts(
+            "1465635673193", mime="video/webm; codecs=vp9"))
+
+    def test_size(self):
+        media_filter = MediaFilter(min_size=1024, max_size=2 * 1024 ** 2)
+        self.assertTrue(media_filter.accepts("back.jpg", 147345))
+        self.assertFalse(media_filter.accepts("back.jpg", 2998927))
+        self.assertFalse(media_filter.accepts("back.jpg", 512))
+        self.assertTrue(media_filter.accepts("back.jpg"))
+        self.assertTrue(media_filter.needs_size(None))
+        self.assertFalse(media_filter.needs_size(147345))
+        self.assertFalse(MediaFilter().needs_size(None))
+
+    def test_dimensions(self):
+        media_filter = MediaFilter(min_dimensions=(800, 600),
+                                   max_dimensions=(1920, 1080))
+        self.assertTrue(media_filter.accepts("back.jpg", None, (1280, 720)))
+        self.assertFalse(media_filter.accepts("back.jpg", None, (715, 1000)))
+        self.assertFalse(media_filter.accepts("back.jpg", None, (3461, 3110)))
+        self.assertTrue(MediaFilter(min_dimensions=(800, 600)).accepts(
+            "back.jpg", None, (3461, 3110)))
+
+
+if __name__ == "__main__":
+    unittest.main()
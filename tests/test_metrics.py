@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+import os
+import unittest
+
+from chandere.metrics import Metrics, serve, write_stats
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_counters(self):
+        self.metrics.count("chandere_pages_fetched_total")
+        self.metrics.count("chandere_fetched_bytes_total", 2048)
+        self.metrics.count("chandere_fetched_bytes_total", 1024)
+        self.assertEqual(self.metrics.get("chandere_fetched_bytes_total"),
+                         3072)
+        self.assertEqual(self.metrics.render(),
+                         "# TYPE chandere_fetched_bytes_total counter\n"
+                         "chandere_fetched_bytes_total 3072\n"
+                         "# TYPE chandere_pages_fetched_total counter\n"
+                         "chandere_pages_fetched_total 1\n")
+
+    def test_histogram(self):
+        for value in (0.003, 0.02, 0.02, 30):
+            self.metrics.observe("chandere_fetch_seconds", value)
+        lines = self.metrics.render().splitlines()
+        self.assertEqual(lines[0], "# TYPE chandere_fetch_seconds histogram")
+        self.assertTrue("chandere_fetch_seconds_bucket{le=\"0.001\"} 0" in
+                        lines)
+        self.assertTrue("chandere_fetch_seconds_bucket{le=\"0.005\"} 1" in
+                        lines)
+        self.assertTrue("chandere_fetch_seconds_bucket{le=\"0.025\"} 3" in
+                        lines)
+        self.assertTrue("chandere_fetch_seconds_bucket{le=\"10\"} 3" in lines)
+        self.assertTrue("chandere_fetch_seconds_bucket{le=\"+Inf\"} 4" in
+                        lines)
+        self.assertEqual(lines[-1], "chandere_fetch_seconds_count 4")
+
+    def test_gauges(self):
+        depths = {"url": 3, "html": 1}
+        for name in depths:
+            self.metrics.gauge("chandere_queue_depth{queue=\"%s\"}" % name,
+                               lambda name=name: depths[name])
+        depths["html"] = 2
+        self.assertEqual(self.metrics.render(),
+                         "# TYPE chandere_queue_depth gauge\n"
+                         "chandere_queue_depth{queue=\"html\"} 2\n"
+                         "chandere_queue_depth{queue=\"url\"} 3\n")
+
+
+class ExpositionTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.metrics.count("chandere_posts_new_total", 5)
+
+    def test_stats_file(self):
+        write_stats("stats.prom", self.metrics)
+        with open("stats.prom") as stats:
+            self.assertTrue("chandere_posts_new_total 5\n" in stats.read())
+        self.assertFalse(os.path.exists("stats.prom.tmp"))
+        os.remove("stats.prom")
+
+    def test_server(self):
+        server = serve(0, metrics=self.metrics)
+        try:
+            response = urlopen("http://127.0.0.1:%d/metrics" %
+                               server.server_address[1])
+            self.assertTrue(b"chandere_posts_new_total 5\n" in
+                            response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
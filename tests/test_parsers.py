@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+import unittest
+
+from chandere.core import create_offsets
+from chandere.parsers import (HTML_FIELDS, parse_catalog, parse_html,
+                              parse_json, select_parser, time_patterns)
+
+
+class HTMLParserTest(unittest.TestCase):
+    def setUp(self):
+        with open("tests/example_page") as page:
+            self.page = page.read()
+        self.url = "http://boards.4chan.org/g/thread/55021750"
+
+    def test_thread_page(self):
+        board, posts = parse_html(create_offsets("ar", "4chan"), self.url,
+                                  self.page)
+        self.assertEqual(board, "/g/")
+        self.assertEqual([post["post_id"] for post in posts],
+                         ["55021750", "55023789", "55024083", "55024126",
+                          "55024240"])
+        self.assertEqual([post["parent_id"] for post in posts],
+                         [None] + ["55021750"] * 4)
+        self.assertEqual(posts[3]["body"], "Perfect viewer")
+        self.assertEqual(posts[3]["filename"], None)
+
+    def test_matches_offsets(self):
+        for mode in ("ar", "id"):
+            offsets = create_offsets(mode, "4chan")
+            posts = parse_html(offsets, self.url, self.page)[1]
+            originals = (offsets["post_op"].findall(self.page) +
+                         offsets["post_reply"].findall(self.page))
+            self.assertEqual(len(posts), len(originals))
+            for post, original in zip(posts, originals):
+                self.assertEqual(
+                    post["post_id"],
+                    offsets["post_id"].search(original).group())
+                for offset, field in HTML_FIELDS:
+                    if offset in offsets and field not in (
+                            "file_url", "file_size", "dimensions"):
+                        match = offsets[offset].search(original)
+                        self.assertEqual(post[field],
+                                         match.group() if match else None)
+
+    def test_board_page(self):
+        page = self.page.replace("Return</a>", "")
+        board, posts = parse_html(create_offsets("ar", "4chan"), self.url,
+                                  page)
+        self.assertEqual([post["post_id"] for post in posts], ["55021750"])
+
+    def test_mode_fields(self):
+        board, posts = parse_html(create_offsets("id", "4chan"), self.url,
+                                  self.page)
+        self.assertEqual(posts[0]["file_url"],
+                         "http://i.4cdn.org/g/1465635673193.jpg")
+        self.assertEqual(posts[0]["filename"], "back.jpg")
+        self.assertEqual(posts[0]["file_size"], 2998927)
+        self.assertEqual(posts[0]["dimensions"], (3461, 3110))
+        self.assertEqual(posts[0]["name"], None)
+
+    def test_after_last_reply(self):
+        board, posts = parse_html(create_offsets("ar", "4chan"), self.url,
+                                  self.page, after=55024083)
+        self.assertEqual([post["post_id"] for post in posts],
+                         ["55021750", "55024126", "55024240"])
+        self.assertEqual(posts[1]["parent_id"], "55021750")
+        # The last reply seen may have been deleted since, in which case the
+        # whole page is parsed and filtered instead.
+        board, posts = parse_html(create_offsets("ar", "4chan"), self.url,
+                                  self.page, after=55024100)
+        self.assertEqual([post["post_id"] for post in posts],
+                         ["55021750", "55024126", "55024240"])
+
+    def test_time_patterns(self):
+        timings = time_patterns(create_offsets("ar", "4chan"), self.page)
+        matches = dict((offset, count) for offset, seconds, count in timings)
+        self.assertEqual(matches["board_initial"], 1)
+        self.assertEqual(matches["post_split"], 5)
+        self.assertNotIn("post_op", matches)
+        self.assertEqual(matches["post_id"], 5)
+        self.assertEqual(matches["post_body"], 5)
+        self.assertEqual(matches["file_name"], 1)
+        self.assertTrue(all(seconds >= 0 for offset, seconds, count
+                            in timings))
+        self.assertEqual(time_patterns(create_offsets("ar", "4chan", "json"),
+                                       self.page), [])
+
+
+class JSONParserTest(unittest.TestCase):
+    def test_thread_document(self):
+        with open("tests/example_thread.json") as page:
+            board, posts = parse_json(
+                create_offsets("ar", "4chan", "json"),
+                "http://a.4cdn.org/g/thread/55021750.json", page.read())
+        self.assertEqual(board, "/g/")
+        self.assertEqual(len(posts), 5)
+        self.assertEqual(posts[2]["body"], "I use Comicat because it just "
+                         "werks I guess. I&#039;m not an avid user though.")
+        self.assertEqual(posts[2]["parent_id"], "55021750")
+        self.assertEqual(posts[0]["file_size"], 2998927)
+        self.assertEqual(posts[0]["dimensions"], (3461, 3110))
+        self.assertEqual(posts[2]["dimensions"], None)
+
+    def test_thread_document_after_last_reply(self):
+        with open("tests/example_thread.json") as page:
+            board, posts = parse_json(
+                create_offsets("ar", "4chan", "json"),
+                "http://a.4cdn.org/g/thread/55021750.json", page.read(),
+                after=55023789)
+        self.assertEqual([post["post_id"] for post in posts],
+                         ["55021750", "55024083", "55024126", "55024240"])
+
+    def test_matches_html_parser(self):
+        with open("tests/example_thread.json") as page:
+            json_posts = parse_json(
+                create_offsets("ar", "4chan", "json"),
+                "http://a.4cdn.org/g/thread/55021750.json", page.read())[1]
+        with open("tests/example_page") as page:
+            html_posts = parse_html(
+                create_offsets("ar", "4chan"),
+                "http://boards.4chan.org/g/thread/55021750", page.read())[1]
+        for field in ("post_id", "parent_id", "name", "date", "time",
+                      "filename"):
+            self.assertEqual([post[field] for post in json_posts],
+                             [post[field] for post in html_posts])
+
+    def test_board_document(self):
+        with open("tests/example_board.json") as page:
+            board, posts = parse_json(create_offsets("id", "4chan", "json"),
+                                      "http://a.4cdn.org/g/1.json",
+                                      page.read())
+        self.assertEqual([post["post_id"] for post in posts],
+                         ["51971506", "55021750"])
+        self.assertEqual(posts[0]["title"], "The /g/ Wiki")
+
+    def test_catalog_document(self):
+        offsets = create_offsets("ar", "4chan", "json")
+        url = "http://a.4cdn.org/g/threads.json"
+        self.assertTrue(select_parser(offsets, url) is parse_catalog)
+        self.assertTrue(select_parser(offsets, "http://a.4cdn.org/g/1.json")
+                        is parse_json)
+        with open("tests/example_threads.json") as page:
+            board, threads = parse_catalog(offsets, url, page.read())
+        self.assertEqual(board, "/g/")
+        self.assertEqual(threads[1], {"post_id": "55021750",
+                                      "last_modified": 1465651336,
+                                      "replies": 4})
+        self.assertEqual(len(threads), 3)
+
+    def test_vichan_document(self):
+        with open("tests/example_lainchan_thread.json") as page:
+            board, posts = parse_json(
+                create_offsets("ar", "lainchan", "json"),
+                "http://lainchan.org/cyb/res/26278.json", page.read())
+        self.assertEqual(board, "/cyb/")
+        self.assertEqual((posts[1]["date"], posts[1]["time"]),
+                         ("2016-06-11", "12:39:19"))
+        self.assertEqual(posts[1]["filename"], None)
+
+
+if __name__ == "__main__":
+    unittest.main()
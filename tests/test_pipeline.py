@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import threading
+import time
+import unittest
+
+from chandere.pipeline import BoundedQueue, page_size
+
+
+class BoundedQueueTest(unittest.TestCase):
+    def test_item_limit(self):
+        bounded = BoundedQueue(2)
+        bounded.put("a")
+        bounded.put("b")
+        self.assertRaises(queue.Full, bounded.put, "c", False)
+        self.assertRaises(queue.Full, bounded.put, "c", True, 0.05)
+        self.assertTrue(bounded.stats()["blocked"] >= 0.05)
+
+    def test_byte_limit(self):
+        bounded = BoundedQueue(max_bytes=10, sizeof=page_size)
+        bounded.put(("/g/1", "x" * 6))
+        self.assertRaises(queue.Full, bounded.put, ("/g/2", "x" * 6), False)
+        bounded.put(("/g/3", "x" * 4))
+        self.assertEqual(bounded.stats()["bytes"], 10)
+        self.assertEqual(bounded.get(), ("/g/1", "x" * 6))
+        self.assertEqual(bounded.stats()["bytes"], 4)
+
+    def test_oversized_item(self):
+        bounded = BoundedQueue(max_bytes=10, sizeof=page_size)
+        bounded.put(("/g/1", "x" * 20), False)
+        self.assertRaises(queue.Full, bounded.put, ("/g/2", "x"), False)
+
+    def test_backpressure(self):
+        bounded = BoundedQueue(max_bytes=10, sizeof=page_size)
+        bounded.put(("/g/1", "x" * 8))
+        putter = threading.Thread(target=bounded.put,
+                                  args=(("/g/2", "x" * 8), ))
+        putter.start()
+        time.sleep(0.1)
+        self.assertEqual(bounded.stats()["depth"], 1)
+        bounded.get()
+        putter.join(1)
+        self.assertFalse(putter.is_alive())
+        stats = bounded.stats()
+        self.assertEqual((stats["depth"], stats["bytes"], stats["peak"]),
+                         (1, 8, 1))
+        self.assertTrue(stats["blocked"] >= 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+
+import unittest
+
+import chandere.core
+from chandere.metrics import Metrics
+from chandere.profiler import PatternProfiler
+
+URL = "http://boards.4chan.org/g/thread/55021750"
+
+
+class PatternProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.profiler = PatternProfiler(0.5, 2, self.metrics)
+
+    def test_budget(self):
+        with self.assertLogs(level="WARNING") as logs:
+            self.profiler.record(URL, 1000, [("post_op", 0.1, 1),
+                                             ("post_body", 0.75, 5)])
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("\"post_body\" took 0.750 seconds", logs.output[0])
+        self.assertIn("1000 bytes, 5 matches", logs.output[0])
+        self.assertEqual(
+            self.metrics.get("chandere_pattern_budget_exceeded_total"), 1)
+        self.assertEqual(self.metrics.get(
+            "chandere_pattern_seconds_total{offset=\"post_op\"}"), 0.1)
+
+    def test_slowest(self):
+        self.profiler.record(URL, 1000, [("post_split", 0.45, 5),
+                                         ("post_id", 0.2, 5)])
+        self.profiler.record(URL + "/2", 2000, [("post_split", 0.6, 5),
+                                                ("post_id", 0.05, 5)])
+        self.assertEqual(self.profiler.slowest(),
+                         [(0.6, "post_split", URL + "/2", 2000, 5),
+                          (0.45, "post_split", URL, 1000, 5)])
+        totals = self.profiler.totals()
+        self.assertAlmostEqual(totals["post_split"][0], 1.05)
+        self.assertEqual(totals["post_split"][1:], (2, 10))
+        with self.assertLogs(level="INFO") as logs:
+            self.profiler.report()
+        # Only the offset and the run over the budget are warned about.
+        self.assertEqual([record.levelname for record in logs.records],
+                         ["WARNING", "INFO", "WARNING", "INFO"])
+
+    def test_profile_page(self):
+        with open("tests/example_page") as page:
+            self.profiler.profile(chandere.core.create_offsets("id", "4chan"),
+                                  URL, page.read())
+        totals = self.profiler.totals()
+        self.assertEqual(totals["post_split"][1:], (1, 5))
+        self.assertEqual(totals["file_md5"][1:], (1, 1))
+        self.assertNotIn("post_body", totals)
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+import unittest
+
+import chandere.core
+from chandere.profiles import FOURCHAN_PATTERNS, PROFILES, Registry
+
+PROFILE = {
+    "host": "example.org",
+    "max_page": 5,
+    "page_delimiter": "",
+    "thread_delimiter": "res/",
+    "patterns": FOURCHAN_PATTERNS
+}
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.register("example", PROFILE)
+
+    def test_offsets_compiled_once(self):
+        offsets = self.registry.offsets("ar", "example")
+        self.assertEqual(offsets["thread_delimiter"], "res/")
+        self.assertEqual(offsets["reply_marker"],
+                         FOURCHAN_PATTERNS["reply_marker"])
+        offsets["max_page"] = 1
+        again = self.registry.offsets("ar", "example")
+        self.assertEqual(again["max_page"], 5)
+        self.assertIs(again["post_split"], offsets["post_split"])
+
+    def test_mode_fields(self):
+        self.assertNotIn("file_md5", self.registry.offsets("ar", "example"))
+        self.assertNotIn("post_body", self.registry.offsets("id", "example"))
+        self.assertEqual(self.registry.offsets("tc", "example"),
+                         {"max_page": 5, "page_delimiter": "",
+                          "thread_delimiter": "res/"})
+
+    def test_generic(self):
+        offsets = self.registry.offsets("id", "http://example.net")
+        self.assertEqual(offsets["max_page"], None)
+        self.assertEqual(offsets["link_prefix"], "http:")
+        self.assertNotIn("http://example.net", self.registry)
+
+    def test_json_backend(self):
+        self.assertNotIn("backend", self.registry.offsets("ar", "example",
+                                                          "json"))
+        offsets = PROFILES.offsets("ar", "4chan", "json")
+        self.assertEqual(offsets["backend"], "json")
+        self.assertEqual(offsets["api_host"], "a.4cdn.org")
+
+    def test_invalid_profiles(self):
+        self.assertRaises(ValueError, self.registry.register, "broken",
+                          {"host": "example.org"})
+        self.assertRaises(ValueError, self.registry.register, "broken",
+                          dict(PROFILE, patterns={"post_id": r'\d+'}))
+        self.assertRaises(ValueError, self.registry.register, "broken",
+                          dict(PROFILE, patterns=dict(FOURCHAN_PATTERNS,
+                                                      post_likes=r'\d+')))
+        self.registry.register("broken", dict(PROFILE, patterns=dict(
+            FOURCHAN_PATTERNS, post_body=r'(?<=body">.+')))
+        self.assertRaises(ValueError, self.registry.offsets, "ar", "broken")
+        # Patterns a mode doesn't read are never compiled.
+        self.assertEqual(self.registry.offsets("tc", "broken")["max_page"], 5)
+
+    def test_known_chans(self):
+        self.assertEqual(list(self.registry), ["example"])
+        self.assertEqual(self.registry.hosts(), {"example": "example.org"})
+        self.assertEqual(chandere.core.KNOWN_CHANS, PROFILES.hosts())
+        self.assertEqual(sorted(chandere.core.API_CHANS), ["4chan",
+                                                           "lainchan"])
+        self.assertEqual(chandere.core.create_offsets("tc", "4chan"),
+                         {"max_page": 10, "page_delimiter": "",
+                          "thread_delimiter": "thread/"})
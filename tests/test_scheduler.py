@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+import time
+import unittest
+
+import chandere.scheduler
+from chandere.scheduler import Scheduler
+from tests.clock import FakeClock
+
+URL = "http://a.4cdn.org/g/thread/51971506.json"
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(0.05, 0.4, min_interval=0.01, jitter=0)
+
+    def poll(self, new_posts):
+        self.assertEqual(self.scheduler.pop(1), URL)
+        self.scheduler.update(URL, new_posts)
+        return self.scheduler.polling_interval(URL)
+
+    def test_spread(self):
+        clock = FakeClock()
+        chandere.scheduler.time = clock
+        try:
+            self.scheduler = Scheduler(1, jitter=0)
+            urls = ["http://a.4cdn.org/g/%d.json" % page for page in range(4)]
+            self.assertEqual(self.scheduler.extend(urls, 0.3), 4)
+            self.assertEqual(self.scheduler.pop(0), urls[0])
+            for url in urls[1:]:
+                self.assertEqual(self.scheduler.pop(0), None)
+                clock.advance(0.08)
+                self.assertEqual(self.scheduler.pop(0), url)
+        finally:
+            chandere.scheduler.time = time
+
+    def test_quiet_page_backs_off(self):
+        self.scheduler.add(URL)
+        self.assertEqual(self.poll(0), 0.05)
+        self.assertAlmostEqual(self.poll(0), 0.1, places=2)
+        self.assertAlmostEqual(self.poll(0), 0.2, places=2)
+        self.assertEqual(self.poll(0), 0.4)
+
+    def test_busy_page_polled_often(self):
+        self.scheduler.add(URL)
+        self.poll(0)
+        self.assertEqual(self.poll(100), 0.01)
+
+    def test_retire(self):
+        self.scheduler.add(URL)
+        self.assertTrue(self.scheduler.retire(URL))
+        self.assertFalse(self.scheduler.add(URL))
+        self.assertEqual(self.scheduler.pop(0.1), None)
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_once(self):
+        self.scheduler.add(URL, once=True)
+        self.assertEqual(self.scheduler.pop(0), URL)
+        self.assertFalse(URL in self.scheduler)
+        self.assertEqual(self.scheduler.pop(0.1), None)
+        self.assertTrue(self.scheduler.add(URL))
+
+    def test_postpone(self):
+        self.scheduler.add(URL)
+        self.scheduler.postpone(URL, 0.2)
+        self.assertEqual(self.scheduler.pop(0.1), None)
+        self.assertEqual(self.scheduler.pop(0.2), URL)
+
+    def test_postpone_once(self):
+        self.scheduler.add(URL, once=True)
+        self.assertEqual(self.scheduler.pop(0), URL)
+        # The page is forgotten as it is popped, and has to be added again.
+        self.assertFalse(self.scheduler.postpone(URL, 0.1))
+        self.assertTrue(self.scheduler.add(URL, 0.1, once=True))
+        self.assertEqual(self.scheduler.pop(0), None)
+        self.assertEqual(self.scheduler.pop(1), URL)
+
+    def test_known_pages_not_added(self):
+        self.assertTrue(self.scheduler.add(URL))
+        self.assertFalse(self.scheduler.add(URL))
+        self.assertEqual(self.scheduler.extend([URL]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
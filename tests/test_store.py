@@ -0,0 +1,51 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import unittest
+
+from chandere.store import PageStore
+
+URL = "http://boards.4chan.org/g/thread/55021750"
+
+
+class PageStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = PageStore("test_pages")
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree("test_pages")
+
+    def test_versions(self):
+        self.store.record(URL, {"ETag": "\"1\""}, b"<title>1</title>", 1.5)
+        self.store.record("http://boards.4chan.org/g/", {}, b"board", 2.5)
+        self.store.record(URL, {}, b"<title>2</title>", 3.5)
+        self.assertEqual(len(self.store), 3)
+        self.assertIn(URL, self.store)
+        self.assertNotIn("http://boards.4chan.org/v/", self.store)
+        self.assertEqual(self.store.urls(),
+                         [URL, "http://boards.4chan.org/g/"])
+        self.assertEqual(self.store.versions(URL),
+                         [(1.5, {"ETag": "\"1\""}, b"<title>1</title>"),
+                          (3.5, {}, b"<title>2</title>")])
+
+    def test_reopen(self):
+        self.store.record(URL, {}, b"<title>1</title>", 1.5)
+        self.store.close()
+        self.store = PageStore("test_pages")
+        self.store.record(URL, {}, b"<title>2</title>", 2.5)
+        self.assertEqual([body for _, _, body in self.store.versions(URL)],
+                         [b"<title>1</title>", b"<title>2</title>"])
+
+    def test_segments(self):
+        self.store.close()
+        self.store = PageStore("test_pages", segment_size=64)
+        for number in range(3):
+            self.store.record(URL + "/%d" % number, {}, b"x" * 100, number)
+        self.assertEqual(len([name for name in os.listdir("test_pages")
+                              if name.startswith("pages-")]), 3)
+        self.assertEqual([(url, timestamp) for url, timestamp, _, _
+                          in self.store.pages()],
+                         [(URL + "/%d" % number, number)
+                          for number in range(3)])